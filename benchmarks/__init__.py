@@ -0,0 +1,4 @@
+"""Throughput and memory benchmarks for the PDF hot paths.
+
+Run ``python -m benchmarks.run --help`` for usage.
+"""
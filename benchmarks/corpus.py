@@ -0,0 +1,165 @@
+"""Synthetic PDF corpus used by the benchmarks.
+
+Each corpus is a directory of PDFs shaped like one of our real workloads:
+
+  many_small   lots of 1-2 page letters generated from one template
+  few_huge     a couple of long text documents
+  image_scans  pages that are one large raster image each (scanner output)
+  mixed_sizes  A4 / Letter / A3 / landscape pages in the same batch
+  templated    letters from one template that each embed the same font and logo
+
+Generation is deterministic for a given scale so results are comparable
+between runs. Files are cached on disk and only rebuilt when missing.
+"""
+from __future__ import annotations
+
+import io
+import json
+import random
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from reportlab.lib.pagesizes import A3, A4, landscape, letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+CORPORA = ("many_small", "few_huge", "image_scans", "mixed_sizes", "templated")
+
+_LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud "
+    "exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat."
+)
+
+
+def _text_page(c: canvas.Canvas, rng: random.Random, page_no: int) -> None:
+    width, height = c._pagesize
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(72, height - 72, f"Document page {page_no}")
+    c.setFont("Helvetica", 10)
+    y = height - 100
+    while y > 72:
+        start = rng.randrange(0, len(_LOREM) - 80)
+        c.drawString(72, y, _LOREM[start:start + 80])
+        y -= 14
+    c.showPage()
+
+
+def _write_text_pdf(path: Path, pages: int, seed: int, pagesize=A4) -> None:
+    rng = random.Random(seed)
+    c = canvas.Canvas(str(path), pagesize=pagesize)
+    for i in range(pages):
+        _text_page(c, rng, i + 1)
+    c.save()
+
+
+def _scan_image(rng: random.Random, width: int, height: int):
+    from PIL import Image, ImageDraw
+
+    img = Image.new("L", (width, height), 245)
+    draw = ImageDraw.Draw(img)
+    # text-like strokes plus speckle noise, roughly what a 300 dpi scan looks like
+    for y in range(80, height - 80, 40):
+        x = 80
+        while x < width - 200:
+            w = rng.randrange(20, 120)
+            draw.rectangle((x, y, x + w, y + 18), fill=rng.randrange(10, 60))
+            x += w + rng.randrange(10, 30)
+    for _ in range(width * height // 400):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randrange(0, 255))
+    return img.convert("RGB")
+
+
+def _write_scan_pdf(path: Path, pages: int, seed: int, px_width: int) -> None:
+    rng = random.Random(seed)
+    px_height = int(px_width * 297 / 210)
+    c = canvas.Canvas(str(path), pagesize=A4)
+    for _ in range(pages):
+        img = _scan_image(rng, px_width, px_height)
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        buf.seek(0)
+        c.drawImage(ImageReader(buf), 0, 0, width=A4[0], height=A4[1])
+        c.showPage()
+    c.save()
+
+
+def _build_many_small(root: Path, scale: float) -> None:
+    for i in range(max(2, int(200 * scale))):
+        _write_text_pdf(root / f"letter_{i:04d}.pdf", pages=1 + i % 2, seed=i)
+
+
+def _build_few_huge(root: Path, scale: float) -> None:
+    for i in range(2):
+        _write_text_pdf(root / f"huge_{i}.pdf", pages=max(2, int(1000 * scale)), seed=1000 + i)
+
+
+def _build_image_scans(root: Path, scale: float) -> None:
+    px_width = 2480 if scale >= 1 else max(400, int(2480 * scale))
+    for i in range(max(1, int(8 * scale))):
+        _write_scan_pdf(root / f"scan_{i:03d}.pdf", pages=2, seed=2000 + i, px_width=px_width)
+
+
+def _build_mixed_sizes(root: Path, scale: float) -> None:
+    sizes = [A4, letter, A3, landscape(A4), landscape(letter)]
+    for i in range(max(len(sizes), int(40 * scale))):
+        _write_text_pdf(root / f"mixed_{i:03d}.pdf", pages=2, seed=3000 + i, pagesize=sizes[i % len(sizes)])
+
+
+def _build_templated(root: Path, scale: float) -> None:
+    import os
+
+    import reportlab
+    from PIL import Image
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    # an embedded TrueType font plus a logo: every letter carries its own copy
+    font_path = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+    pdfmetrics.registerFont(TTFont("BenchVera", font_path))
+    rng = random.Random(4000)
+    logo = Image.new("RGB", (300, 120), (255, 255, 255))
+    logo.putdata([(rng.randrange(256), 40, 120) for _ in range(300 * 120)])
+    logo_buf = io.BytesIO()
+    logo.save(logo_buf, format="PNG")
+    for i in range(max(2, int(200 * scale))):
+        logo_buf.seek(0)
+        c = canvas.Canvas(str(root / f"templated_{i:04d}.pdf"), pagesize=A4)
+        c.drawImage(ImageReader(logo_buf), 72, A4[1] - 150, width=150, height=60)
+        c.setFont("BenchVera", 11)
+        y = A4[1] - 200
+        for line in (f"Dear customer {i},", _LOREM[:80], _LOREM[80:160], "Kind regards"):
+            c.drawString(72, y, line)
+            y -= 16
+        c.showPage()
+        c.save()
+
+
+_BUILDERS: Dict[str, Callable[[Path, float], None]] = {
+    "many_small": _build_many_small,
+    "few_huge": _build_few_huge,
+    "image_scans": _build_image_scans,
+    "mixed_sizes": _build_mixed_sizes,
+    "templated": _build_templated,
+}
+
+
+def ensure_corpus(base_dir: Path, name: str, scale: float = 1.0) -> List[str]:
+    """Build corpus `name` under `base_dir` (if needed) and return its sorted PDF paths."""
+    if name not in _BUILDERS:
+        raise ValueError(f"Unknown corpus: {name}")
+    root = Path(base_dir) / f"{name}-x{scale:g}"
+    marker = root / "corpus.json"
+    if not marker.exists():
+        root.mkdir(parents=True, exist_ok=True)
+        for old in root.glob("*.pdf"):
+            old.unlink()
+        _BUILDERS[name](root, scale)
+        files = sorted(root.glob("*.pdf"))
+        marker.write_text(json.dumps({
+            "name": name,
+            "scale": scale,
+            "files": len(files),
+            "bytes": sum(f.stat().st_size for f in files),
+        }))
+    return sorted(str(p) for p in root.glob("*.pdf"))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Measure startup cost of loading .env.encrypted across KDF settings.
+
+Usage examples:
+  python -m benchmarks.kdf
+  python -m benchmarks.kdf --scrypt 14 --scrypt 17 --pbkdf2 600000 --json kdf.json
+
+For each setting a sample .env.encrypted is written and loaded in fresh
+interpreters, the way a server process or worker would at startup:
+
+  cold     only ENV_PASSWORD is set, so the key is derived (the master process)
+  cached   the key is handed over on an inherited fd (ENV_KEY_FD), as to a
+           re-exec'd worker; forked workers share it without any cost
+
+The legacy format (single SHA-256, no salt) is included as the baseline.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+PASSWORD = "benchmark-password"
+SAMPLE_ENV = b"".join(f"SECRET_{i}=value-{i:04d}\n".encode() for i in range(50))
+
+
+def _child(path: str) -> dict:
+    """Runs inside the measured interpreter."""
+    sys.path.insert(0, str(PROJECT_ROOT))
+    t0 = time.perf_counter()
+    from encrypt_env import load_encrypted_env
+    import_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    load_encrypted_env(Path(path))
+    return {
+        "import_seconds": import_seconds,
+        "load_seconds": time.perf_counter() - t0,
+    }
+
+
+def _run_child(path: Path, extra_env: dict, pass_fds: tuple = ()) -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ("ENV_PASSWORD", "ENV_PASSWORD_FILE", "ENV_KEY_FD")}
+    env.update(extra_env)
+    t0 = time.perf_counter()
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.kdf", "--child", str(path)],
+            cwd=str(PROJECT_ROOT), env=env, capture_output=True, text=True, pass_fds=pass_fds,
+        )
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "child failed")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = wall
+    return result
+
+
+def measure(label: str, params: dict | None, tmp: Path, repeat: int) -> dict:
+    from encrypt_env import decrypt_bytes, derive_key, encrypt_bytes, share_key
+    from cryptography.fernet import Fernet
+
+    path = tmp / f"{label.replace(' ', '_')}.env.encrypted"
+    if params is None:
+        path.write_bytes(Fernet(derive_key(PASSWORD, None)).encrypt(SAMPLE_ENV))
+    else:
+        path.write_bytes(encrypt_bytes(SAMPLE_ENV, PASSWORD, params))
+
+    cold = [_run_child(path, {"ENV_PASSWORD": PASSWORD}) for _ in range(repeat)]
+    decrypt_bytes(path.read_bytes(), PASSWORD, use_cache=True)
+    cached = []
+    for _ in range(repeat):
+        fd = share_key()
+        cached.append(_run_child(path, {"ENV_KEY_FD": str(fd)}, pass_fds=(fd,)))
+
+    def summary(runs):
+        return {
+            "load_seconds_median": statistics.median(r["load_seconds"] for r in runs),
+            "process_seconds_median": statistics.median(r["process_seconds"] for r in runs),
+        }
+
+    return {"params": params, "cold": summary(cold), "cached": summary(cached)}
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Measure .env.encrypted load time across KDF settings")
+    p.add_argument("--scrypt", type=int, action="append", help="scrypt cost (log2 N) to measure; repeatable")
+    p.add_argument("--pbkdf2", type=int, action="append", help="PBKDF2 iterations to measure; repeatable")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per setting and mode (median is reported)")
+    p.add_argument("--json", dest="json_out", default=None, help="Write results as JSON to this file")
+    p.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(args.child)))
+        return 0
+
+    sys.path.insert(0, str(PROJECT_ROOT))
+    from encrypt_env import new_params
+
+    settings: list[tuple[str, dict | None]] = [("legacy sha256", None)]
+    for cost in args.scrypt or ([] if args.pbkdf2 else [14, 15, 16, 17]):
+        settings.append((f"scrypt 2^{cost}", new_params("scrypt", cost)))
+    for iterations in args.pbkdf2 or ([] if args.scrypt else [100_000, 600_000, 1_200_000]):
+        settings.append((f"pbkdf2 {iterations}", new_params("pbkdf2", iterations)))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, params in settings:
+            results[label] = measure(label, params, Path(tmp), args.repeat)
+
+    print(f"{'setting':18} {'cold load':>10} {'cached load':>12} {'cold process':>13} {'cached process':>15}")
+    for label, res in results.items():
+        cold, cached = res["cold"], res["cached"]
+        print(
+            f"{label:18} {cold['load_seconds_median'] * 1000:>8.1f}ms {cached['load_seconds_median'] * 1000:>10.1f}ms"
+            f" {cold['process_seconds_median'] * 1000:>11.0f}ms {cached['process_seconds_median'] * 1000:>13.0f}ms"
+        )
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2, sort_keys=True))
+        print(f"\nWrote {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
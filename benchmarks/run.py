@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Benchmark the merge, compress and stamping hot paths.
+
+Usage examples:
+  python -m benchmarks.run --scale 0.1                    # quick run, table output
+  python -m benchmarks.run --json bench.json              # save machine-readable results
+  python -m benchmarks.run --compare bench.json           # fail if slower/fatter than baseline
+  python -m benchmarks.run --filter 'compress/' --repeat 5
+
+Every case runs in a fresh process so that peak RSS is attributable to the
+case alone (setup such as reading the corpus is not timed, but does count
+towards RSS, which is why the RSS before the timed part is reported too).
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from benchmarks.corpus import CORPORA, ensure_corpus  # noqa: E402
+
+# A setup function receives the corpus files and a scratch directory and
+# returns the callable to be timed. The callable returns the output size in
+# bytes (or None when there is no single output).
+SetupFn = Callable[[List[str], Path], Callable[[], Optional[int]]]
+
+
+@dataclass
+class Case:
+    name: str
+    corpus: str
+    setup: SetupFn
+
+
+CASES: Dict[str, Case] = {}
+
+
+def register(name: str, corpora: tuple[str, ...]) -> Callable[[SetupFn], SetupFn]:
+    """Register `fn` as benchmark case '<name>/<corpus>' for every corpus given."""
+    def deco(fn: SetupFn) -> SetupFn:
+        for corpus in corpora:
+            CASES[f"{name}/{corpus}"] = Case(f"{name}/{corpus}", corpus, fn)
+        return fn
+    return deco
+
+
+def _client():
+    from webapp import app
+
+    app.testing = True
+    return app.test_client()
+
+
+def _merge_pdfs_case(backend: str) -> SetupFn:
+    def setup(files: List[str], workdir: Path):
+        from merge_pdfs import merge_pdfs
+
+        out = workdir / "merged.pdf"
+
+        def run() -> int:
+            merge_pdfs(files, str(out), backend=backend)
+            return out.stat().st_size
+        return run
+    return setup
+
+
+def _merge_pdfs_bytes_case(backend: str, dedup: bool = True, output_format: str = "standard") -> SetupFn:
+    def setup(files: List[str], workdir: Path):
+        from merge_pdfs import merge_pdfs_bytes
+
+        def run() -> int:
+            # resize to the largest page so the scaling path is exercised too
+            return len(merge_pdfs_bytes(
+                files, global_size="largest", backend=backend, dedup=dedup, output_format=output_format,
+            ))
+        return run
+    return setup
+
+
+# the PyPDF2 cases keep their original names so old baselines still compare
+for _backend, _suffix in (("pypdf2", ""), ("pikepdf", ":pikepdf")):
+    register(f"merge_pdfs{_suffix}", CORPORA)(_merge_pdfs_case(_backend))
+    register(f"merge_pdfs_bytes{_suffix}", CORPORA)(_merge_pdfs_bytes_case(_backend))
+    # what the resource dedup stage saves on template-heavy batches
+    register(f"merge_pdfs_bytes{_suffix}:no-dedup", ("templated",))(_merge_pdfs_bytes_case(_backend, dedup=False))
+    # output size and write time of object streams + xref stream
+    register(f"merge_pdfs_bytes{_suffix}:compact", CORPORA)(_merge_pdfs_bytes_case(_backend, output_format="compact"))
+
+
+@register("preflight", CORPORA)
+def _preflight(files: List[str], workdir: Path):
+    from preflight import preflight
+
+    def run() -> int:
+        return sum(info.pages for info in preflight(files))
+    return run
+
+
+def _compress_case(algorithm: str) -> SetupFn:
+    def setup(files: List[str], workdir: Path):
+        client = _client()
+        data = Path(files[0]).read_bytes()
+
+        def run() -> int:
+            resp = client.post(
+                "/compress",
+                data={"file": (io.BytesIO(data), "in.pdf"), "algorithm": algorithm},
+                content_type="multipart/form-data",
+            )
+            if resp.status_code != 200:
+                raise RuntimeError(f"/compress returned {resp.status_code}: {resp.get_data(as_text=True)}")
+            return len(resp.get_data())
+        return run
+    return setup
+
+
+for _algo in ("lossless", "optimize", "downscale"):
+    register(f"compress/{_algo}", ("few_huge", "image_scans"))(_compress_case(_algo))
+
+
+@register("compress_lossless/merged", ("templated",))
+def _compress_lossless_merged(files: List[str], workdir: Path):
+    from compress_pdfs import compress_lossless
+    from merge_pdfs import merge_pdfs_bytes
+
+    # the bloat lossless targets: a merge that kept every input's own resources
+    data = merge_pdfs_bytes(files, dedup=False)
+
+    def run() -> int:
+        return len(compress_lossless(data))
+    return run
+
+
+@register("add_signature", ("many_small", "few_huge"))
+def _add_signature(files: List[str], workdir: Path):
+    from PIL import Image, ImageDraw
+
+    client = _client()
+    sig = Image.new("RGBA", (400, 160), (255, 255, 255, 0))
+    ImageDraw.Draw(sig).line((10, 120, 120, 30, 250, 130, 390, 40), fill=(0, 0, 80, 255), width=6)
+    sig_buf = io.BytesIO()
+    sig.save(sig_buf, format="PNG")
+
+    client.post("/edit/store-pdf", data={"file": (open(files[0], "rb"), "in.pdf")},
+                content_type="multipart/form-data")
+    client.post("/edit/store-signature", data={"file": (io.BytesIO(sig_buf.getvalue()), "sig.png")},
+                content_type="multipart/form-data")
+
+    def run() -> int:
+        resp = client.post("/edit/add-signature", data={
+            "signature_source": "upload", "page_num": "1", "x": "100", "y": "600",
+            "width": "200", "height": "80", "signature_date": "2024-01-31",
+        })
+        if resp.status_code != 200:
+            raise RuntimeError(f"/edit/add-signature returned {resp.status_code}: {resp.get_data(as_text=True)}")
+        return len(resp.get_data())
+    return run
+
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _child(case_name: str, files: List[str], repeat: int, conn) -> None:
+    """Run one case inside a fresh process and send the measurements back."""
+    try:
+        case = CASES[case_name]
+        with tempfile.TemporaryDirectory() as tmp:
+            run = case.setup(files, Path(tmp))
+            rss_before = _peak_rss_kb()
+            tracemalloc_peak = None
+            if rss_before is None:
+                import tracemalloc
+                tracemalloc.start()
+            timings = []
+            out_bytes = None
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                out_bytes = run()
+                timings.append(time.perf_counter() - t0)
+            if rss_before is None:
+                import tracemalloc
+                tracemalloc_peak = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+        conn.send({
+            "seconds_min": min(timings),
+            "seconds_median": statistics.median(timings),
+            "repeat": repeat,
+            "rss_before_kb": rss_before,
+            "peak_rss_kb": _peak_rss_kb() if rss_before is not None else tracemalloc_peak,
+            "output_bytes": out_bytes,
+            "input_files": len(files),
+            "input_bytes": sum(os.path.getsize(f) for f in files),
+        })
+    except Exception as exc:
+        conn.send({"error": f"{type(exc).__name__}: {exc}"})
+    finally:
+        conn.close()
+
+
+def run_case(case_name: str, files: List[str], repeat: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(case_name, files, repeat, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"error": "benchmark process died"}
+    proc.join()
+    return result
+
+
+def compare(current: dict, baseline: dict, threshold: float, noise_floor: float = 0.005) -> List[str]:
+    """Print current vs baseline and return the cases that regressed by more than `threshold`.
+
+    Time differences smaller than `noise_floor` seconds are never flagged, so
+    millisecond-sized cases don't fail the comparison on scheduler jitter.
+    """
+    regressions = []
+    print(f"\n{'case':44} {'time':>10} {'baseline':>10} {'delta':>8} {'rss delta':>10}")
+    for name, cur in sorted(current["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if not base or "error" in cur or "error" in base:
+            continue
+        t_delta = cur["seconds_median"] / base["seconds_median"] - 1 if base["seconds_median"] else 0.0
+        rss_delta = 0.0
+        if cur.get("peak_rss_kb") and base.get("peak_rss_kb"):
+            rss_delta = cur["peak_rss_kb"] / base["peak_rss_kb"] - 1
+        flag = ""
+        slower = t_delta > threshold and cur["seconds_median"] - base["seconds_median"] > noise_floor
+        if slower or rss_delta > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:44} {cur['seconds_median']:>9.3f}s {base['seconds_median']:>9.3f}s "
+              f"{t_delta:>+7.1%} {rss_delta:>+9.1%}{flag}")
+    return regressions
+
+
+def _print_result(name: str, res: dict) -> None:
+    if "error" in res:
+        print(f"{name:44} ERROR {res['error']}")
+        return
+    rss = f"{res['peak_rss_kb'] / 1024:.1f}MB" if res.get("peak_rss_kb") else "n/a"
+    out = f"{res['output_bytes'] / 1024:.0f}KB" if res.get("output_bytes") is not None else "-"
+    print(f"{name:44} {res['seconds_median']:>9.3f}s {res['seconds_min']:>9.3f}s {rss:>10} {out:>10}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark PDF merge/compress/stamping hot paths")
+    p.add_argument("--scale", type=float, default=1.0, help="Corpus size multiplier (e.g. 0.1 for a quick run)")
+    p.add_argument("--repeat", type=int, default=3, help="Timed repetitions per case (default 3)")
+    p.add_argument("--filter", default=None, help="Only run cases whose name matches this regex")
+    p.add_argument("--corpus-dir", default=str(PROJECT_ROOT / ".bench-corpus"), help="Where to cache the corpus")
+    p.add_argument("--json", dest="json_out", default=None, help="Write results as JSON to this file")
+    p.add_argument("--compare", default=None, help="Baseline JSON file to compare against")
+    p.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown/RSS growth vs baseline (default 0.15)")
+    p.add_argument("--list", action="store_true", help="List the available cases and exit")
+    args = p.parse_args(argv)
+
+    names = sorted(CASES)
+    if args.filter:
+        pattern = re.compile(args.filter)
+        names = [n for n in names if pattern.search(n)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    if not names:
+        print("No benchmark cases selected.", file=sys.stderr)
+        return 2
+
+    results: dict = {}
+    print(f"{'case':44} {'median':>10} {'min':>10} {'peak rss':>10} {'output':>10}")
+    for name in names:
+        case = CASES[name]
+        files = ensure_corpus(Path(args.corpus_dir), case.corpus, args.scale)
+        results[name] = run_case(name, files, args.repeat)
+        _print_result(name, results[name])
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"\nWrote {args.json_out}")
+
+    rc = 1 if any("error" in r for r in results.values()) else 0
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            rc = 1
+    return rc
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
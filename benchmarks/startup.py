@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Measure webapp import time and first-request latency per route.
+
+Usage examples:
+  python -m benchmarks.startup
+  python -m benchmarks.startup --json startup.json
+
+Each startup mode runs in a fresh interpreter:
+
+  dev                 default settings (reloads merge_pdfs on import)
+  production          PDFTOOLS_PRODUCTION=1
+  production+warmup   PDFTOOLS_PRODUCTION=1 PDFTOOLS_WARMUP=1 (what gunicorn.conf.py uses)
+
+For every route the first and the second request are timed; the difference
+is the lazy-import/first-use cost that warmup moves to startup.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+MODES = {
+    "dev": {},
+    "production": {"PDFTOOLS_PRODUCTION": "1"},
+    "production+warmup": {"PDFTOOLS_PRODUCTION": "1", "PDFTOOLS_WARMUP": "1"},
+}
+
+
+def _write_samples(tmp: Path) -> None:
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    # one page with a large image so /compress?algorithm=downscale has work to do
+    img = Image.radial_gradient("L").resize((2400, 2400)).convert("RGB")
+    img_buf = io.BytesIO()
+    img.save(img_buf, format="PNG")
+    img_buf.seek(0)
+    c = canvas.Canvas(str(tmp / "sample.pdf"), pagesize=(612, 792))
+    c.drawImage(ImageReader(img_buf), 0, 0, width=612, height=792)
+    c.showPage()
+    c.save()
+
+    sig = Image.new("RGBA", (200, 80), (0, 0, 0, 0))
+    sig.save(tmp / "sig.png", format="PNG")
+
+
+def _child(sample_dir: Path) -> dict:
+    """Runs inside the measured interpreter."""
+    sys.path.insert(0, str(PROJECT_ROOT))
+    pdf = (sample_dir / "sample.pdf").read_bytes()
+    sig = (sample_dir / "sig.png").read_bytes()
+
+    t0 = time.perf_counter()
+    from webapp import app  # noqa: E402
+    import_seconds = time.perf_counter() - t0
+
+    client = app.test_client()
+
+    def form(**fields):
+        return dict(content_type="multipart/form-data", data=fields)
+
+    def compress(algo):
+        return lambda: client.post("/compress", **form(file=(io.BytesIO(pdf), "a.pdf"), algorithm=algo))
+
+    def add_signature():
+        client.post("/edit/store-signature", **form(file=(io.BytesIO(sig), "sig.png")))
+        return client.post("/edit/add-signature", data={"signature_source": "upload", "page_num": "1"})
+
+    client.post("/edit/store-pdf", **form(file=(io.BytesIO(pdf), "a.pdf")))
+    routes = {
+        "GET /": lambda: client.get("/"),
+        "POST /merge": lambda: client.post("/merge", **form(files=[(io.BytesIO(pdf), "a.pdf"), (io.BytesIO(pdf), "b.pdf")])),
+        "POST /compress lossless": compress("lossless"),
+        "POST /compress optimize": compress("optimize"),
+        "POST /compress downscale": compress("downscale"),
+        "POST /edit/add-text": lambda: client.post("/edit/add-text", **form(file=(io.BytesIO(pdf), "a.pdf"), text="hello")),
+        "POST /edit/add-signature": add_signature,
+    }
+    results = {}
+    for name, call in routes.items():
+        timings = []
+        for _ in range(2):
+            t = time.perf_counter()
+            resp = call()
+            resp.get_data()
+            resp.close()
+            timings.append(time.perf_counter() - t)
+            if resp.status_code != 200:
+                raise RuntimeError(f"{name} returned {resp.status_code}")
+        results[name] = {"first": timings[0], "second": timings[1]}
+    return {"import_seconds": import_seconds, "routes": results}
+
+
+def measure(mode: str, sample_dir: Path) -> dict:
+    env = dict(os.environ, **MODES[mode])
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", str(sample_dir)],
+        cwd=str(PROJECT_ROOT), env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "child failed"}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = wall
+    return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Measure webapp import time and first-request latency")
+    p.add_argument("--json", dest="json_out", default=None, help="Write results as JSON to this file")
+    p.add_argument("--mode", action="append", choices=sorted(MODES), help="Only measure these modes")
+    p.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(Path(args.child))))
+        return 0
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        _write_samples(Path(tmp))
+        for mode in args.mode or list(MODES):
+            results[mode] = measure(mode, Path(tmp))
+
+    for mode, res in results.items():
+        if "error" in res:
+            print(f"{mode}: ERROR {res['error']}")
+            continue
+        print(f"\n{mode}: import {res['import_seconds'] * 1000:.0f} ms, process total {res['process_seconds']:.2f} s")
+        print(f"  {'route':28} {'first':>10} {'second':>10}")
+        for route, t in res["routes"].items():
+            print(f"  {route:28} {t['first'] * 1000:>8.1f}ms {t['second'] * 1000:>8.1f}ms")
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2, sort_keys=True))
+        print(f"\nWrote {args.json_out}")
+    return 1 if any("error" in r for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,868 @@
+#!/usr/bin/env python3
+"""Shrink PDFs: lossless object cleanup and image downscaling.
+
+Usage examples:
+  python compress_pdfs.py scans/ -r -o compressed/ --jobs 8
+  python compress_pdfs.py big.pdf -o out/ --algorithm downscale --target-dpi 100
+
+``compress_lossless`` runs qpdf (through pikepdf) over the whole document in
+five steps, each timed and measured separately:
+
+  fonts       duplicate embedded font programs are collapsed, and TrueType
+              fonts optionally subset to the glyphs used (see pdf_fonts)
+  collapse    byte-identical objects (fonts, images, resource dictionaries
+              repeated by earlier merges) are merged into one
+  prune       resources the page contents never use are removed, and
+              objects nothing refers to any more are not written
+  recompress  Flate streams are re-deflated at the highest level, spread
+              over a thread pool (zlib releases the GIL), and kept only
+              where they got smaller
+  serialize   objects are packed into compressed object streams
+
+``compress_downscale`` resamples page images drawn at more than a target
+DPI (found from their placement in the content streams) and picks a codec
+per image from a sampled histogram: CCITT G4 (or 1-bit Flate) for bilevel
+scans, grayscale JPEG, indexed Flate with PNG predictors for line art and
+charts, RGB JPEG for photos.
+
+``compress_optimize`` is a plain qpdf re-save with stream and object stream
+compression. The command line runs any of them over files and directory
+trees in a process pool, skipping files whose output is already newer.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+from merge_backends import ObjGen, collapse_pikepdf
+from pdf_limits import Limits, check_document, stream_filters
+
+# objects whose identity matters even when their contents are equal: structure,
+# optional content (layers are switched on and off by reference), article
+# threads and actions
+_KEEP_TYPES = {
+    "/Catalog", "/Pages", "/Page", "/Annot", "/StructTreeRoot", "/StructElem", "/Sig", "/ObjStm", "/XRef",
+    "/OCG", "/OCMD", "/OCProperties", "/Thread", "/Bead", "/Action", "/Outlines",
+}
+
+# streams smaller than this are recompressed inline; the pool is not worth it
+_POOL_MIN_BYTES = 16 * 1024
+
+LOSSLESS_PHASES = ("parse", "fonts", "collapse", "prune", "recompress", "serialize")
+
+
+def _collapsible(obj: Any) -> bool:
+    import pikepdf
+
+    if not isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream, pikepdf.Array)):
+        return False
+    if isinstance(obj, pikepdf.Array):
+        return True
+    if obj.get("/Type") in _KEEP_TYPES:
+        return False
+    # actions usually carry no /Type, only their kind in /S (as do transparency groups, which may go)
+    if "/S" in obj and obj.get("/S") != "/Transparency":
+        return False
+    # annotations, form fields and outline items belong to one place in the document
+    return "/Rect" not in obj and "/Parent" not in obj
+
+
+def _object_size(obj: Any) -> int:
+    import pikepdf
+
+    if isinstance(obj, pikepdf.Stream):
+        return len(obj.read_raw_bytes()) + len(obj.stream_dict.unparse())
+    return len(obj.unparse())
+
+
+def _is_container(obj: Any) -> bool:
+    # the input's object and xref streams: rewritten by serialize, not dropped
+    import pikepdf
+
+    return isinstance(obj, pikepdf.Stream) and obj.get("/Type") in ("/ObjStm", "/XRef")
+
+
+def _reachable(pdf: Any) -> set:
+    """objgens of every indirect object reachable from the trailer."""
+    import pikepdf
+
+    seen: set = set()
+    stack = [pdf.trailer]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, pikepdf.Array):
+            children = list(obj)
+        elif isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+            children = [obj[k] for k in obj.keys()]
+        else:
+            continue
+        for child in children:
+            if not isinstance(child, pikepdf.Object):
+                continue
+            if child.is_indirect:
+                if child.objgen in seen:
+                    continue
+                seen.add(child.objgen)
+            stack.append(child)
+    return seen
+
+
+def _recompress(raw: bytes, filtered: bool) -> Optional[bytes]:
+    """Deflate at level 9; None if that does not beat `raw`."""
+    try:
+        data = zlib.decompress(raw) if filtered else raw
+    except zlib.error:
+        return None
+    packed = zlib.compress(data, 9)
+    return packed if len(packed) < len(raw) else None
+
+
+def _flate_candidates(pdf: Any) -> List[Tuple[Any, bool]]:
+    """(stream, currently Flate-filtered) for every stream we can safely re-deflate."""
+    import pikepdf
+
+    found = []
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream):
+            continue
+        filt = obj.get("/Filter")
+        if isinstance(filt, pikepdf.Array):
+            filt = filt[0] if len(filt) == 1 else None
+        if filt is None and "/Filter" not in obj:
+            found.append((obj, False))
+        elif filt == pikepdf.Name.FlateDecode and "/DecodeParms" not in obj:
+            # predictor-encoded streams (PNG images) are left as they are
+            found.append((obj, True))
+    return found
+
+
+class _Steps:
+    """Times the steps of one compression and collects what each removed."""
+
+    def __init__(self, phase: Callable[[str], ContextManager] | None) -> None:
+        self.phase = phase or (lambda name: contextlib.nullcontext())
+        self.phases: Dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name: str):
+        t0 = time.perf_counter()
+        with self.phase(name):
+            record = self.phases.setdefault(name, {"seconds": 0.0, "objects": 0, "bytes_saved": 0})
+            yield record
+        record["seconds"] = time.perf_counter() - t0
+
+    def finish(self, data: bytes, result: bytes, pages: int, stats: Optional[dict]) -> None:
+        # serialize is credited with whatever the earlier steps do not account for
+        removed = sum(p["bytes_saved"] for name, p in self.phases.items() if name != "serialize")
+        self.phases["serialize"]["bytes_saved"] = len(data) - removed - len(result)
+        if stats is not None:
+            stats.update(pages=pages, input_size=len(data), output_size=len(result), phases=self.phases)
+
+
+def _open(data: bytes, limits: Optional[Limits]) -> Any:
+    import pikepdf
+
+    try:
+        pdf = pikepdf.Pdf.open(io.BytesIO(data))
+    except pikepdf.PasswordError:
+        raise ValueError("Cannot read encrypted PDF without password")
+    try:
+        if pdf.is_encrypted:
+            raise ValueError("Cannot read encrypted PDF without password")
+        # before anything is decoded (see pdf_limits)
+        check_document(pdf, limits or Limits.from_env())
+    except ValueError:
+        pdf.close()
+        raise
+    return pdf
+
+
+def _remove_metadata(pdf: Any) -> None:
+    pdf.docinfo.clear()
+    if "/Metadata" in pdf.Root:
+        del pdf.Root["/Metadata"]
+
+
+def compress_lossless(
+    data: bytes,
+    remove_metadata: bool = False,
+    jobs: Optional[int] = None,
+    subset_fonts: bool = False,
+    limits: Optional[Limits] = None,
+    phase: Callable[[str], ContextManager] | None = None,
+    stats: Optional[dict] = None,
+) -> bytes:
+    """Losslessly compress the PDF `data` and return the new PDF bytes.
+
+    jobs: threads used to recompress streams (default: CPU count).
+    subset_fonts: also cut TrueType fonts down to the glyphs used (needs
+      'fonttools'; raises ValueError without it).
+    limits: resource limits checked before decoding (default: from the
+      environment, see pdf_limits); raises LimitExceeded.
+    phase: optional factory returning a context manager per phase name
+      (see LOSSLESS_PHASES); used by the webapp for timings.
+    stats: optional dict that receives 'pages', 'input_size', 'output_size'
+      and per phase in 'phases': 'seconds', 'objects' and 'bytes_saved'
+      (the size of the removed or rewritten objects; serialize reports the
+      difference between the final file and the object bytes it received);
+      'fonts' maps font names to 'duplicates' and 'bytes_saved'.
+    """
+    import pikepdf
+
+    import pdf_fonts
+
+    step = _Steps(phase)
+    with step("parse"):
+        pdf = _open(data, limits)
+    try:
+        if remove_metadata:
+            _remove_metadata(pdf)
+
+        with step("fonts") as record:
+            removed, fonts = pdf_fonts.dedup_fonts(pdf)
+            removed = set(removed)
+            record["objects"] = len(removed)
+            if subset_fonts:
+                for name, report in pdf_fonts.subset_fonts(pdf).items():
+                    fonts.setdefault(name, {"duplicates": 0, "bytes_saved": 0})
+                    fonts[name]["bytes_saved"] += report["bytes_saved"]
+                    record["objects"] += 1
+            record["bytes_saved"] = sum(report["bytes_saved"] for report in fonts.values())
+
+        with step("collapse") as record:
+            candidates: Dict[ObjGen, Any] = {obj.objgen: obj for obj in pdf.objects if _collapsible(obj)}
+            remap = collapse_pikepdf(pdf, candidates)
+            removed.update(remap)
+            record["objects"] = len(remap)
+            record["bytes_saved"] = sum(_object_size(candidates[objgen]) for objgen in remap)
+
+        with step("prune") as record:
+            pdf.remove_unreferenced_resources()
+            reachable = _reachable(pdf)
+            dropped = [
+                obj for obj in pdf.objects
+                if obj.objgen not in reachable and obj.objgen not in removed and not _is_container(obj)
+            ]
+            record["objects"] = len(dropped)
+            record["bytes_saved"] = sum(_object_size(obj) for obj in dropped)
+
+        with step("recompress") as record:
+            streams = [(obj, filtered) for obj, filtered in _flate_candidates(pdf) if obj.objgen in reachable]
+            raws = [obj.read_raw_bytes() for obj, _ in streams]
+            small = [i for i, raw in enumerate(raws) if len(raw) < _POOL_MIN_BYTES]
+            large = [i for i, raw in enumerate(raws) if len(raw) >= _POOL_MIN_BYTES]
+            packed: Dict[int, Optional[bytes]] = {i: _recompress(raws[i], streams[i][1]) for i in small}
+            if large:
+                workers = jobs or os.cpu_count() or 1
+                with ThreadPoolExecutor(max_workers=min(workers, len(large))) as pool:
+                    results = pool.map(lambda i: _recompress(raws[i], streams[i][1]), large)
+                    packed.update(zip(large, results))
+            for i, new in packed.items():
+                if new is None:
+                    continue
+                streams[i][0].write(new, filter=pikepdf.Name.FlateDecode)
+                record["objects"] += 1
+                record["bytes_saved"] += len(raws[i]) - len(new)
+
+        with step("serialize") as record:
+            out = io.BytesIO()
+            # stream data was already (re)compressed above; keep it as it is
+            pdf.save(
+                out,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True,
+                stream_decode_level=pikepdf.StreamDecodeLevel.none,
+            )
+            pages = len(pdf.pages)
+    finally:
+        pdf.close()
+
+    result = out.getvalue()
+    step.finish(data, result, pages, stats)
+    if stats is not None:
+        stats["fonts"] = fonts
+    return result
+
+
+def compress_optimize(
+    data: bytes,
+    linearize: bool = False,
+    remove_metadata: bool = False,
+    limits: Optional[Limits] = None,
+    phase: Callable[[str], ContextManager] | None = None,
+    stats: Optional[dict] = None,
+) -> bytes:
+    """Re-save the PDF with qpdf's own stream and object stream compression.
+
+    Streams with generic filters (Flate, LZW, ASCII) are re-deflated; if
+    that does not make the file smaller, all streams (images included) are
+    decoded and re-deflated and the smaller result is kept. `limits` and
+    `stats` as for compress_lossless.
+    """
+    import pikepdf
+
+    step = _Steps(phase)
+    with step("parse"):
+        pdf = _open(data, limits)
+    try:
+        if remove_metadata:
+            _remove_metadata(pdf)
+        with step("serialize"):
+            best = None
+            for level in (pikepdf.StreamDecodeLevel.generalized, pikepdf.StreamDecodeLevel.all):
+                out = io.BytesIO()
+                try:
+                    pdf.save(
+                        out, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                        stream_decode_level=level, recompress_flate=True, linearize=linearize,
+                    )
+                except Exception:
+                    if best is None:
+                        raise
+                    # keep the first attempt if the aggressive one fails
+                    break
+                if best is None or out.getbuffer().nbytes < len(best):
+                    best = out.getvalue()
+                if len(best) < len(data):
+                    break
+            pages = len(pdf.pages)
+    finally:
+        pdf.close()
+
+    step.finish(data, best, pages, stats)
+    return best
+
+
+ALGORITHMS = ("lossless", "optimize", "downscale")
+
+
+def compress_bytes(data: bytes, algorithm: str = "lossless", **options: Any) -> bytes:
+    """Compress `data` with one of ALGORITHMS; `options` go to its function."""
+    if algorithm == "lossless":
+        return compress_lossless(data, **options)
+    if algorithm == "optimize":
+        return compress_optimize(data, **options)
+    if algorithm == "downscale":
+        return compress_downscale(data, **options)
+    raise ValueError(f"Unknown compression algorithm '{algorithm}' (choose from {', '.join(ALGORITHMS)})")
+
+
+# Image re-encoding (downscale)
+
+IMAGE_KINDS = ("bilevel", "gray", "palette", "photo")
+
+# classification looks at a nearest-neighbour sample of about this many pixels
+_SAMPLE_PIXELS = 64 * 1024
+# channel spread up to which a pixel still counts as gray (scanner colour noise)
+_GRAY_TOLERANCE = 12
+# share of sampled pixels that must be near black or near white for bilevel
+_BILEVEL_SHARE = 0.95
+
+# images that are not resized are only decoded (to look for a lossless
+# re-encode) from this size; below it the gain does not pay for the decode
+_REENCODE_MIN_BYTES = 256 * 1024
+
+# gray images with at most this many levels are drawings, not photos
+_GRAY_PALETTE_LEVELS = 16
+
+# filters whose data already lost information; such images are only
+# re-encoded when they are resized anyway
+_LOSSY_FILTERS = {"/DCTDecode", "/JPXDecode", "/JBIG2Decode", "/CCITTFaxDecode"}
+
+
+def classify_image(img: Any) -> str:
+    """One of IMAGE_KINDS for a PIL image, decided from a sampled histogram."""
+    from PIL import Image, ImageChops
+
+    step = max(1, int((img.width * img.height / _SAMPLE_PIXELS) ** 0.5))
+    sample = img if step == 1 else img.resize((max(1, img.width // step), max(1, img.height // step)), Image.NEAREST)
+    rgb = sample.convert("RGB")
+    total = rgb.width * rgb.height
+    r, g, b = rgb.split()
+    spread = ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b)).histogram()
+    if sum(spread[_GRAY_TOLERANCE + 1:]) <= total * 0.01:
+        levels = rgb.convert("L").histogram()
+        if sum(levels[:64]) + sum(levels[192:]) >= total * _BILEVEL_SHARE:
+            return "bilevel"
+        # any 8-bit gray image has <= 256 levels; only a few mean flat line art
+        return "palette" if rgb.getcolors(_GRAY_PALETTE_LEVELS) is not None else "gray"
+    return "palette" if rgb.getcolors(256) is not None else "photo"
+
+
+def _may_shrink_losslessly(obj: Any, raw_size: int) -> bool:
+    """Worth decoding an image that is not resized to look for an exact re-encode?"""
+    import pikepdf
+
+    if raw_size < _REENCODE_MIN_BYTES or _LOSSY_FILTERS.intersection(stream_filters(obj)):
+        return False
+    colorspace = obj.get("/ColorSpace")
+    # already 1-bit or indexed: nothing to gain
+    if obj.get("/BitsPerComponent", 8) == 1:
+        return False
+    return not (isinstance(colorspace, pikepdf.Array) and len(colorspace) and colorspace[0] == pikepdf.Name.Indexed)
+
+
+def _is_exact(img: Any, kind: str) -> bool:
+    """True if encoding `img` as `kind` loses nothing."""
+    if kind == "bilevel":
+        colors = img.convert("L").getcolors(2)
+        return colors is not None and {value for _, value in colors} <= {0, 255}
+    if kind == "palette":
+        return img.convert("RGB").getcolors(256) is not None
+    return False
+
+
+def _png_data(img: Any) -> Tuple[bytes, int, Optional[bytes]]:
+    """(Flate data with PNG predictors, bits per component, palette) via Pillow's PNG writer.
+
+    The concatenated IDAT chunks of a non-interlaced PNG are exactly a PDF
+    FlateDecode stream with /Predictor 15.
+    """
+    import struct
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    png = buf.getvalue()
+    pos, bits, palette, idat = 8, 8, None, []
+    while pos < len(png):
+        length, ctype = struct.unpack(">I4s", png[pos:pos + 8])
+        body = png[pos + 8:pos + 8 + length]
+        if ctype == b"IHDR":
+            bits = body[8]
+        elif ctype == b"PLTE":
+            palette = body
+        elif ctype == b"IDAT":
+            idat.append(body)
+        pos += 12 + length
+    return b"".join(idat), bits, palette
+
+
+def _flate_image(img: Any, colors: int) -> Tuple[bytes, dict]:
+    import pikepdf
+
+    data, bits, palette = _png_data(img)
+    entries = {
+        "/Filter": pikepdf.Name.FlateDecode,
+        "/DecodeParms": pikepdf.Dictionary(Predictor=15, Colors=colors, BitsPerComponent=bits, Columns=img.width),
+        "/BitsPerComponent": bits,
+    }
+    if palette is not None:
+        entries["/ColorSpace"] = pikepdf.Array(
+            [pikepdf.Name.Indexed, pikepdf.Name.DeviceRGB, len(palette) // 3 - 1, pikepdf.String(palette)]
+        )
+    else:
+        entries["/ColorSpace"] = pikepdf.Name.DeviceGray if colors == 1 else pikepdf.Name.DeviceRGB
+    return data, entries
+
+
+def _g4_image(bw: Any) -> Optional[Tuple[bytes, dict]]:
+    import pikepdf
+    from PIL import features
+
+    if not features.check("libtiff"):
+        return None
+    buf = io.BytesIO()
+    # a single strip, so the TIFF holds one G4 stream we can lift out
+    bw.save(buf, format="TIFF", compression="group4", tiffinfo={278: bw.height})
+    from PIL import Image
+
+    with Image.open(io.BytesIO(buf.getvalue())) as tif:
+        offsets, counts = tif.tag_v2[273], tif.tag_v2[279]
+    if len(offsets) != 1:
+        return None
+    data = buf.getvalue()[offsets[0]:offsets[0] + counts[0]]
+    # Pillow writes min-is-black, so 1 bits are white
+    parms = pikepdf.Dictionary(K=-1, Columns=bw.width, Rows=bw.height, BlackIs1=True)
+    return data, {
+        "/Filter": pikepdf.Name.CCITTFaxDecode,
+        "/DecodeParms": parms,
+        "/ColorSpace": pikepdf.Name.DeviceGray,
+        "/BitsPerComponent": 1,
+    }
+
+
+def _jpeg_image(img: Any, quality: int) -> Tuple[bytes, dict]:
+    import pikepdf
+
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    colorspace = pikepdf.Name.DeviceGray if img.mode == "L" else pikepdf.Name.DeviceRGB
+    return buf.getvalue(), {"/Filter": pikepdf.Name.DCTDecode, "/ColorSpace": colorspace, "/BitsPerComponent": 8}
+
+
+def encode_image(img: Any, kind: str, jpeg_quality: int = 75) -> Tuple[bytes, dict]:
+    """Encode a PIL image for `kind`; returns (stream data, image dictionary entries).
+
+    bilevel  CCITT G4 or 1-bit Flate, whichever is smaller
+    gray     grayscale JPEG
+    palette  indexed colour, Flate with PNG predictors
+    photo    RGB JPEG
+    """
+    if kind == "bilevel":
+        bw = img.convert("L").point(lambda v: 255 if v >= 128 else 0).convert("1")
+        options = [_flate_image(bw, 1)]
+        g4 = _g4_image(bw)
+        if g4 is not None:
+            options.append(g4)
+        return min(options, key=lambda option: len(option[0]))
+    if kind == "gray":
+        return _jpeg_image(img.convert("L"), jpeg_quality)
+    if kind == "palette":
+        rgb = img.convert("RGB")
+        if all(r == g == b for _, (r, g, b) in rgb.getcolors(256) or []):
+            return _flate_image(rgb.convert("L"), 1)
+        return _flate_image(rgb.quantize(colors=256), 1)
+    return _jpeg_image(img.convert("RGB"), jpeg_quality)
+
+
+def _page_images(pdf: Any) -> List[Any]:
+    """Image XObjects placed directly on the pages, each once."""
+    import pikepdf
+
+    seen: set = set()
+    images = []
+    for page in pdf.pages:
+        resources = page.obj.get("/Resources", pikepdf.Dictionary())
+        for _, obj in resources.get("/XObject", pikepdf.Dictionary()).items():
+            if not isinstance(obj, pikepdf.Stream) or obj.get("/Subtype") != pikepdf.Name.Image:
+                continue
+            if obj.is_indirect:
+                if obj.objgen in seen:
+                    continue
+                seen.add(obj.objgen)
+            images.append(obj)
+    return images
+
+
+_IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+# images are only resampled when drawn at more than this times the target DPI
+_DPI_MARGIN = 1.15
+
+
+def _multiply(m: Tuple[float, ...], n: Tuple[float, ...]) -> Tuple[float, ...]:
+    """The PDF matrix product m x n (apply m, then n)."""
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (
+        a * a2 + b * c2, a * b2 + b * d2,
+        c * a2 + d * c2, c * b2 + d * d2,
+        e * a2 + f * c2 + e2, e * b2 + f * d2 + f2,
+    )
+
+
+def image_placements(pdf: Any, max_depth: int = 8) -> Dict[ObjGen, Tuple[float, float]]:
+    """Largest drawn (width, height) in points of every image XObject on the pages.
+
+    Follows q/Q/cm through the page content streams and into Form XObjects
+    (with their /Matrix). An image drawn several times reports the largest
+    extent on each axis, so resampling for it suits every placement.
+    """
+    import pikepdf
+
+    placements: Dict[ObjGen, Tuple[float, float]] = {}
+    parsed: Dict[ObjGen, list] = {}
+
+    def instructions(form: Any) -> list:
+        # a form used on every page (letterheads, stamps) is parsed once
+        if form.objgen not in parsed:
+            parsed[form.objgen] = pikepdf.parse_content_stream(form, "q Q cm Do")
+        return parsed[form.objgen]
+
+    def walk(ops: list, resources: Any, ctm: Tuple[float, ...], depth: int, active: frozenset) -> None:
+        xobjects = resources.get("/XObject") if isinstance(resources, pikepdf.Dictionary) else None
+        if not xobjects:
+            return
+        saved = []
+        for operands, operator in ops:
+            op = str(operator)
+            if op == "q":
+                saved.append(ctm)
+            elif op == "Q":
+                if saved:
+                    ctm = saved.pop()
+            elif op == "cm" and len(operands) == 6:
+                ctm = _multiply(tuple(float(v) for v in operands), ctm)
+            elif op == "Do" and operands:
+                xobj = xobjects.get(operands[0])
+                if not isinstance(xobj, pikepdf.Stream) or not xobj.is_indirect:
+                    continue
+                if xobj.get("/Subtype") == pikepdf.Name.Image:
+                    a, b, c, d, _, _ = ctm
+                    width, height = placements.get(xobj.objgen, (0.0, 0.0))
+                    placements[xobj.objgen] = (max(width, math.hypot(a, b)), max(height, math.hypot(c, d)))
+                elif xobj.get("/Subtype") == pikepdf.Name.Form and depth < max_depth and xobj.objgen not in active:
+                    matrix = tuple(float(v) for v in xobj.get("/Matrix", _IDENTITY))
+                    walk(
+                        instructions(xobj), xobj.get("/Resources", resources), _multiply(matrix, ctm),
+                        depth + 1, active | {xobj.objgen},
+                    )
+
+    for page in pdf.pages:
+        resources = page.obj.get("/Resources")
+        if not isinstance(resources, pikepdf.Dictionary) or "/XObject" not in resources:
+            continue
+        unit = float(page.obj.get("/UserUnit", 1))
+        walk(pikepdf.parse_content_stream(page, "q Q cm Do"), resources, (unit, 0.0, 0.0, unit, 0.0, 0.0), 0, frozenset())
+    return placements
+
+
+def _target_size(
+    size: Tuple[int, int], drawn: Optional[Tuple[float, float]], target_dpi: Optional[float], max_px: Optional[int],
+) -> Optional[Tuple[int, int]]:
+    """Pixel size to resample an image to, or None to keep it."""
+    width, height = size
+    factor = 1.0
+    if drawn is not None and target_dpi:
+        # pixels needed on each axis at the target DPI; the larger need wins
+        needed = max(drawn[0] / 72 * target_dpi / width, drawn[1] / 72 * target_dpi / height)
+        if needed * _DPI_MARGIN < 1:
+            factor = needed
+    if max_px and max(width, height) * factor > max_px:
+        factor = max_px / max(width, height)
+    if factor >= 1:
+        return None
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def compress_downscale(
+    data: bytes,
+    target_dpi: Optional[float] = 150,
+    max_px: Optional[int] = None,
+    jpeg_quality: int = 75,
+    remove_metadata: bool = False,
+    limits: Optional[Limits] = None,
+    phase: Callable[[str], ContextManager] | None = None,
+    stats: Optional[dict] = None,
+) -> bytes:
+    """Shrink page images and return the new PDF bytes.
+
+    Images drawn at more than `target_dpi` (at their largest placement, see
+    image_placements) are resampled to `target_dpi`; `max_px` optionally
+    caps either side as well, and is the only rule for images whose
+    placement is unknown. Resampled images are re-encoded with the codec
+    that suits their content (see encode_image and classify_image). Other
+    images (from 256 KiB of stream data) are only re-encoded when that is
+    lossless (exact bilevel or <= 256 colours from a lossless source) and
+    smaller. `limits` as for compress_lossless; `stats` receives the same
+    figures as compress_lossless plus per kind in 'images': 'count',
+    'bytes_before' and 'bytes_after'.
+    """
+    import pikepdf
+    from PIL import Image
+
+    step = _Steps(phase)
+    with step("parse"):
+        pdf = _open(data, limits)
+    images = {kind: {"count": 0, "bytes_before": 0, "bytes_after": 0} for kind in IMAGE_KINDS}
+    try:
+        if remove_metadata:
+            _remove_metadata(pdf)
+        with step("transform") as record:
+            placements = image_placements(pdf) if target_dpi else {}
+            for obj in _page_images(pdf):
+                if obj.get("/ImageMask", False):
+                    continue
+                size = (int(obj.get("/Width", 0)), int(obj.get("/Height", 0)))
+                if min(size) < 1:
+                    continue
+                resize = _target_size(size, placements.get(obj.objgen), target_dpi, max_px)
+                old_size = len(obj.read_raw_bytes())
+                if not resize and not _may_shrink_losslessly(obj, old_size):
+                    # decided from the dictionary alone; decoding is the expensive part
+                    continue
+                try:
+                    pil = pikepdf.PdfImage(obj).as_pil_image()
+                except Exception:
+                    continue
+                kind = classify_image(pil)
+                if not resize and not _is_exact(pil, kind):
+                    continue
+                if resize:
+                    if kind in ("bilevel", "gray") and pil.mode != "L":
+                        # one channel to resample instead of three
+                        pil = pil.convert("L")
+                    pil = pil.resize(resize, Image.LANCZOS, reducing_gap=2.0)
+                new_data, entries = encode_image(pil, kind, jpeg_quality)
+                if len(new_data) >= old_size:
+                    continue
+                # the new data has its own colour values; a colour-key mask no longer matches
+                for key in ("/Mask", "/DecodeParms", "/Decode"):
+                    if key in obj:
+                        del obj[key]
+                obj.write(new_data, filter=entries.pop("/Filter"), decode_parms=entries.pop("/DecodeParms", None))
+                for key, value in entries.items():
+                    obj[key] = value
+                obj.Width, obj.Height = pil.width, pil.height
+                images[kind]["count"] += 1
+                images[kind]["bytes_before"] += old_size
+                images[kind]["bytes_after"] += len(new_data)
+                record["objects"] += 1
+                record["bytes_saved"] += old_size - len(new_data)
+
+        with step("serialize"):
+            out = io.BytesIO()
+            pdf.save(out, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+            pages = len(pdf.pages)
+    finally:
+        pdf.close()
+
+    result = out.getvalue()
+    step.finish(data, result, pages, stats)
+    if stats is not None:
+        stats["images"] = {kind: counts for kind, counts in images.items() if counts["count"]}
+    return result
+
+
+# Batch compression (command line)
+
+
+def compress_file(src: str | Path, dst: str | Path, algorithm: str = "lossless", **options: Any) -> dict:
+    """Compress the PDF at `src` into `dst`, replacing `dst` atomically.
+
+    The original bytes are written instead when compressing does not make
+    the file smaller. Returns 'input_size', 'output_size' and 'seconds'.
+    """
+    t0 = time.perf_counter()
+    data = Path(src).read_bytes()
+    result = compress_bytes(data, algorithm, **options)
+    if len(result) >= len(data):
+        result = data
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # a unique temporary name: several workers may write to the same directory
+    fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=f".{dst.name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(result)
+        os.replace(tmp, dst)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+    return {"input_size": len(data), "output_size": len(result), "seconds": time.perf_counter() - t0}
+
+
+def _compress_job(src: str, dst: str, algorithm: str, options: dict) -> dict:
+    try:
+        return compress_file(src, dst, algorithm, **options)
+    except Exception as exc:
+        return {"error": str(exc) or type(exc).__name__}
+
+
+def _unique(dst: Path, taken: set) -> Path:
+    """`dst`, or `dst` numbered (x_2.pdf, x_3.pdf, ...) past the destinations already taken."""
+    name, n = dst, 1
+    while name in taken:
+        n += 1
+        name = dst.with_name(f"{dst.stem}_{n}{dst.suffix}")
+    taken.add(name)
+    return name
+
+
+def _plan(inputs: List[str], output_dir: Path, recursive: bool) -> List[Tuple[Path, Path]]:
+    """(source, destination) pairs; directory inputs keep their layout under output_dir.
+
+    Two sources that map to the same destination (a/x.pdf and b/x.pdf) get
+    numbered names in input order; a source listed twice is compressed once.
+    """
+    pairs: List[Tuple[Path, Path]] = []
+    seen: set = set()
+    taken: set = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            pattern = "**/*.pdf" if recursive else "*.pdf"
+            sources = sorted(x for x in path.glob(pattern) if x.is_file())
+            found = [(src, output_dir / src.relative_to(path)) for src in sources]
+        else:
+            found = [(path, output_dir / path.name)]
+        for src, dst in found:
+            if src.resolve() in seen:
+                continue
+            seen.add(src.resolve())
+            pairs.append((src, _unique(dst, taken)))
+    return pairs
+
+
+def _up_to_date(src: Path, dst: Path) -> bool:
+    try:
+        return dst.stat().st_mtime >= src.stat().st_mtime
+    except OSError:
+        return False
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Compress PDF files")
+    p.add_argument("inputs", nargs="+", help="PDF files or directories to compress")
+    p.add_argument("-o", "--output-dir", required=True, help="Directory for the compressed files")
+    p.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+    p.add_argument("-a", "--algorithm", choices=ALGORITHMS, default="lossless", help="Default 'lossless'")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    p.add_argument("--force", action="store_true", help="Also compress files whose output is newer than the input")
+    p.add_argument("--remove-metadata", action="store_true", help="Drop document info and XMP metadata")
+    p.add_argument("--subset-fonts", action="store_true", help="lossless: subset TrueType fonts (needs fonttools)")
+    p.add_argument("--linearize", action="store_true", help="optimize: linearize for fast web view")
+    p.add_argument("--target-dpi", type=float, default=150, help="downscale: target resolution (default 150)")
+    p.add_argument("--max-px", type=int, default=None, help="downscale: also cap image sides at this many pixels")
+    p.add_argument("--jpeg-quality", type=int, default=75, help="downscale: JPEG quality (default 75)")
+    args = p.parse_args(argv)
+
+    options: Dict[str, Any] = {"remove_metadata": args.remove_metadata}
+    if args.algorithm == "lossless":
+        # parallelism comes from the process pool; one thread per file
+        options.update(subset_fonts=args.subset_fonts, jobs=1)
+    elif args.algorithm == "optimize":
+        options.update(linearize=args.linearize)
+    else:
+        options.update(target_dpi=args.target_dpi, max_px=args.max_px, jpeg_quality=args.jpeg_quality)
+
+    pairs = _plan(args.inputs, Path(args.output_dir), args.recursive)
+    if not pairs:
+        print("No PDF files found.", file=sys.stderr)
+        return 2
+    todo = [(src, dst) for src, dst in pairs if args.force or not _up_to_date(src, dst)]
+
+    t0 = time.perf_counter()
+    done = failed = 0
+    size_in = size_out = 0
+    if todo:
+        with ProcessPoolExecutor(max_workers=min(args.jobs or os.cpu_count() or 1, len(todo))) as pool:
+            futures = {
+                pool.submit(_compress_job, str(src), str(dst), args.algorithm, options): src for src, dst in todo
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                if "error" in result:
+                    failed += 1
+                    print(f"Error: {futures[future]}: {result['error']}", file=sys.stderr)
+                    continue
+                done += 1
+                size_in += result["input_size"]
+                size_out += result["output_size"]
+    elapsed = time.perf_counter() - t0
+
+    mib = 1024 * 1024
+    saved = size_in - size_out
+    print(
+        f"Compressed {done} file(s), skipped {len(pairs) - len(todo)} up to date, {failed} failed, "
+        f"in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} files/s, "
+        f"{size_in / mib / elapsed if elapsed else 0:.1f} MiB/s)"
+    )
+    if size_in:
+        print(f"{size_in / mib:.1f} MiB -> {size_out / mib:.1f} MiB, saved {saved / mib:.1f} MiB ({saved / size_in:.0%})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
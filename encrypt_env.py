@@ -4,53 +4,213 @@ Encrypt/Decrypt .env file to protect sensitive credentials
 Usage:
     python encrypt_env.py encrypt  - Encrypts .env to .env.encrypted
     python encrypt_env.py decrypt  - Decrypts .env.encrypted to .env
+    python encrypt_env.py upgrade  - Re-encrypts .env.encrypted with the current KDF settings
+
+Options for encrypt/upgrade:
+    --kdf scrypt|pbkdf2   key derivation function (default: scrypt, or $ENV_KDF)
+    --cost N              scrypt: log2 of N (default 15); pbkdf2: iterations (default 600000)
+
+The webapp does not need a decrypted .env: with ENV_PASSWORD set it loads
+.env.encrypted straight into the process environment (load_encrypted_env).
 """
 
-import sys
+import base64
+import hashlib
+import io
+import json
 import os
+import sys
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+
 from cryptography.fernet import Fernet
 import getpass
 
-def get_encryption_key():
-    """Get or create encryption key from user password"""
-    # Prompt for password
-    password = getpass.getpass("Enter encryption password: ")
-    
-    # Derive a key from the password (simple approach - use 32 bytes)
-    # For production, use proper KDF like PBKDF2
-    from hashlib import sha256
-    key = sha256(password.encode()).digest()
-    
+# Files written by this version start with this line, followed by the JSON
+# KDF parameters and the Fernet token. Files without it are the original
+# format (key = SHA-256 of the password) and can still be read.
+HEADER = b"#pdftools-env v1 "
+
+DEFAULT_KDF = "scrypt"
+DEFAULT_COST = {"scrypt": 15, "pbkdf2": 600_000}
+
+# Keys derived in this process, by fingerprint of the KDF parameters. Forked
+# workers inherit them; they are never put in the environment, which every
+# child process (and anything it execs) would inherit as well.
+_key_cache: Dict[str, bytes] = {}
+
+# Names an inherited file descriptor to read "<fingerprint>:<key>" lines from,
+# once (see share_key): how a re-exec'd worker gets the key without the KDF.
+KEY_FD_VAR = "ENV_KEY_FD"
+
+
+def get_password(prompt: str = "Enter encryption password: ", interactive: bool = True) -> str:
+    """Password from $ENV_PASSWORD, $ENV_PASSWORD_FILE, or an interactive prompt"""
+    if os.environ.get("ENV_PASSWORD"):
+        return os.environ["ENV_PASSWORD"]
+    if os.environ.get("ENV_PASSWORD_FILE"):
+        return Path(os.environ["ENV_PASSWORD_FILE"]).read_text().rstrip("\n")
+    if not interactive:
+        raise ValueError("No password: set ENV_PASSWORD or ENV_PASSWORD_FILE")
+    return getpass.getpass(prompt)
+
+
+def new_params(kdf: Optional[str] = None, cost: Optional[int] = None) -> dict:
+    """Fresh KDF parameters (random salt) for encrypting"""
+    kdf = (kdf or os.environ.get("ENV_KDF") or DEFAULT_KDF).lower()
+    if kdf not in DEFAULT_COST:
+        raise ValueError(f"Unknown KDF '{kdf}' (choose from: scrypt, pbkdf2)")
+    if cost is None:
+        cost = int(os.environ.get("ENV_KDF_COST") or DEFAULT_COST[kdf])
+    params = {"kdf": kdf, "salt": base64.b64encode(os.urandom(16)).decode()}
+    if kdf == "scrypt":
+        params.update({"n": 2 ** cost, "r": 8, "p": 1})
+    else:
+        params.update({"iterations": cost, "hash": "sha256"})
+    return params
+
+
+def derive_key(password: str, params: Optional[dict]) -> bytes:
+    """Fernet key for `password`; `params` None means the legacy SHA-256 key"""
+    secret = password.encode()
+    if params is None:
+        key = hashlib.sha256(secret).digest()
+    elif params["kdf"] == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        key = hashlib.scrypt(
+            secret, salt=base64.b64decode(params["salt"]), n=n, r=r, p=p,
+            maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=32,
+        )
+    elif params["kdf"] == "pbkdf2":
+        key = hashlib.pbkdf2_hmac(
+            params.get("hash", "sha256"), secret, base64.b64decode(params["salt"]), params["iterations"], dklen=32,
+        )
+    else:
+        raise ValueError(f"Unknown KDF '{params['kdf']}'")
     # Fernet requires base64-encoded 32-byte key
-    import base64
     return base64.urlsafe_b64encode(key)
 
-def encrypt_env():
+
+def encrypt_bytes(data: bytes, password: str, params: Optional[dict] = None) -> bytes:
+    """Encrypted file contents: header line with KDF parameters + Fernet token"""
+    params = params or new_params()
+    token = Fernet(derive_key(password, params)).encrypt(data)
+    return HEADER + json.dumps(params, sort_keys=True).encode() + b"\n" + token
+
+
+def split_blob(blob: bytes) -> Tuple[Optional[dict], bytes]:
+    """(KDF parameters or None for the legacy format, Fernet token)"""
+    if blob.startswith(HEADER):
+        header, _, token = blob.partition(b"\n")
+        return json.loads(header[len(HEADER):]), token.strip()
+    return None, blob.strip()
+
+
+def _fingerprint(params: Optional[dict]) -> str:
+    raw = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def _cached_key(params: Optional[dict]) -> Optional[bytes]:
+    fd = os.environ.pop(KEY_FD_VAR, None)
+    if fd is not None:
+        with os.fdopen(int(fd), "rb") as f:
+            for line in f.read().decode().splitlines():
+                fingerprint, _, key = line.partition(":")
+                if key:
+                    _key_cache[fingerprint] = key.encode()
+    return _key_cache.get(_fingerprint(params))
+
+
+def share_key() -> Optional[int]:
+    """A pipe's read end holding the keys cached here, for a child that is exec'd
+
+    Start the child with this fd inherited (subprocess ``pass_fds``) and
+    $ENV_KEY_FD set to its number; the child reads the keys once and closes
+    it. Close the fd here once the child started. None when no key is cached.
+    """
+    if not _key_cache:
+        return None
+    read, write = os.pipe()
+    with os.fdopen(write, "wb") as f:
+        f.write("".join(f"{fp}:{key.decode()}\n" for fp, key in _key_cache.items()).encode())
+    return read
+
+
+def decrypt_bytes(
+    blob: bytes, password: Optional[str] = None, use_cache: bool = False, interactive: bool = True,
+) -> bytes:
+    """Decrypt file contents written by encrypt_bytes (or by the legacy format)
+
+    With `use_cache`, a key derived by an earlier call in this process (or
+    its parent, before the fork, or handed over by share_key) is used
+    instead of running the KDF, and a freshly derived key is kept for later.
+    """
+    params, token = split_blob(blob)
+    key = _cached_key(params) if use_cache else None
+    if key is None:
+        if password is None:
+            password = get_password(interactive=interactive)
+        key = derive_key(password, params)
+        if use_cache:
+            _key_cache[_fingerprint(params)] = key
+    return Fernet(key).decrypt(token)
+
+
+def load_encrypted_env(path: Path, password: Optional[str] = None, override: bool = False) -> Dict[str, str]:
+    """Decrypt `path` in memory and add its variables to os.environ
+
+    Nothing is written to disk. Like python-dotenv, variables that are
+    already set win unless `override` is true. Returns the parsed values.
+    """
+    from dotenv import dotenv_values
+
+    blob = Path(path).read_bytes()
+    data = decrypt_bytes(blob, password, use_cache=True, interactive=False)
+    values = dotenv_values(stream=io.StringIO(data.decode("utf-8")))
+    for name, value in values.items():
+        if value is not None and (override or name not in os.environ):
+            os.environ[name] = value
+    # the derived key (cached above) only opens this file; drop the password
+    os.environ.pop("ENV_PASSWORD", None)
+    return {k: v for k, v in values.items() if v is not None}
+
+
+def _parse_kdf_options(args):
+    kdf, cost = None, None
+    it = iter(args)
+    for arg in it:
+        if arg == "--kdf":
+            kdf = next(it, None)
+        elif arg == "--cost":
+            cost = int(next(it, "0"))
+        else:
+            raise ValueError(f"Unknown option: {arg}")
+    return new_params(kdf, cost)
+
+
+def encrypt_env(params: Optional[dict] = None):
     """Encrypt .env file"""
     env_file = Path(__file__).parent / ".env"
     encrypted_file = Path(__file__).parent / ".env.encrypted"
-    
+
     if not env_file.exists():
         print("❌ .env file not found!")
         return False
-    
+
     # Read .env content
     with open(env_file, 'rb') as f:
         data = f.read()
-    
-    # Get encryption key from password
-    key = get_encryption_key()
-    
-    # Encrypt
-    fernet = Fernet(key)
-    encrypted_data = fernet.encrypt(data)
-    
+
+    # Encrypt with a key derived from the password
+    params = params or new_params()
+    encrypted_data = encrypt_bytes(data, get_password(), params)
+
     # Write encrypted file
     with open(encrypted_file, 'wb') as f:
         f.write(encrypted_data)
-    
-    print(f"✅ Encrypted .env → .env.encrypted")
+
+    print(f"✅ Encrypted .env → .env.encrypted ({params['kdf']})")
     print(f"⚠️  Keep .env.encrypted in version control")
     print(f"⚠️  Add .env to .gitignore")
     print(f"⚠️  Remember your encryption password!")
@@ -60,27 +220,23 @@ def decrypt_env():
     """Decrypt .env.encrypted file"""
     encrypted_file = Path(__file__).parent / ".env.encrypted"
     env_file = Path(__file__).parent / ".env"
-    
+
     if not encrypted_file.exists():
         print("❌ .env.encrypted file not found!")
         return False
-    
+
     # Read encrypted content
     with open(encrypted_file, 'rb') as f:
         encrypted_data = f.read()
-    
-    # Get encryption key from password
-    key = get_encryption_key()
-    
+
     try:
         # Decrypt
-        fernet = Fernet(key)
-        decrypted_data = fernet.decrypt(encrypted_data)
-        
+        decrypted_data = decrypt_bytes(encrypted_data)
+
         # Write .env file
         with open(env_file, 'wb') as f:
             f.write(decrypted_data)
-        
+
         print(f"✅ Decrypted .env.encrypted → .env")
         return True
     except Exception as e:
@@ -88,22 +244,52 @@ def decrypt_env():
         print(f"   Error: {str(e)}")
         return False
 
+def upgrade_env(params: Optional[dict] = None):
+    """Re-encrypt .env.encrypted with new KDF parameters (same password)"""
+    encrypted_file = Path(__file__).parent / ".env.encrypted"
+
+    if not encrypted_file.exists():
+        print("❌ .env.encrypted file not found!")
+        return False
+
+    password = get_password()
+    try:
+        data = decrypt_bytes(encrypted_file.read_bytes(), password)
+    except Exception as e:
+        print(f"❌ Decryption failed! Wrong password or corrupted file.")
+        print(f"   Error: {str(e)}")
+        return False
+
+    params = params or new_params()
+    encrypted_file.write_bytes(encrypt_bytes(data, password, params))
+    print(f"✅ Re-encrypted .env.encrypted ({params['kdf']})")
+    return True
+
 def main():
     if len(sys.argv) < 2:
         print("Usage:")
-        print("  python encrypt_env.py encrypt  - Encrypt .env file")
+        print("  python encrypt_env.py encrypt [--kdf scrypt|pbkdf2] [--cost N]  - Encrypt .env file")
         print("  python encrypt_env.py decrypt  - Decrypt .env.encrypted file")
+        print("  python encrypt_env.py upgrade [--kdf scrypt|pbkdf2] [--cost N]  - Re-encrypt with new KDF settings")
         sys.exit(1)
-    
+
     command = sys.argv[1].lower()
-    
+
+    try:
+        params = _parse_kdf_options(sys.argv[2:]) if command in ("encrypt", "upgrade") else None
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
     if command == "encrypt":
-        encrypt_env()
+        encrypt_env(params)
     elif command == "decrypt":
         decrypt_env()
+    elif command == "upgrade":
+        upgrade_env(params)
     else:
         print(f"❌ Unknown command: {command}")
-        print("Use 'encrypt' or 'decrypt'")
+        print("Use 'encrypt', 'decrypt' or 'upgrade'")
         sys.exit(1)
 
 if __name__ == "__main__":
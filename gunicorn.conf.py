@@ -0,0 +1,36 @@
+"""gunicorn settings for production.
+
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py webapp:app
+
+The app is imported once in the master (``preload_app``) with the
+production flags below, so the heavy PDF libraries are loaded and warmed
+before forking and shared copy-on-write by all workers. Without
+``preload_app`` each worker warms itself when it imports the app.
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+os.environ.setdefault("PDFTOOLS_PRODUCTION", "1")
+os.environ.setdefault("PDFTOOLS_WARMUP", "1")
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the collector's reach; otherwise
+    # the first GC pass in each worker writes to (and so copies) those pages.
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    # a worker killed mid-request (timeout, OOM kill) never released its
+    # share of the admission budget; give it back for it
+    admission = sys.modules.get("webapp.admission")
+    if admission is not None:
+        admission.budget.reclaim(worker.pid)
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""Watch a folder and merge (and optionally compress) PDFs as they arrive.
+
+Usage examples:
+  python hot_folder.py /srv/scans -r -o /srv/merged --archive /srv/scans-done
+  python hot_folder.py inbox/ -o out/ --batch-size 20 --batch-window 30 --compress lossless
+
+New files are noticed through inotify (Linux, via ctypes) or, where that is
+not available, by polling the tree with merge_pdfs' own file gathering. A
+file is used once its size and modification time have not changed for
+`--settle` seconds and it ends in a complete PDF trailer (scanners writing
+over SMB close and reopen files several times). Ready files are batched
+until `--batch-size` files are waiting or the oldest has waited
+`--batch-window` seconds, and each batch is merged by a bounded process pool
+into `--output-dir`.
+
+Processed inputs are moved under `--archive` when given; otherwise they are
+left in place and remembered (until they change) for the life of the process.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from merge_pdfs import _gather_files, merge_pdfs
+from preflight import PreflightError, _check_structure, preflight
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+Signature = Tuple[int, int]  # (size, mtime_ns)
+
+
+class _Inotify:
+    """Recursive directory watch reporting created, written and moved-in paths."""
+
+    def __init__(self, root: Path, recursive: bool) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.recursive = recursive
+        self.dirs: Dict[int, Path] = {}
+
+    def start(self) -> List[Path]:
+        return self.watch(self.root)
+
+    def watch(self, directory: Path) -> List[Path]:
+        """Watch `directory` (and its subdirectories when recursive); returns the PDFs already there."""
+        found: List[Path] = []
+        wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            # removed again before we got to it
+            return found
+        self.dirs[wd] = directory
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        found.extend(self.watch(Path(entry.path)))
+                elif entry.name.lower().endswith(".pdf"):
+                    found.append(Path(entry.path))
+        return found
+
+    def read(self, timeout: float, wake: int) -> Optional[List[Path]]:
+        """Paths touched within `timeout` seconds (or until `wake` is readable); None when events were lost."""
+        ready, _, _ = select.select([self.fd, wake], [], [], timeout)
+        if self.fd not in ready:
+            return []
+        paths: List[Path] = []
+        overflow = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                directory = self.dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = directory / os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    if self.recursive:
+                        # files may already be in a directory moved or copied in
+                        paths.extend(self.watch(path))
+                elif path.name.lower().endswith(".pdf"):
+                    paths.append(path)
+        return None if overflow else paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _Poller:
+    """Fallback: rescan the tree every `interval` seconds."""
+
+    def __init__(self, root: Path, recursive: bool, interval: float) -> None:
+        self.args = argparse.Namespace(files=[str(root)], recursive=recursive)
+        self.interval = interval
+        self.seen: Dict[str, Signature] = {}
+
+    def start(self) -> List[Path]:
+        return self.scan()
+
+    def scan(self) -> List[Path]:
+        changed: List[Path] = []
+        current: Dict[str, Signature] = {}
+        for name in _gather_files(self.args):
+            sig = _signature(Path(name))
+            if sig is None:
+                continue
+            current[name] = sig
+            if self.seen.get(name) != sig:
+                changed.append(Path(name))
+        self.seen = current
+        return changed
+
+    def read(self, timeout: float, wake: int) -> Optional[List[Path]]:
+        select.select([wake], [], [], min(timeout, self.interval))
+        return self.scan()
+
+    def close(self) -> None:
+        pass
+
+
+def _signature(path: Path) -> Optional[Signature]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def process_batch(
+    files: List[str],
+    output: str,
+    backend: Optional[str] = None,
+    output_format: str = "standard",
+    compress: Optional[str] = None,
+) -> dict:
+    """Merge `files` into `output` (replaced atomically), then optionally compress it.
+
+    Inputs failing preflight are left out rather than failing the batch;
+    they are returned in 'skipped' as (path, reason) pairs.
+    """
+    skipped: List[Tuple[str, str]] = []
+    try:
+        preflight(files)
+    except PreflightError as exc:
+        skipped = [(f.path, f.reason) for f in exc.failures]
+        bad = {path for path, _ in skipped}
+        files = [f for f in files if f not in bad]
+    if not files:
+        return {"output": None, "size": 0, "skipped": skipped}
+
+    out = Path(output)
+    fd, tmp = tempfile.mkstemp(dir=out.parent, prefix=f".{out.name}.", suffix=".part")
+    os.close(fd)
+    try:
+        merge_pdfs(files, tmp, backend=backend, output_format=output_format, check=False)
+        if compress:
+            from compress_pdfs import compress_file
+
+            compress_file(tmp, tmp, compress)
+        os.replace(tmp, out)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return {"output": output, "size": out.stat().st_size, "skipped": skipped}
+
+
+class HotFolder:
+    """Watches `root` and hands settled PDFs to a process pool in batches."""
+
+    def __init__(
+        self,
+        root: str | Path,
+        output_dir: str | Path,
+        recursive: bool = False,
+        archive: str | Path | None = None,
+        settle: float = 2.0,
+        batch_size: int = 50,
+        batch_window: float = 10.0,
+        jobs: int = 2,
+        poll: Optional[float] = None,
+        existing: bool = False,
+        backend: Optional[str] = None,
+        output_format: str = "standard",
+        compress: Optional[str] = None,
+        prefix: str = "batch",
+        log=print,
+    ) -> None:
+        self.root = Path(root).resolve()
+        self.output_dir = Path(output_dir).resolve()
+        self.archive = Path(archive).resolve() if archive else None
+        self.recursive = recursive
+        self.settle = settle
+        # a file that never gets a complete trailer is reported after this long
+        self.give_up = max(60.0, settle * 10)
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.jobs = jobs
+        self.poll = poll
+        self.existing = existing
+        self.merge_options = {"backend": backend, "output_format": output_format, "compress": compress}
+        self.prefix = prefix
+        self.log = log
+        for other in (self.output_dir, self.archive):
+            if other is not None and (other == self.root or (recursive and self.root in other.parents)):
+                raise ValueError(f"{other} must not be inside the watched folder {self.root}")
+
+        # path -> (signature, when it last changed, when first seen)
+        self.pending: Dict[Path, Tuple[Optional[Signature], float, float]] = {}
+        self.ready: List[Tuple[Path, float]] = []
+        self.done: Dict[Path, Signature] = {}
+        self.in_flight: Dict[Future, Tuple[List[Tuple[Path, float]], str]] = {}
+        self.stop_event = threading.Event()
+        # stop() writes here so a long wait for events ends at once
+        self._wake_r, self._wake_w = os.pipe()
+        self.batches = 0
+        self._seq = 0
+
+    # watching
+
+    def _watcher(self):
+        if self.poll is None:
+            try:
+                return _Inotify(self.root, self.recursive), "inotify"
+            except (AttributeError, OSError) as exc:
+                self.log(f"inotify not available ({exc}); polling every 2s")
+                self.poll = 2.0
+        return _Poller(self.root, self.recursive, self.poll), "polling"
+
+    def notice(self, paths: Iterable[Path]) -> None:
+        now = time.monotonic()
+        for path in paths:
+            sig = _signature(path)
+            if sig is None or self.done.get(path) == sig:
+                continue
+            _, _, first = self.pending.get(path, (None, now, now))
+            self.pending[path] = (sig, now, first)
+
+    def _settle(self) -> None:
+        now = time.monotonic()
+        queued = {path for path, _ in self.ready}
+        for path, (sig, changed, first) in list(self.pending.items()):
+            current = _signature(path)
+            if current is None:
+                del self.pending[path]
+                continue
+            if current != sig:
+                self.pending[path] = (current, now, first)
+                continue
+            if now - changed < self.settle:
+                continue
+            try:
+                _check_structure(str(path))
+            except (OSError, ValueError) as exc:
+                if now - first >= self.give_up:
+                    self.log(f"Error: {path}: {exc}; skipped until it changes")
+                    self.done[path] = current
+                    del self.pending[path]
+                continue
+            del self.pending[path]
+            if path not in queued:
+                self.ready.append((path, first))
+
+    # batching
+
+    def _output_name(self) -> str:
+        self._seq += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return str(self.output_dir / f"{self.prefix}-{stamp}-{self._seq:04d}.pdf")
+
+    def _flush(self, pool: ProcessPoolExecutor, force: bool = False) -> None:
+        while self.ready and len(self.in_flight) < self.jobs:
+            oldest = min(first for _, first in self.ready)
+            if not force and len(self.ready) < self.batch_size and time.monotonic() - oldest < self.batch_window:
+                return
+            batch, self.ready = self.ready[:self.batch_size], self.ready[self.batch_size:]
+            files = sorted(str(path) for path, _ in batch)
+            future = pool.submit(process_batch, files, self._output_name(), **self.merge_options)
+            self.in_flight[future] = (batch, files[0])
+
+    def _collect(self) -> None:
+        for future in [f for f in self.in_flight if f.done()]:
+            batch, _ = self.in_flight.pop(future)
+            latency = time.monotonic() - min(first for _, first in batch)
+            merged: Set[str] = set()
+            try:
+                result = future.result()
+            except Exception as exc:
+                self.log(f"Error: batch of {len(batch)} file(s) failed: {exc}")
+            else:
+                for path, reason in result["skipped"]:
+                    self.log(f"Error: {path}: {reason}; skipped until it changes")
+                merged = {str(path) for path, _ in batch} - {path for path, _ in result["skipped"]}
+                if result["output"]:
+                    self.batches += 1
+                    self.log(f"Merged {len(merged)} file(s) into {result['output']} ({latency:.1f}s after arrival)")
+            for path, _ in batch:
+                if self.archive is not None and str(path) in merged:
+                    self._archive(path)
+                    continue
+                # failed inputs are not retried until they change
+                sig = _signature(path)
+                if sig is not None:
+                    self.done[path] = sig
+
+    def _archive(self, path: Path) -> None:
+        target = self.archive / path.relative_to(self.root)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(path), str(target))
+
+    def _timeout(self) -> float:
+        waits = [self.settle / 2 if self.pending else self.batch_window]
+        if self.ready:
+            waits.append(self.batch_window / 2)
+        if self.in_flight:
+            waits.append(0.2)
+        return max(0.05, min(waits))
+
+    def run(self) -> None:
+        """Watch until stop() is called; waiting batches are flushed before returning."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        watcher, kind = self._watcher()
+        present = watcher.start()
+        self.log(f"Watching {self.root} ({kind}), writing to {self.output_dir}")
+        if self.existing:
+            self.notice(present)
+        else:
+            # files that were there before we started are left alone
+            for path in present:
+                sig = _signature(path)
+                if sig is not None:
+                    self.done[path] = sig
+        try:
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                while not self.stop_event.is_set():
+                    touched = watcher.read(self._timeout(), self._wake_r)
+                    if touched is None:
+                        # the kernel queue overflowed: one full rescan
+                        touched = [Path(p) for p in _gather_files(
+                            argparse.Namespace(files=[str(self.root)], recursive=self.recursive))]
+                    self.notice(touched)
+                    self._settle()
+                    self._collect()
+                    self._flush(pool)
+                self._settle()
+                while self.ready or self.in_flight:
+                    self._flush(pool, force=True)
+                    time.sleep(0.05)
+                    self._collect()
+        finally:
+            watcher.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        with contextlib.suppress(OSError):
+            # already closed when run() has returned
+            os.write(self._wake_w, b"\0")
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Merge PDFs dropped into a folder as they arrive")
+    p.add_argument("folder", help="Folder to watch")
+    p.add_argument("-o", "--output-dir", required=True, help="Directory for merged files (outside the folder)")
+    p.add_argument("-r", "--recursive", action="store_true", help="Watch subdirectories too")
+    p.add_argument("--archive", help="Move processed inputs here (outside the folder)")
+    p.add_argument("--existing", action="store_true", help="Also process PDFs already in the folder at start")
+    p.add_argument("--settle", type=float, default=2.0, help="Seconds a file must be unchanged (default 2)")
+    p.add_argument("--batch-size", type=int, default=50, help="Merge once this many files are ready (default 50)")
+    p.add_argument("--batch-window", type=float, default=10.0,
+                   help="...or once the oldest ready file has waited this many seconds (default 10)")
+    p.add_argument("-j", "--jobs", type=int, default=2, help="Batches processed at once (default 2)")
+    p.add_argument("--poll", type=float, default=None, help="Poll every N seconds instead of using inotify")
+    p.add_argument("--compress", choices=("lossless", "optimize", "downscale"), help="Compress each merged file")
+    p.add_argument("--prefix", default="batch", help="Output file name prefix (default 'batch')")
+    p.add_argument("--backend", default=None, help="Merge backend (default: $MERGE_BACKEND or 'pypdf2')")
+    p.add_argument("--output-format", choices=("standard", "compact"), default="standard")
+    args = p.parse_args(argv)
+
+    try:
+        folder = HotFolder(
+            args.folder, args.output_dir, recursive=args.recursive, archive=args.archive, settle=args.settle,
+            batch_size=args.batch_size, batch_window=args.batch_window, jobs=args.jobs, poll=args.poll,
+            existing=args.existing, backend=args.backend, output_format=args.output_format,
+            compress=args.compress, prefix=args.prefix, log=lambda msg: print(msg, flush=True),
+        )
+    except ValueError as exc:
+        print("Error:", exc, file=sys.stderr)
+        return 1
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: folder.stop())
+    folder.run()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
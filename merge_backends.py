@@ -0,0 +1,476 @@
+"""PDF libraries that can do the work behind merge_pdfs.
+
+Two implementations of the same small interface:
+
+  pypdf2   pure-Python PyPDF2 (default; the original implementation)
+  pikepdf  qpdf through pikepdf: page import and resizing run in native code
+
+Select one with ``get_backend(name)``; ``None`` falls back to the
+``MERGE_BACKEND`` environment variable and then to 'pypdf2'.
+"""
+from __future__ import annotations
+
+import bisect
+from abc import ABC, abstractmethod
+import hashlib
+import io
+import os
+import weakref
+from typing import Any, BinaryIO, Callable, Dict, Hashable, Iterable, Iterator, List, Tuple, Type
+
+from PyPDF2 import PageObject, PdfReader, PdfWriter
+from PyPDF2.generic import IndirectObject
+
+DEFAULT_BACKEND = "pypdf2"
+
+# 'standard': classic xref table, objects written as the library produces them
+# 'compact':  objects packed into compressed object streams with an xref
+#             stream, uncompressed streams Flate-compressed (PDF 1.5+)
+OUTPUT_FORMATS = ("standard", "compact")
+
+_INHERITABLE_PAGE_ATTRS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def _parse_page_ranges(spec: str, num_pages: int) -> list[int]:
+    """Turn a 1-based range string like '1-3,10,12-' into 0-based page indices."""
+    indices: list[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start_s, end_s = part.split("-", 1)
+            start = int(start_s) if start_s.strip() else 1
+            end = int(end_s) if end_s.strip() else num_pages
+        else:
+            start = end = int(part)
+        if start < 1 or end > num_pages or start > end:
+            raise ValueError(f"Page range '{part}' is outside 1-{num_pages}")
+        indices.extend(range(start - 1, end))
+    if not indices:
+        raise ValueError(f"Empty page range: '{spec}'")
+    return indices
+
+
+def _resolve(remap: Dict[Any, Any], key: Any) -> Any:
+    while key in remap:
+        key = remap[key]
+    return key
+
+
+def _find_duplicates(ids: Iterable[Any], key_for: Callable[[Any, Dict[Any, Any]], Hashable]) -> Dict[Any, Any]:
+    """Map each duplicate stream id to the id of its canonical copy.
+
+    Repeats until nothing changes: once two images' /SMask streams have been
+    merged, the images themselves compare equal on the next pass.
+    """
+    ids = list(ids)
+    remap: Dict[Any, Any] = {}
+    while True:
+        seen: Dict[Hashable, Any] = {}
+        found: Dict[Any, Any] = {}
+        for sid in ids:
+            if sid in remap:
+                continue
+            key = key_for(sid, remap)
+            if key in seen:
+                found[sid] = seen[key]
+            else:
+                seen[key] = sid
+        if not found:
+            return remap
+        remap.update(found)
+
+
+def _scale_factor(size: tuple[float, float], target: tuple[float, float]) -> float:
+    """Uniform scale that fits `size` into `target` (preserving aspect ratio)."""
+    w, h = size
+    target_w, target_h = target
+    scale_x = target_w / w if w else 1.0
+    scale_y = target_h / h if h else 1.0
+    return min(scale_x, scale_y)
+
+
+class MergeBackend(ABC):
+    """Interface shared by the backends.
+
+    A merge opens every source, picks pages from them, adds each page
+    (optionally fitted to a target size) to an output document and writes it.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def open(self, path: str) -> Any:
+        """Open a source document. Raises ValueError for encrypted files."""
+
+    def close(self, doc: Any) -> None:
+        """Release a source document once the output has been written."""
+
+    @abstractmethod
+    def page_count(self, doc: Any) -> int:
+        """Number of pages in `doc`."""
+
+    @abstractmethod
+    def pages(self, doc: Any, ranges: str | None = None) -> List[Any]:
+        """Pages of `doc` selected by a 1-based range string (all if empty)."""
+
+    @abstractmethod
+    def page_size(self, page: Any) -> tuple[float, float]:
+        """(width, height) of the page's MediaBox in points."""
+
+    @abstractmethod
+    def new_output(self) -> Any:
+        """An empty output document."""
+
+    @abstractmethod
+    def add_page(self, out: Any, page: Any, target: tuple[float, float] | None = None) -> None:
+        """Append `page` to `out`, scaled to fit `target` if given."""
+
+    @abstractmethod
+    def dedup(self, out: Any) -> Tuple[int, int]:
+        """Share identical stream objects (fonts, images, ICC profiles...) in `out`.
+
+        Streams with equal data and equal dictionaries are collapsed into one
+        object and every reference is pointed at it. Returns
+        (objects removed, stream bytes saved).
+        """
+
+    @abstractmethod
+    def write(self, out: Any, stream: BinaryIO, output_format: str = "standard") -> None:
+        """Serialize `out` to `stream` in one of OUTPUT_FORMATS."""
+
+
+class PyPDF2Backend(MergeBackend):
+    name = "pypdf2"
+
+    def open(self, path: str) -> PdfReader:
+        reader = PdfReader(str(path))
+        if getattr(reader, "is_encrypted", False):
+            try:
+                # try decrypt with empty password
+                ok = reader.decrypt("")
+            except Exception:
+                ok = 0
+            if not ok:
+                raise ValueError(f"Encrypted PDF: {path}")
+        return reader
+
+    def page_count(self, doc: PdfReader) -> int:
+        return _page_count(doc)
+
+    def pages(self, doc: PdfReader, ranges: str | None = None) -> List[PageObject]:
+        return list(_iter_pages(doc, ranges))
+
+    def page_size(self, page: PageObject) -> tuple[float, float]:
+        return float(page.mediabox.width), float(page.mediabox.height)
+
+    def new_output(self) -> PdfWriter:
+        return PdfWriter()
+
+    def add_page(self, out: PdfWriter, page: PageObject, target: tuple[float, float] | None = None) -> None:
+        if target:
+            _fit_page(page, target)
+        out.add_page(page)
+
+    def __init__(self) -> None:
+        # writers deduplicated through qpdf -> the qpdf document to write instead
+        self._repacked: "weakref.WeakKeyDictionary[PdfWriter, Any]" = weakref.WeakKeyDictionary()
+
+    def dedup(self, out: PdfWriter) -> Tuple[int, int]:
+        # PyPDF2 has no public way to drop or share objects in a writer, so the
+        # writer is handed to qpdf here and collapsed as the pikepdf backend does
+        import pikepdf
+
+        buf = io.BytesIO()
+        out.write(buf)
+        buf.seek(0)
+        pdf = pikepdf.Pdf.open(buf)
+        streams = {obj.objgen: obj for obj in pdf.objects if isinstance(obj, pikepdf.Stream)}
+        remap = collapse_pikepdf(pdf, streams)
+        saved = sum(len(streams[objgen].read_raw_bytes()) for objgen in remap)
+        self._repacked[out] = pdf
+        return len(remap), saved
+
+    def write(self, out: PdfWriter, stream: BinaryIO, output_format: str = "standard") -> None:
+        _check_output_format(output_format)
+        pdf = self._repacked.pop(out, None)
+        if pdf is None and output_format == "standard":
+            out.write(stream)
+            return
+        if pdf is None:
+            # PyPDF2 cannot write object/xref streams; let qpdf repack its output
+            import pikepdf
+
+            buf = io.BytesIO()
+            out.write(buf)
+            buf.seek(0)
+            pdf = pikepdf.Pdf.open(buf)
+        with pdf:
+            if output_format == "compact":
+                _save_compact(pdf, stream)
+            else:
+                pdf.save(stream)
+
+
+class PikepdfBackend(MergeBackend):
+    name = "pikepdf"
+
+    def __init__(self) -> None:
+        try:
+            import pikepdf
+        except ImportError as exc:  # pragma: no cover - pikepdf is in requirements.txt
+            raise ValueError("The pikepdf backend requires 'pikepdf'. Try: pip install pikepdf") from exc
+        self._pikepdf = pikepdf
+
+    def open(self, path: str) -> Any:
+        try:
+            # qpdf tries the empty password by itself
+            return self._pikepdf.Pdf.open(str(path))
+        except self._pikepdf.PasswordError:
+            raise ValueError(f"Encrypted PDF: {path}")
+
+    def close(self, doc: Any) -> None:
+        doc.close()
+
+    def page_count(self, doc: Any) -> int:
+        return len(doc.pages)
+
+    def pages(self, doc: Any, ranges: str | None = None) -> List[Any]:
+        if not ranges:
+            return list(doc.pages)
+        return [doc.pages[i] for i in _parse_page_ranges(ranges, len(doc.pages))]
+
+    def page_size(self, page: Any) -> tuple[float, float]:
+        llx, lly, urx, ury = (float(v) for v in page.mediabox)
+        return abs(urx - llx), abs(ury - lly)
+
+    def new_output(self) -> Any:
+        return self._pikepdf.Pdf.new()
+
+    def add_page(self, out: Any, page: Any, target: tuple[float, float] | None = None) -> None:
+        pikepdf = self._pikepdf
+        # copies the page and everything it references across (qpdf, native)
+        out.pages.append(page)
+        if not target:
+            return
+        new_page = out.pages[-1]
+        scale = _scale_factor(self.page_size(new_page), target)
+        # same result as PyPDF2's scale_to(): content scaled towards the origin,
+        # existing page boxes scaled, then the MediaBox set to the target size
+        new_page.contents_add(f"q {scale:.6f} 0 0 {scale:.6f} 0 0 cm\n".encode(), prepend=True)
+        new_page.contents_add(b"\nQ")
+        for box in ("/CropBox", "/ArtBox", "/BleedBox", "/TrimBox"):
+            if box in new_page.obj:
+                new_page.obj[box] = pikepdf.Array([float(v) * scale for v in new_page.obj[box]])
+        llx, lly = (float(v) * scale for v in list(new_page.mediabox)[:2])
+        new_page.obj["/MediaBox"] = pikepdf.Array([llx, lly, llx + target[0], lly + target[1]])
+        for annot in new_page.obj.get("/Annots", []):
+            if "/Rect" in annot:
+                annot["/Rect"] = pikepdf.Array([float(v) * scale for v in annot["/Rect"]])
+
+    def dedup(self, out: Any) -> Tuple[int, int]:
+        streams = {obj.objgen: obj for obj in out.objects if isinstance(obj, self._pikepdf.Stream)}
+        remap = collapse_pikepdf(out, streams)
+        # qpdf only writes objects that are still referenced
+        saved = sum(len(streams[objgen].read_raw_bytes()) for objgen in remap)
+        return len(remap), saved
+
+    def write(self, out: Any, stream: BinaryIO, output_format: str = "standard") -> None:
+        _check_output_format(output_format)
+        if output_format == "compact":
+            _save_compact(out, stream)
+        else:
+            out.save(stream)
+
+
+ObjGen = Tuple[int, int]
+
+
+def collapse_pikepdf(pdf: Any, candidates: Dict[ObjGen, Any]) -> Dict[ObjGen, ObjGen]:
+    """Collapse identical objects among `candidates` (objgen -> object) in `pdf`.
+
+    Streams compare by raw data and dictionary (without /Length), other
+    objects by value; references to already-collapsed objects count as
+    equal. Every reference to a duplicate is pointed at its canonical copy,
+    so the duplicates become unreferenced and qpdf no longer writes them.
+    Returns the duplicate -> canonical mapping.
+    """
+    import pikepdf
+
+    digests = {
+        objgen: hashlib.sha256(obj.read_raw_bytes()).digest()
+        for objgen, obj in candidates.items()
+        if isinstance(obj, pikepdf.Stream)
+    }
+
+    def canon(obj: Any, remap: Dict[ObjGen, ObjGen]) -> Hashable:
+        if not isinstance(obj, pikepdf.Object):
+            # numbers and booleans come back as Python values
+            return (type(obj).__name__, repr(obj))
+        if obj.is_indirect:
+            return ("R", _resolve(remap, obj.objgen))
+        return canon_direct(obj, remap)
+
+    def canon_direct(obj: Any, remap: Dict[ObjGen, ObjGen]) -> Hashable:
+        if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+            return ("D", tuple(sorted((k, canon(obj[k], remap)) for k in obj.keys() if k != "/Length")))
+        if isinstance(obj, pikepdf.Array):
+            return ("A", tuple(canon(v, remap) for v in obj))
+        return ("S", obj.unparse())
+
+    def key_for(objgen: ObjGen, remap: Dict[ObjGen, ObjGen]) -> Hashable:
+        return digests.get(objgen), canon_direct(candidates[objgen], remap)
+
+    remap = _find_duplicates(candidates, key_for)
+    if remap:
+        redirect_pikepdf(pdf, remap)
+    return remap
+
+
+def redirect_pikepdf(pdf: Any, remap: Dict[ObjGen, ObjGen]) -> None:
+    """Point every reference to an object in `remap` at the object it maps to."""
+    import pikepdf
+
+    stack = [obj for obj in pdf.objects if isinstance(obj, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream))]
+    stack.append(pdf.trailer)
+    while stack:
+        container = stack.pop()
+        keys = list(container.keys()) if not isinstance(container, pikepdf.Array) else range(len(container))
+        for key in keys:
+            value = container[key]
+            if not isinstance(value, pikepdf.Object):
+                continue
+            if value.is_indirect:
+                if value.objgen in remap:
+                    container[key] = pdf.get_object(_resolve(remap, value.objgen))
+            elif isinstance(value, (pikepdf.Dictionary, pikepdf.Array)):
+                stack.append(value)
+
+
+def _check_output_format(output_format: str) -> None:
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}' (choose from: {', '.join(OUTPUT_FORMATS)})")
+
+
+def _save_compact(pdf: Any, stream: BinaryIO) -> None:
+    import pikepdf
+
+    # streams that already carry a filter are copied as they are; only the
+    # unfiltered ones (e.g. content streams rewritten by a resize) get Flate
+    pdf.save(
+        stream,
+        object_stream_mode=pikepdf.ObjectStreamMode.generate,
+        compress_streams=True,
+        stream_decode_level=pikepdf.StreamDecodeLevel.none,
+    )
+
+
+BACKENDS: Dict[str, Type[MergeBackend]] = {
+    PyPDF2Backend.name: PyPDF2Backend,
+    PikepdfBackend.name: PikepdfBackend,
+}
+
+
+def get_backend(name: str | None = None) -> MergeBackend:
+    """Instantiate the backend `name` (or $MERGE_BACKEND, default 'pypdf2')."""
+    name = (name or os.environ.get("MERGE_BACKEND") or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown merge backend '{name}' (choose from: {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[name]()
+
+
+# PyPDF2 page helpers
+
+
+def _page_count(reader: PdfReader) -> int:
+    """Number of pages, read from the root /Count without flattening the tree."""
+    try:
+        return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        return len(reader.pages)
+
+
+def _lazy_page(reader: PdfReader, index: int, memo: Dict[int, Any] | None = None) -> PageObject:
+    """Resolve a single page by walking /Kids with /Count.
+
+    Unlike ``reader.pages[index]`` this resolves only the nodes on the path
+    to the page and the siblings before them, instead of every page
+    dictionary in the document. Siblings are resolved to learn their
+    /Count, which a flat page tree (the usual layout) makes O(index) per
+    page; pass the same `memo` for every page taken from one reader and
+    each kid is resolved at most once, so a selection costs O(last page
+    selected) in all rather than per page.
+    """
+    memo = {} if memo is None else memo
+    node_ref = reader.trailer["/Root"].get_object()["/Pages"]
+    node = node_ref.get_object()
+    inherit: dict = {}
+    remaining = index
+    while "/Kids" in node:
+        for attr in _INHERITABLE_PAGE_ATTRS:
+            if attr in node:
+                inherit[attr] = node[attr]
+        kids = node["/Kids"]
+        # the node itself is kept so that its id() stays its own
+        _, ends, resolved = memo.setdefault(id(node), (node, [], []))
+        while not ends or remaining >= ends[-1]:
+            if len(resolved) == len(kids):
+                raise IndexError(f"Page {index + 1} not found in page tree")
+            kid_ref = kids[len(resolved)]
+            kid = kid_ref.get_object()
+            resolved.append((kid_ref, kid))
+            ends.append((ends[-1] if ends else 0) + (int(kid.get("/Count", 1)) if "/Kids" in kid else 1))
+        # the first kid whose pages end past `remaining` holds the page
+        pos = bisect.bisect_right(ends, remaining)
+        remaining -= ends[pos - 1] if pos else 0
+        node_ref, node = resolved[pos]
+    if remaining != 0:
+        raise IndexError(f"Page {index + 1} not found in page tree")
+
+    page = PageObject(reader, node_ref if isinstance(node_ref, IndirectObject) else None)
+    page.update(node)
+    for attr, value in inherit.items():
+        if attr not in page:
+            page[attr] = value
+    return page
+
+
+def _iter_pages(reader: PdfReader, ranges: str | None) -> Iterator[PageObject]:
+    """Yield the selected pages of `reader` (all pages if `ranges` is empty)."""
+    if not ranges:
+        yield from reader.pages
+        return
+    memo: Dict[int, Any] = {}
+    for idx in _parse_page_ranges(ranges, _page_count(reader)):
+        try:
+            yield _lazy_page(reader, idx, memo)
+        except Exception:
+            # malformed page tree (bad /Count etc.): fall back to PyPDF2
+            yield reader.pages[idx]
+
+
+def _fit_page(p: PageObject, target: tuple[float, float]) -> None:
+    """Scale `p` to fit `target` (preserving aspect ratio) and set its MediaBox."""
+    target_w, target_h = target
+    w = float(p.mediabox.width)
+    h = float(p.mediabox.height)
+    scale = _scale_factor((w, h), target)
+    # preserve aspect ratio when possible
+    try:
+        if hasattr(p, "scale_to"):
+            p.scale_to(w * scale, h * scale)
+        elif hasattr(p, "scale_by"):
+            p.scale_by(scale)
+        elif hasattr(p, "scale"):
+            p.scale(scale)
+        else:
+            # fallback: leave content and change mediabox (may crop or stretch)
+            pass
+    except Exception:
+        pass
+
+    # ensure the page MediaBox is the target size (keeps consistent output size)
+    llx = float(p.mediabox.lower_left[0])
+    lly = float(p.mediabox.lower_left[1])
+    p.mediabox.upper_right = (llx + target_w, lly + target_h)
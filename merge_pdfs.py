@@ -4,43 +4,101 @@
 Usage examples:
   python merge_pdfs.py file1.pdf file2.pdf -o merged.pdf
   python merge_pdfs.py -o combined.pdf  # merges all PDFs in current dir
+  python merge_pdfs.py "big.pdf[1-3,10]" other.pdf -o excerpt.pdf  # page ranges
+  python merge_pdfs.py *.pdf --page-size A4 --dry-run  # page layout only, nothing written
 """
 from __future__ import annotations
 
 import argparse
+import contextlib
+import re
 import sys
 from pathlib import Path
-from typing import Iterable, List
-
-from PyPDF2 import PdfReader, PdfWriter
+from typing import Callable, ContextManager, Iterable, List
 
 import io
 
+from merge_backends import (  # noqa: F401  (page helpers re-exported for callers/tests)
+    BACKENDS,
+    OUTPUT_FORMATS,
+    _fit_page,
+    _iter_pages,
+    _lazy_page,
+    _page_count,
+    _parse_page_ranges,
+    _scale_factor,
+    get_backend,
+)
+from preflight import PreflightError, preflight
+
+
+_PAGE_SPEC_RE = re.compile(r"^(?P<path>.+)\[(?P<ranges>[0-9,\-\s]*)\]$")
+
+_NAMED_SIZES = {"a4": "210mmx297mm", "letter": "8.5inx11in", "let": "8.5inx11in"}
+
+# content stream bytes added to a page that is fitted to a target size
+_RESIZE_OVERHEAD = 64
 
-def merge_pdfs(files: Iterable[str], output: str) -> str:
+
+def _split_page_spec(item: str) -> tuple[str, str | None]:
+    """Split 'file.pdf[1-3,10]' into ('file.pdf', '1-3,10').
+
+    A path that exists on disk is never split, so files whose names really
+    end in brackets keep working.
+    """
+    if Path(item).exists():
+        return item, None
+    m = _PAGE_SPEC_RE.match(item)
+    if not m:
+        return item, None
+    return m.group("path"), m.group("ranges")
+
+
+def merge_pdfs(
+    files: Iterable[str],
+    output: str,
+    backend: str | None = None,
+    dedup: bool = True,
+    output_format: str = "standard",
+    check: bool = True,
+) -> str:
     """Merge the list of PDF filenames into `output`.
 
-    Raises ValueError if any input file cannot be read (e.g., encrypted).
+    Each filename may carry a page selection suffix, e.g. 'big.pdf[1-3,10]'.
+    `backend` names the PDF library to use (see merge_backends; defaults to
+    $MERGE_BACKEND or 'pypdf2'). With `dedup`, identical streams (fonts,
+    images...) shared by several inputs are written once. `output_format`
+    'compact' writes object streams with an xref stream (smaller, PDF 1.5+).
+    With `check`, every input is preflighted (in parallel) before merging.
+    Raises ValueError if any input file cannot be read (e.g., encrypted);
+    preflight failures for all inputs are reported together (PreflightError).
     Returns the output filename on success.
     """
-    writer = PdfWriter()
-    files_list: List[str] = list(files)
-    for f in files_list:
-        path = Path(f)
-        if not path.exists() or not path.is_file():
-            raise ValueError(f"File not found: {f}")
-        reader = PdfReader(str(path))
-        if getattr(reader, "is_encrypted", False):
-            try:
-                # try decrypt with empty password
-                reader.decrypt("")
-            except Exception:
-                raise ValueError(f"Encrypted PDF: {f}")
-        for p in reader.pages:
-            writer.add_page(p)
-
-    with open(output, "wb") as out_f:
-        writer.write(out_f)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    be = get_backend(backend)
+    specs = [_split_page_spec(item) for item in files]
+    if check:
+        preflight([f for f, _ in specs], [ranges for _, ranges in specs])
+    writer = be.new_output()
+    docs = []
+    try:
+        for f, ranges in specs:
+            path = Path(f)
+            if not path.exists() or not path.is_file():
+                raise ValueError(f"File not found: {f}")
+            doc = be.open(str(path))
+            docs.append(doc)
+            for p in be.pages(doc, ranges):
+                be.add_page(writer, p)
+
+        if dedup:
+            be.dedup(writer)
+        with open(output, "wb") as out_f:
+            be.write(writer, out_f, output_format)
+    finally:
+        for doc in docs:
+            be.close(doc)
     return output
 
 
@@ -61,7 +119,7 @@ def _gather_files(args: argparse.Namespace) -> List[str]:
 
 
 def _parse_size(size: str) -> tuple[float, float]:
-    """Parse size strings like '612x792', '8.5inx11in', '210mmx297mm'. Returns (width, height) in points."""
+    """Parse size strings like '612x792', '8.5inx11in', '210mmx297mm' or 'A4'. Returns (width, height) in points."""
     def to_pts(val: str) -> float:
         val = val.strip()
         if val.endswith("mm"):
@@ -72,15 +130,19 @@ def _parse_size(size: str) -> tuple[float, float]:
             return float(val[:-2])
         return float(val)  # assume points
 
+    named = _NAMED_SIZES.get(size.strip().lower())
+    if named:
+        size = named
     if "x" not in size:
         raise ValueError("Size must be in WIDTHxHEIGHT format")
     w_s, h_s = size.split("x", 1)
     return to_pts(w_s), to_pts(h_s)
 
 
-def _choose_target_size(pages, size_arg: str | None) -> tuple[float, float]:
-    widths = [float(p.mediabox.width) for p in pages]
-    heights = [float(p.mediabox.height) for p in pages]
+def _choose_target_size(sizes: List[tuple[float, float]], size_arg: str | None) -> tuple[float, float]:
+    """Pick the output page size from the (width, height) of every page."""
+    widths = [w for w, _ in sizes]
+    heights = [h for _, h in sizes]
     if not size_arg or size_arg.lower() == "largest":
         return max(widths), max(heights)
     if size_arg.lower() == "smallest":
@@ -91,9 +153,49 @@ def _choose_target_size(pages, size_arg: str | None) -> tuple[float, float]:
     return _parse_size(size_arg)
 
 
+def _merge_specs(files: Iterable[str], page_ranges: list[str | None] | None) -> list[tuple[str, str | None]]:
+    """(path, ranges) per input; an entry of `page_ranges` overrides an inline 'file.pdf[1-3]'."""
+    specs = []
+    for idx, item in enumerate(files):
+        f, ranges = _split_page_spec(item)
+        if page_ranges and idx < len(page_ranges) and page_ranges[idx]:
+            ranges = page_ranges[idx]
+        specs.append((f, ranges))
+    return specs
+
+
+def _file_target(
+    per_file_sizes: list[str] | None, idx: int, global_target: tuple[float, float] | None,
+) -> tuple[float, float] | None:
+    """Target page size of input `idx` (None: keep its pages as they are)."""
+    if not per_file_sizes or idx >= len(per_file_sizes):
+        # fall back to global target if provided
+        return global_target
+    spec = per_file_sizes[idx]
+    if not spec or spec == "preserve":
+        return None
+    if spec == "global":
+        return global_target
+    return _parse_size(spec)
+
+
+def _resized(count: int, per_file_sizes: list[str] | None, global_size: str | None) -> list[bool]:
+    """Per input, whether its pages will be resized (their content streams rewritten)."""
+    global_on = bool(global_size) and global_size.lower() != "preserve"
+    resized = []
+    for idx in range(count):
+        spec = per_file_sizes[idx] if per_file_sizes and idx < len(per_file_sizes) else "global"
+        resized.append(bool(spec) and spec != "preserve" and (spec != "global" or global_on))
+    return resized
+
+
 def main(argv: list[str] | None = None) -> int:
     p = argparse.ArgumentParser(description="Merge PDF files")
-    p.add_argument("files", nargs="*", help="PDF files or directories to merge")
+    p.add_argument(
+        "files",
+        nargs="*",
+        help="PDF files or directories to merge. Select pages with FILE[RANGES], e.g. 'a.pdf[1-3,10]'",
+    )
     p.add_argument("-o", "--output", default="merged.pdf", help="Output filename")
     p.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
     p.add_argument(
@@ -104,6 +206,36 @@ def main(argv: list[str] | None = None) -> int:
             "(e.g. 8.5inx11in, 210mmx297mm, 612x792). Units: pt, mm, in. Default 'largest'."
         ),
     )
+    p.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default=None,
+        help="PDF library used for the merge (default: $MERGE_BACKEND or 'pypdf2')",
+    )
+    p.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Keep every input's own copy of shared fonts/images instead of writing identical streams once",
+    )
+    p.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default="standard",
+        help=(
+            "'compact' packs objects into compressed object streams with an xref stream and "
+            "compresses uncompressed streams (smaller files, needs a PDF 1.5+ reader). Default 'standard'."
+        ),
+    )
+    p.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the page layout and estimated size of the result instead of merging",
+    )
+    p.add_argument(
+        "--no-preflight",
+        action="store_true",
+        help="Skip the quick check of all inputs (header, xref, encryption, page ranges) before merging",
+    )
     args = p.parse_args(argv)
 
     files = _gather_files(args)
@@ -111,64 +243,104 @@ def main(argv: list[str] | None = None) -> int:
         print("No PDF files found.", file=sys.stderr)
         return 2
 
-    # read pages first to be able to choose a target size
     try:
-        pages = []
-        for f in files:
-            try:
-                reader = PdfReader(str(f))
-            except Exception as e:
-                raise ValueError(f"There was a problem reading the document: {f}: {e}")
-            pages.extend(reader.pages)
-
-        size_arg = args.page_size
-        target_w, target_h = _choose_target_size(pages, size_arg)
-    except Exception as exc:
+        be = get_backend(args.backend)
+    except ValueError as exc:
         print("Error:", exc, file=sys.stderr)
         return 1
 
-    # perform the merge and resizing
-    try:
-        writer = PdfWriter()
-        for f in files:
-            reader = PdfReader(str(f))
-            for p in reader.pages:
-                w = float(p.mediabox.width)
-                h = float(p.mediabox.height)
-                scale_x = target_w / w if w else 1.0
-                scale_y = target_h / h if h else 1.0
-                scale = min(scale_x, scale_y)
-                # preserve aspect ratio when possible
-                try:
-                    if hasattr(p, "scale_to"):
-                        p.scale_to(w * scale, h * scale)
-                    elif hasattr(p, "scale_by"):
-                        p.scale_by(scale)
-                    elif hasattr(p, "scale"):
-                        p.scale(scale)
-                    else:
-                        # fallback: leave content and change mediabox (may crop or stretch)
-                        pass
-                except Exception:
-                    pass
-
-                # ensure the page MediaBox is the target size (keeps consistent output size)
-                llx = float(p.mediabox.lower_left[0])
-                lly = float(p.mediabox.lower_left[1])
-                p.mediabox.upper_right = (llx + target_w, lly + target_h)
-                writer.add_page(p)
-
-        with open(args.output, "wb") as out_f:
-            writer.write(out_f)
-
-        print(f"Merged {len(files)} file(s) into {args.output} with pages {int(target_w)}x{int(target_h)} pts")
+    if args.dry_run:
+        # the command line fits every page to one size
+        try:
+            plan = plan_merge(files, global_size=args.page_size, backend=args.backend, check=not args.no_preflight)
+        except PreflightError as exc:
+            for failure in exc.failures:
+                print("Error:", failure.message(), file=sys.stderr)
+            return 1
+        except Exception as exc:
+            print("Error:", exc, file=sys.stderr)
+            return 1
+        _print_plan(plan)
         return 0
-    except Exception as exc:
-        print("Error:", exc, file=sys.stderr)
-        return 1
 
+    if not args.no_preflight:
+        specs = [_split_page_spec(item) for item in files]
+        try:
+            # every page is fitted to the target size: check decoded sizes too
+            preflight([f for f, _ in specs], [ranges for _, ranges in specs], decoded=[True] * len(specs))
+        except PreflightError as exc:
+            # report every bad input, not just the first one
+            for failure in exc.failures:
+                print("Error:", failure.message(), file=sys.stderr)
+            return 1
 
-def merge_pdfs_bytes(files: Iterable[str], per_file_sizes: list[str] | None = None, global_size: str | None = None) -> bytes:
+    # read pages first to be able to choose a target size
+    docs = []
+    try:
+        try:
+            selected = []
+            for item in files:
+                f, ranges = _split_page_spec(item)
+                try:
+                    doc = be.open(str(f))
+                    docs.append(doc)
+                except Exception as e:
+                    raise ValueError(f"There was a problem reading the document: {f}: {e}")
+                try:
+                    pages = be.pages(doc, ranges)
+                except ValueError as e:
+                    if ranges is not None:
+                        raise ValueError(f"Invalid page selection for {f}: {e}")
+                    raise ValueError(f"There was a problem reading the document: {f}: {e}")
+                except Exception as e:
+                    raise ValueError(f"There was a problem reading the document: {f}: {e}")
+                selected.append(pages)
+
+            size_arg = args.page_size
+            sizes = [be.page_size(p) for pages in selected for p in pages]
+            target_w, target_h = _choose_target_size(sizes, size_arg)
+        except Exception as exc:
+            print("Error:", exc, file=sys.stderr)
+            return 1
+
+        # perform the merge and resizing
+        try:
+            writer = be.new_output()
+            for pages in selected:
+                for p in pages:
+                    be.add_page(writer, p, (target_w, target_h))
+
+            saved = 0
+            if not args.no_dedup:
+                _, saved = be.dedup(writer)
+
+            with open(args.output, "wb") as out_f:
+                be.write(writer, out_f, args.output_format)
+
+            print(f"Merged {len(files)} file(s) into {args.output} with pages {int(target_w)}x{int(target_h)} pts")
+            if saved:
+                print(f"Shared identical resources: {saved} bytes saved")
+            return 0
+        except Exception as exc:
+            print("Error:", exc, file=sys.stderr)
+            return 1
+    finally:
+        for doc in docs:
+            be.close(doc)
+
+
+def merge_pdfs_bytes(
+    files: Iterable[str],
+    per_file_sizes: list[str] | None = None,
+    global_size: str | None = None,
+    page_ranges: list[str | None] | None = None,
+    phase: Callable[[str], ContextManager] | None = None,
+    stats: dict | None = None,
+    backend: str | None = None,
+    dedup: bool = True,
+    output_format: str = "standard",
+    check: bool = True,
+) -> bytes:
     """Merge files and return PDF bytes.
 
     per_file_sizes: optional list with same length as `files`. Each entry may be:
@@ -176,66 +348,166 @@ def merge_pdfs_bytes(files: Iterable[str], per_file_sizes: list[str] | None = No
       - 'global' (use global_size)
       - WIDTHxHEIGHT string (e.g. '8.5inx11in') to resize this file's pages
     global_size: optional size string used when an entry is 'global'
+    page_ranges: optional list with same length as `files`. Each entry is a
+      1-based range string such as '1-3,10' (empty/None selects all pages).
+      Filenames may also carry the selection inline ('file.pdf[1-3]').
+    phase: optional factory returning a context manager per phase name
+      ('preflight', 'parse', 'transform', 'dedup', 'serialize'); used by the
+      webapp for timings.
+    stats: optional dict that receives figures about the merge ('pages',
+      'dedup_objects', 'dedup_bytes_saved').
+    backend: PDF library to use (default: $MERGE_BACKEND or 'pypdf2').
+    dedup: write identical streams (fonts, images, ICC profiles) shared by
+      several inputs only once.
+    output_format: 'standard' or 'compact' (object streams + xref stream,
+      uncompressed streams Flate-compressed).
+    check: preflight all inputs in parallel first (timed as 'preflight');
+      raises PreflightError listing every bad input before any merging.
     """
-    files_list: List[str] = list(files)
-    # read pages to compute global target size if needed
-    all_pages = []
-    for f in files_list:
-        reader = PdfReader(str(f))
-        all_pages.extend(reader.pages)
+    if phase is None:
+        phase = lambda name: contextlib.nullcontext()  # noqa: E731
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    be = get_backend(backend)
+    specs = _merge_specs(files, page_ranges)
+    if check:
+        with phase("preflight"):
+            preflight(
+                [f for f, _ in specs], [ranges for _, ranges in specs],
+                decoded=_resized(len(specs), per_file_sizes, global_size),
+            )
+    # read the selected pages once; they are reused for sizing and merging
+    selected = []
+    docs = []
+    try:
+        with phase("parse"):
+            for f, ranges in specs:
+                doc = be.open(str(f))
+                docs.append(doc)
+                selected.append(be.pages(doc, ranges))
+        all_pages = [p for pages in selected for p in pages]
+
+        global_target: tuple[float, float] | None = None
+        if global_size and global_size.lower() != "preserve":
+            global_target = _choose_target_size([be.page_size(p) for p in all_pages], global_size)
+
+        writer = be.new_output()
+        with phase("transform"):
+            for idx, pages in enumerate(selected):
+                target = _file_target(per_file_sizes, idx, global_target)
+                for p in pages:
+                    be.add_page(writer, p, target)
+
+        removed, saved = 0, 0
+        if dedup:
+            with phase("dedup"):
+                removed, saved = be.dedup(writer)
+
+        if stats is not None:
+            stats["pages"] = len(all_pages)
+            stats["dedup_objects"] = removed
+            stats["dedup_bytes_saved"] = saved
+
+        with phase("serialize"):
+            buf = io.BytesIO()
+            be.write(writer, buf, output_format)
+            buf.seek(0)
+            return buf.read()
+    finally:
+        for doc in docs:
+            be.close(doc)
+
+
+def plan_merge(
+    files: Iterable[str],
+    per_file_sizes: list[str] | None = None,
+    global_size: str | None = None,
+    page_ranges: list[str | None] | None = None,
+    backend: str | None = None,
+    check: bool = True,
+) -> dict:
+    """What merge_pdfs_bytes would produce with the same options, from page geometry only.
+
+    Nothing is merged or written. Returns 'pages', 'estimated_bytes' and
+    'files', one entry per input with its 'file', 'pages', 'target' (None
+    when its pages keep their size), 'estimated_bytes' and 'page_plan': per
+    selected page its 1-based 'page' number in the input, 'original' and
+    'target' size in points and the 'scale' its content is drawn at.
+    'estimated_bytes' counts each input's share of its file size for the
+    selected pages, before deduplication.
+    """
+    be = get_backend(backend)
+    specs = _merge_specs(files, page_ranges)
+    if check:
+        preflight([f for f, _ in specs], [ranges for _, ranges in specs])
+    docs = []
+    try:
+        selected = []
+        for f, ranges in specs:
+            doc = be.open(str(f))
+            docs.append(doc)
+            count = be.page_count(doc)
+            numbers = _parse_page_ranges(ranges, count) if ranges else range(count)
+            selected.append((f, count, [(i + 1, be.page_size(p)) for i, p in zip(numbers, be.pages(doc, ranges))]))
+    finally:
+        for doc in docs:
+            be.close(doc)
 
     global_target: tuple[float, float] | None = None
     if global_size and global_size.lower() != "preserve":
-        global_target = _choose_target_size(all_pages, global_size)
-
-    writer = PdfWriter()
-    for idx, f in enumerate(files_list):
-        reader = PdfReader(str(f))
-        # determine target for this file
-        target = None
-        if per_file_sizes and idx < len(per_file_sizes):
-            spec = per_file_sizes[idx]
-            if not spec or spec == "preserve":
-                target = None
-            elif spec == "global":
-                target = global_target
-            elif isinstance(spec, str) and spec.lower() == "a4":
-                target = _parse_size("210mmx297mm")
-            elif isinstance(spec, str) and spec.lower() in ("letter", "let"):
-                target = _parse_size("8.5inx11in")
+        global_target = _choose_target_size([size for _, _, pages in selected for _, size in pages], global_size)
+
+    plan_files = []
+    for idx, (f, count, pages) in enumerate(selected):
+        target = _file_target(per_file_sizes, idx, global_target)
+        page_plan = []
+        for number, size in pages:
+            scale = _scale_factor(size, target) if target else 1.0
+            page_plan.append({
+                "page": number,
+                "original": [round(v, 2) for v in size],
+                "target": [round(v, 2) for v in (target or size)],
+                "scale": round(scale, 4),
+            })
+        estimate = Path(f).stat().st_size * len(pages) // max(count, 1)
+        if target:
+            estimate += _RESIZE_OVERHEAD * len(pages)
+        plan_files.append({
+            "file": str(f),
+            "pages": len(pages),
+            "target": [round(v, 2) for v in target] if target else None,
+            "estimated_bytes": estimate,
+            "page_plan": page_plan,
+        })
+    return {
+        "pages": sum(f["pages"] for f in plan_files),
+        "estimated_bytes": sum(f["estimated_bytes"] for f in plan_files),
+        "files": plan_files,
+    }
+
+
+def _print_plan(plan: dict) -> None:
+    """Plan of plan_merge as text, runs of pages with the same geometry on one line."""
+    def fmt(size: list) -> str:
+        return f"{size[0]:g}x{size[1]:g}"
+
+    for entry in plan["files"]:
+        print(f"{entry['file']}: {entry['pages']} page(s), ~{entry['estimated_bytes']} bytes")
+        runs: list[list] = []
+        for page in entry["page_plan"]:
+            key = (page["original"], page["target"], page["scale"])
+            if runs and runs[-1][2] == key and runs[-1][1] == page["page"] - 1:
+                runs[-1][1] = page["page"]
             else:
-                target = _parse_size(spec)
-        else:
-            # fall back to global target if provided
-            target = global_target
-
-        for p in reader.pages:
-            if target:
-                target_w, target_h = target
-                w = float(p.mediabox.width)
-                h = float(p.mediabox.height)
-                scale_x = target_w / w if w else 1.0
-                scale_y = target_h / h if h else 1.0
-                scale = min(scale_x, scale_y)
-                try:
-                    if hasattr(p, "scale_to"):
-                        p.scale_to(w * scale, h * scale)
-                    elif hasattr(p, "scale_by"):
-                        p.scale_by(scale)
-                    elif hasattr(p, "scale"):
-                        p.scale(scale)
-                except Exception:
-                    pass
-                llx = float(p.mediabox.lower_left[0])
-                lly = float(p.mediabox.lower_left[1])
-                p.mediabox.upper_right = (llx + target_w, lly + target_h)
-
-            writer.add_page(p)
-
-    buf = io.BytesIO()
-    writer.write(buf)
-    buf.seek(0)
-    return buf.read()
+                runs.append([page["page"], page["page"], key])
+        for first, last, (original, target, scale) in runs:
+            label = f"page {first}" if first == last else f"pages {first}-{last}"
+            if original == target:
+                print(f"  {label}: {fmt(original)} pt")
+            else:
+                print(f"  {label}: {fmt(original)} pt -> {fmt(target)} pt (scale {scale:g})")
+    mib = plan["estimated_bytes"] / (1024 * 1024)
+    print(f"Total: {plan['pages']} page(s), estimated {mib:.1f} MiB before deduplication")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+"""Embedded font cleanup for compress_pdfs.
+
+Two passes over an open pikepdf document:
+
+  dedup_fonts   font programs (FontFile/FontFile2/FontFile3) with the same
+                decoded bytes are collapsed into one, whatever filters they
+                were stored with; the smallest stored copy is kept
+  subset_fonts  TrueType programs are cut down to the glyphs the document
+                shows (needs the optional 'fonttools' package)
+
+Subsetting keeps glyph ids (so no content stream changes) and only touches
+a font when every use of it could be followed: fonts used from forms
+without resources, from AcroForm defaults, through ExtGState /Font, or by
+text shown without a Tf are left whole.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import re
+import zlib
+from typing import Any, Dict, Optional, Set, Tuple
+
+from merge_backends import ObjGen, redirect_pikepdf
+
+FONT_FILE_KEYS = ("/FontFile", "/FontFile2", "/FontFile3")
+
+_SUBSET_TAG_RE = re.compile(r"^[A-Z]{6}\+")
+_TEXT_OPERATORS = {"Tj", "TJ", "'", '"'}
+
+
+def _font_name(descriptor: Any) -> str:
+    name = str(descriptor.get("/FontName", "/unknown"))
+    return name[1:] if name.startswith("/") else name
+
+
+def _font_files(pdf: Any) -> Dict[ObjGen, Tuple[Any, Any, str]]:
+    """font program objgen -> (program stream, a descriptor using it, key)"""
+    import pikepdf
+
+    found: Dict[ObjGen, Tuple[Any, Any, str]] = {}
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Dictionary) or obj.get("/Type") != pikepdf.Name.FontDescriptor:
+            continue
+        for key in FONT_FILE_KEYS:
+            program = obj.get(key)
+            if isinstance(program, pikepdf.Stream) and program.is_indirect:
+                found.setdefault(program.objgen, (program, obj, key))
+    return found
+
+
+def dedup_fonts(pdf: Any) -> Tuple[Dict[ObjGen, ObjGen], Dict[str, dict]]:
+    """Collapse identical font programs.
+
+    Returns the remap of dropped program -> kept program, and per font name
+    the number of 'duplicates' removed and their stored 'bytes_saved'.
+    """
+    files = _font_files(pdf)
+    groups: Dict[Tuple[str, bytes], list] = {}
+    for objgen, (program, _, key) in files.items():
+        try:
+            digest = hashlib.sha256(program.read_bytes()).digest()
+        except Exception:
+            # a filter qpdf cannot decode; leave this copy alone
+            continue
+        subtype = str(program.get("/Subtype", ""))
+        groups.setdefault((key + subtype, digest), []).append((len(program.read_raw_bytes()), objgen))
+
+    remap: Dict[ObjGen, ObjGen] = {}
+    report: Dict[str, dict] = {}
+    for copies in groups.values():
+        if len(copies) < 2:
+            continue
+        copies.sort()
+        keep = copies[0][1]
+        entry = report.setdefault(_font_name(files[keep][1]), {"duplicates": 0, "bytes_saved": 0})
+        for size, objgen in copies[1:]:
+            remap[objgen] = keep
+            entry["duplicates"] += 1
+            entry["bytes_saved"] += size
+    if remap:
+        redirect_pikepdf(pdf, remap)
+    return remap, report
+
+
+class _Usage:
+    """Character codes shown per font dictionary, collected from content streams."""
+
+    def __init__(self) -> None:
+        self.codes: Dict[ObjGen, Set[bytes]] = {}
+        self.seen: Set[ObjGen] = set()
+        self.unsafe: Set[ObjGen] = set()
+        self.uncertain = False
+
+    def scan(self, stream: Any, resources: Any) -> None:
+        import pikepdf
+
+        fonts = resources.get("/Font") if isinstance(resources, pikepdf.Dictionary) else None
+        for _, font in (fonts.items() if isinstance(fonts, pikepdf.Dictionary) else []):
+            if isinstance(font, pikepdf.Dictionary) and font.is_indirect:
+                self.seen.add(font.objgen)
+                self.codes.setdefault(font.objgen, set())
+        gstates = resources.get("/ExtGState") if isinstance(resources, pikepdf.Dictionary) else None
+        for _, gs in (gstates.items() if isinstance(gstates, pikepdf.Dictionary) else []):
+            if isinstance(gs, pikepdf.Dictionary) and "/Font" in gs:
+                # a font set by the gs operator; we do not follow that
+                self.uncertain = True
+
+        current: Optional[Any] = None
+        saved = []
+        for operands, operator in pikepdf.parse_content_stream(stream, "q Q Tf Tj TJ ' \""):
+            op = str(operator)
+            if op == "q":
+                saved.append(current)
+            elif op == "Q":
+                current = saved.pop() if saved else None
+            elif op == "Tf" and operands:
+                current = fonts.get(operands[0]) if isinstance(fonts, pikepdf.Dictionary) else None
+            elif op in _TEXT_OPERATORS:
+                if current is None or not current.is_indirect:
+                    # text in a font chosen by the caller (or a direct font dict)
+                    self.uncertain = True
+                    continue
+                strings = operands[-1] if op != "TJ" else operands[0]
+                items = strings if isinstance(strings, pikepdf.Array) else [strings]
+                codes = self.codes.setdefault(current.objgen, set())
+                codes.update(bytes(item) for item in items if isinstance(item, pikepdf.String))
+
+    def collect(self, pdf: Any) -> None:
+        import pikepdf
+
+        for page in pdf.pages:
+            resources = page.obj.get("/Resources")
+            if not isinstance(resources, pikepdf.Dictionary):
+                self.uncertain = True
+                continue
+            self.scan(page, resources)
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream) and (
+                obj.get("/Subtype") == pikepdf.Name.Form or obj.get("/PatternType") == 1
+            ):
+                if isinstance(obj.get("/Resources"), pikepdf.Dictionary):
+                    self.scan(obj, obj.Resources)
+                elif pikepdf.parse_content_stream(obj, "Tj TJ ' \""):
+                    self.uncertain = True
+            elif isinstance(obj, pikepdf.Dictionary) and obj.get("/Subtype") == pikepdf.Name.Type3:
+                for _, proc in obj.get("/CharProcs", pikepdf.Dictionary()).items():
+                    if isinstance(proc, pikepdf.Stream):
+                        self.scan(proc, obj.get("/Resources", pikepdf.Dictionary()))
+        acroform = pdf.Root.get("/AcroForm")
+        if isinstance(acroform, pikepdf.Dictionary):
+            fonts = acroform.get("/DR", pikepdf.Dictionary()).get("/Font", pikepdf.Dictionary())
+            for _, font in fonts.items():
+                if isinstance(font, pikepdf.Object) and font.is_indirect:
+                    # form fields may render any text with these later
+                    self.unsafe.add(font.objgen)
+
+
+def _truetype_program(font: Any) -> Optional[Tuple[Any, Any, str]]:
+    """(FontFile2 stream, descriptor, 'simple' or 'cid') for fonts we can subset."""
+    import pikepdf
+
+    subtype = font.get("/Subtype")
+    if subtype == pikepdf.Name.TrueType:
+        descriptor, kind = font.get("/FontDescriptor"), "simple"
+    elif subtype == pikepdf.Name.Type0 and str(font.get("/Encoding", "")) in ("/Identity-H", "/Identity-V"):
+        descendants = font.get("/DescendantFonts")
+        if not isinstance(descendants, pikepdf.Array) or len(descendants) != 1:
+            return None
+        cid = descendants[0]
+        if cid.get("/Subtype") != pikepdf.Name.CIDFontType2:
+            return None
+        if "/CIDToGIDMap" in cid and cid.CIDToGIDMap != pikepdf.Name.Identity:
+            return None
+        descriptor, kind = cid.get("/FontDescriptor"), "cid"
+    else:
+        return None
+    if not isinstance(descriptor, pikepdf.Dictionary):
+        return None
+    program = descriptor.get("/FontFile2")
+    if not isinstance(program, pikepdf.Stream) or not program.is_indirect:
+        return None
+    return program, descriptor, kind
+
+
+def _simple_glyphs(ttfont: Any, font: Any, codes: Set[int]) -> Set[str]:
+    """Glyph names a viewer may pick for one-byte `codes` of a simple TrueType font.
+
+    Viewers differ in which cmap they consult (symbolic (3,0) with the
+    0xF0xx offsets, Mac (1,0), or Unicode via the font's /Encoding), so
+    every candidate is kept.
+    """
+    import pikepdf
+    from fontTools.agl import toUnicode
+
+    differences: Dict[int, str] = {}
+    encoding = font.get("/Encoding")
+    if isinstance(encoding, pikepdf.Dictionary):
+        code = 0
+        for item in encoding.get("/Differences", []):
+            if isinstance(item, pikepdf.Name):
+                differences[code] = str(item)[1:]
+                code += 1
+            else:
+                code = int(item)
+
+    glyphs = {".notdef"}
+    order = set(ttfont.getGlyphOrder())
+    for code in codes:
+        chars = {bytes([code]).decode(enc, errors="ignore") for enc in ("cp1252", "mac_roman", "latin-1")}
+        if code in differences:
+            glyphs.add(differences[code])
+            chars.add(toUnicode(differences[code]))
+        for table in ttfont["cmap"].tables:
+            if table.platformID == 3 and table.platEncID == 0:
+                keys = [code, 0xF000 + code, 0xF100 + code, 0xF200 + code]
+            elif table.platformID == 1 and table.platEncID == 0:
+                keys = [code]
+            else:
+                keys = [ord(c) for c in chars if len(c) == 1]
+            glyphs.update(table.cmap[k] for k in keys if k in table.cmap)
+    return glyphs & order
+
+
+def _subset_tag(glyphs: Set[Any]) -> str:
+    digest = hashlib.sha256(repr(sorted(map(str, glyphs))).encode()).digest()
+    return "".join(chr(ord("A") + b % 26) for b in digest[:6])
+
+
+def subset_fonts(pdf: Any) -> Dict[str, dict]:
+    """Subset TrueType font programs to the glyphs used; returns per font name 'bytes_saved'."""
+    import pikepdf
+
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        raise ValueError("Font subsetting requires 'fonttools'. Try: pip install fonttools")
+
+    usage = _Usage()
+    usage.collect(pdf)
+    if usage.uncertain:
+        return {}
+
+    # every font dictionary, grouped by the TrueType program it uses
+    users: Dict[ObjGen, list] = {}
+    for obj in pdf.objects:
+        if isinstance(obj, pikepdf.Dictionary) and obj.get("/Type") == pikepdf.Name.Font:
+            found = _truetype_program(obj)
+            if found is not None:
+                users.setdefault(found[0].objgen, []).append((obj, found))
+
+    report: Dict[str, dict] = {}
+    for fonts in users.values():
+        program, descriptor, _ = fonts[0][1]
+        name = _font_name(descriptor)
+        if _SUBSET_TAG_RE.match(name):
+            continue
+        if any(font.objgen not in usage.seen or font.objgen in usage.unsafe for font, _ in fonts):
+            continue
+        try:
+            ttfont = TTFont(io.BytesIO(program.read_bytes()))
+            glyphs: Set[str] = {".notdef"}
+            order = ttfont.getGlyphOrder()
+            for font, (_, _, kind) in fonts:
+                codes = usage.codes.get(font.objgen, set())
+                if kind == "cid":
+                    gids = {int.from_bytes(s[i:i + 2], "big") for s in codes for i in range(0, len(s) - 1, 2)}
+                    glyphs.update(order[g] for g in gids if g < len(order))
+                else:
+                    glyphs |= _simple_glyphs(ttfont, font, {b for s in codes for b in s})
+            options = subset.Options()
+            options.retain_gids = True  # content streams keep their glyph ids
+            options.notdef_outline = True
+            options.glyph_names = True
+            options.name_IDs = ["*"]
+            options.layout_features = []
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(glyphs=glyphs)
+            subsetter.subset(ttfont)
+            buf = io.BytesIO()
+            ttfont.save(buf)
+        except Exception:
+            # fontTools could not parse or rebuild it; keep the original
+            continue
+        data = buf.getvalue()
+        packed = zlib.compress(data, 9)
+        before = len(program.read_raw_bytes())
+        if len(packed) >= before:
+            continue
+        program.write(packed, filter=pikepdf.Name.FlateDecode)
+        program.Length1 = len(data)
+        tag = _subset_tag(glyphs)
+        descriptor.FontName = pikepdf.Name(f"/{tag}+{name}")
+        for font, (_, desc, _) in fonts:
+            base = str(font.get("/BaseFont", f"/{name}"))[1:]
+            font.BaseFont = pikepdf.Name(f"/{tag}+{base}")
+            if desc is not descriptor:
+                desc.FontName = descriptor.FontName
+            if "/DescendantFonts" in font:
+                font.DescendantFonts[0].BaseFont = pikepdf.Name(f"/{tag}+{name}")
+        report[name] = {"bytes_saved": before - len(packed)}
+    return report
@@ -0,0 +1,324 @@
+"""Resource limits for processing untrusted PDFs.
+
+A small upload can declare millions of pages or objects, or hold streams
+that decode to gigabytes (a Flate bomb, or a 100000 x 100000 pixel image
+that is a few bytes of JPEG). ``check_document`` looks at an opened
+pikepdf document before anything is decoded:
+
+  pages          /Count of the page tree
+  objects        /Size of the trailer (the xref is all qpdf has read)
+  image pixels   /Width x /Height of every image XObject
+  decoded bytes  the sum over all streams of what decoding them produces:
+                 images from their dimensions, colour space and bit depth;
+                 other streams by decoding their whole filter chain
+                 (Flate, LZW, RunLength, ASCII85, ASCIIHex) in bounded
+                 pieces, counting the output without keeping it, and
+                 stopping once it passes the cap; filters not decoded here
+                 (image codecs outside images) by their encoded size
+
+and raises LimitExceeded (a ValueError) naming the first limit broken.
+
+Environment (defaults in brackets):
+  PDF_MAX_PAGES          [10000]
+  PDF_MAX_OBJECTS        [1000000]
+  PDF_MAX_IMAGE_PIXELS   [180000000, about Pillow's own bomb limit]
+  PDF_MAX_DECODED_BYTES  [2 GiB]
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import io
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+_INFLATE_CHUNK = 1024 * 1024
+
+_COMPONENTS = {"/DeviceGray": 1, "/CalGray": 1, "/DeviceRGB": 3, "/CalRGB": 3, "/Lab": 3, "/DeviceCMYK": 4}
+
+
+class LimitExceeded(ValueError):
+    """The document needs more resources than the configured limits allow."""
+
+
+@dataclass
+class Limits:
+    max_pages: int = 10_000
+    max_objects: int = 1_000_000
+    max_image_pixels: int = 180_000_000
+    max_decoded_bytes: int = 2 * 1024 ** 3
+
+    @classmethod
+    def from_env(cls) -> "Limits":
+        default = cls()
+        return cls(
+            max_pages=int(os.environ.get("PDF_MAX_PAGES", default.max_pages)),
+            max_objects=int(os.environ.get("PDF_MAX_OBJECTS", default.max_objects)),
+            max_image_pixels=int(os.environ.get("PDF_MAX_IMAGE_PIXELS", default.max_image_pixels)),
+            max_decoded_bytes=int(os.environ.get("PDF_MAX_DECODED_BYTES", default.max_decoded_bytes)),
+        )
+
+
+def stream_filters(obj: Any) -> List[str]:
+    """Names of the filters of the stream `obj`, in decoding order."""
+    import pikepdf
+
+    filt = obj.get("/Filter")
+    if filt is None:
+        return []
+    return [str(f) for f in filt] if isinstance(filt, pikepdf.Array) else [str(filt)]
+
+
+def _components(colorspace: Any) -> int:
+    import pikepdf
+
+    if isinstance(colorspace, pikepdf.Array) and len(colorspace):
+        family = str(colorspace[0])
+        if family in ("/Indexed", "/I", "/Separation"):
+            return 1
+        if family == "/ICCBased":
+            return int(colorspace[1].get("/N", 4))
+        if family == "/DeviceN" and len(colorspace) > 1:
+            return len(colorspace[1])
+        return _COMPONENTS.get(family, 4)
+    return _COMPONENTS.get(str(colorspace), 4)
+
+
+def _image_bytes(obj: Any) -> int:
+    width, height = int(obj.get("/Width", 0)), int(obj.get("/Height", 0))
+    if obj.get("/ImageMask", False):
+        return (width + 7) // 8 * height
+    bpc = int(obj.get("/BitsPerComponent", 8))
+    return (width * _components(obj.get("/ColorSpace")) * bpc + 7) // 8 * height
+
+
+# Decoders for a filter chain: each takes the previous filter's output, in
+# pieces, and yields its own in pieces of about _INFLATE_CHUNK at most, so
+# nothing larger is ever held. On corrupt data they stop: qpdf gives up on
+# it too (with a warning), and what came out so far is what gets counted.
+
+def _pieces(raw: bytes) -> Iterator[bytes]:
+    for start in range(0, len(raw), _INFLATE_CHUNK):
+        yield raw[start:start + _INFLATE_CHUNK]
+
+
+def _flate(pieces: Iterable[bytes], parms: Any) -> Iterator[bytes]:
+    inflater = zlib.decompressobj()
+    try:
+        for data in pieces:
+            while data and not inflater.eof:
+                yield inflater.decompress(data, _INFLATE_CHUNK)
+                data = inflater.unconsumed_tail
+            if inflater.eof:
+                return
+        yield inflater.flush()
+    except zlib.error:
+        return
+
+
+def _lzw(pieces: Iterable[bytes], parms: Any) -> Iterator[bytes]:
+    early = int(parms.get("/EarlyChange", 1)) if parms is not None else 1
+    table = [bytes([i]) for i in range(256)] + [b"", b""]
+    width, acc, bits = 9, 0, 0
+    previous: Optional[bytes] = None
+    out = bytearray()
+    for data in pieces:
+        for byte in data:
+            acc = (acc << 8) | byte
+            bits += 8
+            while bits >= width:
+                bits -= width
+                code = acc >> bits
+                acc &= (1 << bits) - 1
+                if code == 256:  # clear table
+                    del table[258:]
+                    width, previous = 9, None
+                    continue
+                if code == 257:  # end of data
+                    yield bytes(out)
+                    return
+                if code < len(table):
+                    entry = table[code]
+                elif code == len(table) and previous is not None:
+                    entry = previous + previous[:1]
+                else:
+                    yield bytes(out)
+                    return
+                out += entry
+                if previous is not None and len(table) < 4096:
+                    table.append(previous + entry[:1])
+                previous = entry
+                if len(table) + early >= 1 << width and width < 12:
+                    width += 1
+                if len(out) >= _INFLATE_CHUNK:
+                    yield bytes(out)
+                    out = bytearray()
+    yield bytes(out)
+
+
+def _run_length(pieces: Iterable[bytes], parms: Any) -> Iterator[bytes]:
+    pending = b""
+    for data in pieces:
+        data = pending + data
+        out = bytearray()
+        i = 0
+        while i < len(data):
+            length = data[i]
+            if length == 128:  # end of data
+                yield bytes(out)
+                return
+            if length < 128:
+                if i + length + 2 > len(data):
+                    break
+                out += data[i + 1:i + length + 2]
+                i += length + 2
+            else:
+                if i + 2 > len(data):
+                    break
+                out += data[i + 1:i + 2] * (257 - length)
+                i += 2
+            if len(out) >= _INFLATE_CHUNK:
+                yield bytes(out)
+                out = bytearray()
+        pending = data[i:]
+        yield bytes(out)
+
+
+def _ascii_hex(pieces: Iterable[bytes], parms: Any) -> Iterator[bytes]:
+    pending = b""
+    for data in pieces:
+        data, end, _ = data.partition(b">")
+        digits = pending + data.translate(None, b" \t\r\n\f\0")
+        pending = digits[len(digits) // 2 * 2:]
+        try:
+            yield bytes.fromhex(digits[:len(digits) // 2 * 2].decode("ascii"))
+        except ValueError:
+            return
+        if end:
+            break
+    try:
+        # an odd last digit is followed by an implied 0
+        yield bytes.fromhex((pending + b"0").decode("ascii")) if pending else b""
+    except ValueError:
+        return
+
+
+def _ascii85(pieces: Iterable[bytes], parms: Any) -> Iterator[bytes]:
+    pending = b""
+    first = True
+    for data in pieces:
+        if first:
+            data = data.lstrip()
+            data = data[2:] if data.startswith(b"<~") else data
+            first = False
+        data, end, _ = data.partition(b"~")
+        # "z" stands for a group of four zero bytes, as "!!!!!" does
+        groups = pending + data.translate(None, b" \t\r\n\f\0").replace(b"z", b"!!!!!")
+        pending = groups[len(groups) // 5 * 5:]
+        try:
+            yield base64.a85decode(groups[:len(groups) // 5 * 5])
+        except ValueError:
+            return
+        if end:
+            break
+    try:
+        yield base64.a85decode(pending)
+    except ValueError:
+        return
+
+
+_DECODERS: Dict[str, Callable[[Iterable[bytes], Any], Iterator[bytes]]] = {
+    "/FlateDecode": _flate, "/Fl": _flate,
+    "/LZWDecode": _lzw, "/LZW": _lzw,
+    "/RunLengthDecode": _run_length, "/RL": _run_length,
+    "/ASCIIHexDecode": _ascii_hex, "/AHx": _ascii_hex,
+    "/ASCII85Decode": _ascii85, "/A85": _ascii85,
+}
+
+
+def _count(pieces: Iterable[bytes], cap: int) -> int:
+    """Bytes in `pieces`, counting at most a little past `cap`."""
+    total = 0
+    for piece in pieces:
+        total += len(piece)
+        if total > cap:
+            break
+    return total
+
+
+def inflated_size(raw: bytes, cap: int) -> int:
+    """Size of zlib data `raw` once inflated, counting at most a little past `cap`."""
+    return _count(_flate(_pieces(raw), None), cap)
+
+
+def _decode_parms(obj: Any, count: int) -> List[Any]:
+    import pikepdf
+
+    parms = obj.get("/DecodeParms")
+    if isinstance(parms, pikepdf.Array):
+        return [p if isinstance(p, pikepdf.Dictionary) else None for p in parms] + [None] * (count - len(parms))
+    return [parms if isinstance(parms, pikepdf.Dictionary) else None] * count
+
+
+def decoded_size(obj: Any, cap: int) -> int:
+    """Bytes that decoding the stream `obj` produces, counting at most a little past `cap`."""
+    import pikepdf
+
+    if obj.get("/Subtype") == pikepdf.Name.Image and "/Width" in obj:
+        return _image_bytes(obj)
+    filters = stream_filters(obj)
+    pieces: Iterable[bytes] = _pieces(obj.read_raw_bytes())
+    for name, parms in zip(filters, _decode_parms(obj, len(filters))):
+        decoder = _DECODERS.get(name)
+        if decoder is None:
+            # an image codec: its output is an image's, measured above when it is one
+            break
+        pieces = decoder(pieces, parms)
+    return _count(pieces, cap)
+
+
+def check_counts(pdf: Any, limits: Limits) -> int:
+    """Check the object and page counts only (nothing is decoded); returns the page count."""
+    objects = int(pdf.trailer.get("/Size", 0))
+    if objects > limits.max_objects:
+        raise LimitExceeded(f"too many objects ({objects} > {limits.max_objects})")
+    try:
+        pages = int(pdf.Root.Pages.Count)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        pages = len(pdf.pages)
+    if pages > limits.max_pages:
+        raise LimitExceeded(f"too many pages ({pages} > {limits.max_pages})")
+    return pages
+
+
+def check_document(pdf: Any, limits: Limits) -> int:
+    """Raise LimitExceeded if `pdf` would break `limits` when fully decoded; returns the page count."""
+    import pikepdf
+
+    pages = check_counts(pdf, limits)
+    decoded = 0
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream):
+            continue
+        if obj.get("/Subtype") == pikepdf.Name.Image:
+            pixels = int(obj.get("/Width", 0)) * int(obj.get("/Height", 0))
+            if pixels > limits.max_image_pixels:
+                raise LimitExceeded(f"image too large ({pixels} pixels > {limits.max_image_pixels})")
+        decoded += decoded_size(obj, limits.max_decoded_bytes - decoded)
+        if decoded > limits.max_decoded_bytes:
+            raise LimitExceeded(f"streams decode to more than {limits.max_decoded_bytes} bytes")
+    return pages
+
+
+def check_bytes(data: bytes, limits: Optional[Limits] = None) -> None:
+    """check_document on the PDF in `data`; unreadable data is left for the caller to report."""
+    import pikepdf
+
+    try:
+        pdf = pikepdf.Pdf.open(io.BytesIO(data))
+    except pikepdf.PdfError:
+        return
+    with pdf:
+        check_document(pdf, limits or Limits.from_env())
@@ -0,0 +1,174 @@
+"""Cheap structural checks run on every merge input before the real work.
+
+Each file is checked in two steps:
+
+  1. bytes only: ``%PDF-`` header, last ``%%EOF`` marker and a ``startxref``
+     offset that lies inside the file (catches non-PDFs and truncated uploads)
+  2. qpdf opens the file, which reads just the xref and trailer: password
+     protection and the page count (from the root /Pages node); for inputs
+     whose pages will be rewritten, also what their streams decode to
+
+Files are checked in parallel and every failure is collected, so a large
+batch with one bad file fails at once with the full list.
+"""
+from __future__ import annotations
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+from merge_backends import _parse_page_ranges
+from pdf_limits import LimitExceeded, Limits, check_counts, check_document
+
+# PDF readers accept the header anywhere in the first KiB; the end-of-file
+# marker may be followed by any amount of padding (scanners, SMB copies)
+_HEADER_WINDOW = 1024
+_TAIL_WINDOW = 2048
+_BLOCK = 1024 * 1024
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)")
+# after the last %%EOF, the start of an incremental update cut off mid-write
+_UPDATE_RE = re.compile(rb"\d+\s+\d+\s+obj\b|\bxref\b|\btrailer\b")
+
+
+@dataclass
+class PreflightInfo:
+    path: str
+    size: int
+    version: str
+    pages: int
+    encrypted: bool
+
+
+@dataclass
+class PreflightFailure:
+    path: str
+    reason: str
+    page_selection: bool = False
+    limit: bool = False
+
+    def message(self) -> str:
+        if self.page_selection:
+            return f"Invalid page selection for {self.path}: {self.reason}"
+        return f"There was a problem reading the document: {self.path}: {self.reason}"
+
+
+class PreflightError(ValueError):
+    """One or more inputs failed preflight; `failures` lists all of them."""
+
+    def __init__(self, failures: List[PreflightFailure]) -> None:
+        self.failures = failures
+        super().__init__("; ".join(f.message() for f in failures))
+
+
+def _find_last_eof(f, size: int) -> int:
+    """Offset of the last ``%%EOF`` in the file, searched backwards block by block; -1 if none."""
+    end = size
+    while end > 0:
+        start = max(0, end - _BLOCK)
+        f.seek(start)
+        # overlap by the marker's length so one split across blocks is found
+        block = f.read(min(size, end + 4) - start)
+        idx = block.rfind(b"%%EOF")
+        if idx >= 0:
+            return start + idx
+        end = start
+    return -1
+
+
+def _check_structure(path: str) -> tuple[int, str]:
+    size = os.path.getsize(path)
+    if size == 0:
+        raise ValueError("empty file")
+    with open(path, "rb") as f:
+        head = f.read(_HEADER_WINDOW)
+        idx = head.find(b"%PDF-")
+        if idx < 0:
+            raise ValueError("not a PDF (no %PDF- header)")
+        version = head[idx + 5:idx + 8].decode("latin-1")
+        eof = _find_last_eof(f, size)
+        if eof < 0:
+            raise ValueError("truncated file (no %%EOF marker)")
+        f.seek(eof + 5)
+        if _UPDATE_RE.search(f.read(_BLOCK)):
+            raise ValueError("truncated file (incomplete update after the last %%EOF)")
+        f.seek(max(0, eof - _TAIL_WINDOW))
+        tail = f.read(eof - max(0, eof - _TAIL_WINDOW))
+    matches = list(_STARTXREF_RE.finditer(tail))
+    if not matches:
+        raise ValueError("no startxref found")
+    if int(matches[-1].group(1)) >= size:
+        raise ValueError("startxref points past the end of the file")
+    return size, version
+
+
+def check_file(path: str, limits: Optional[Limits] = None, decoded: bool = False) -> PreflightInfo:
+    """Check one input; raises ValueError (LimitExceeded for pdf_limits) with a short reason on failure.
+
+    With `decoded`, for inputs whose pages will be rewritten (resized), the
+    size of every stream once decoded is checked as well, not just the counts.
+    """
+    import pikepdf
+
+    if not os.path.isfile(path):
+        raise ValueError("file not found")
+    size, version = _check_structure(path)
+    try:
+        # like the merge backends, an empty user password is tried automatically
+        with pikepdf.Pdf.open(path) as pdf:
+            encrypted = pdf.is_encrypted
+            pages = (check_document if decoded else check_counts)(pdf, limits or Limits.from_env())
+    except pikepdf.PasswordError:
+        raise ValueError("encrypted PDF (password required)")
+    except pikepdf.PdfError as exc:
+        raise ValueError(f"unreadable PDF: {exc}")
+    if pages < 1:
+        raise ValueError("document has no pages")
+    return PreflightInfo(path=path, size=size, version=version, pages=pages, encrypted=encrypted)
+
+
+def preflight(
+    paths: Sequence[str],
+    page_ranges: Optional[Sequence[Optional[str]]] = None,
+    jobs: Optional[int] = None,
+    decoded: Optional[Sequence[bool]] = None,
+) -> List[PreflightInfo]:
+    """Check all `paths` in parallel; raise PreflightError listing every failure.
+
+    `page_ranges` (same length as `paths`, entries may be empty) are
+    validated against each file's page count as well. `decoded` (same
+    length) marks the inputs whose decoded stream sizes are checked too.
+    """
+    paths = list(paths)
+    if not paths:
+        return []
+    workers = jobs or min(32, (os.cpu_count() or 1) + 4, len(paths))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(check_file, p, None, bool(decoded and idx < len(decoded) and decoded[idx]))
+            for idx, p in enumerate(paths)
+        ]
+
+    infos: List[PreflightInfo] = []
+    failures: List[PreflightFailure] = []
+    for idx, (path, future) in enumerate(zip(paths, futures)):
+        try:
+            info = future.result()
+        except LimitExceeded as exc:
+            failures.append(PreflightFailure(path, str(exc), limit=True))
+            continue
+        except Exception as exc:
+            failures.append(PreflightFailure(path, str(exc)))
+            continue
+        ranges = page_ranges[idx] if page_ranges and idx < len(page_ranges) else None
+        if ranges:
+            try:
+                _parse_page_ranges(ranges, info.pages)
+            except ValueError as exc:
+                failures.append(PreflightFailure(path, str(exc), page_selection=True))
+                continue
+        infos.append(info)
+    if failures:
+        raise PreflightError(failures)
+    return infos
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Split PDF files.
+
+Usage examples:
+  python split_pdfs.py scan.pdf --every 50 -o parts/
+  python split_pdfs.py scan.pdf --ranges 1-3 4-10,12 13- -o parts/
+  python split_pdfs.py scan.pdf --max-size 25M -o parts/  # e.g. a mail size limit
+
+A split is planned first (which pages go into which chunk), then the chunks
+are written in a process pool, each worker opening the input itself. qpdf
+copies a page together with the objects it references and nothing else, so
+a chunk carries only its own fonts, images and other resources; links to
+pages that are not in the chunk are dropped.
+
+``--max-size`` plans chunks from the sizes of the objects each page
+references (counting resources shared by pages of one chunk once). A
+chunk that still comes out too large is split in half again; a single
+page larger than the limit is written on its own.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from merge_backends import OUTPUT_FORMATS, ObjGen, _check_output_format, _parse_page_ranges, _save_compact
+from pdf_limits import Limits, check_counts
+
+# xref entry plus "n 0 obj ... endobj" around every written object
+_OBJECT_OVERHEAD = 40
+# header, catalog, page tree and trailer of every chunk
+_FILE_OVERHEAD = 1024
+# qpdf drops these filters when saving, leaving the binary data underneath
+_ASCII_FILTERS = {"/ASCII85Decode": 0.8, "/A85": 0.8, "/ASCIIHexDecode": 0.5, "/AHx": 0.5}
+
+_SIZE_RE = re.compile(r"^\s*(?P<number>\d+(?:\.\d+)?)\s*(?P<unit>[kmg]?)i?b?\s*$", re.IGNORECASE)
+_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+# copied from the zip into memory at a time
+_ZIP_BLOCK = 1024 * 1024
+
+
+def _label(pages: List[int]) -> str:
+    """1-based page span, e.g. 'p1-50'."""
+    first, last = pages[0] + 1, pages[-1] + 1
+    return f"p{first}" if first == last else f"p{first}-{last}"
+
+
+@dataclass
+class Chunk:
+    path: str
+    pages: List[int]  # 0-based page indices of the input
+    size: int
+
+
+def parse_size(text: str) -> int:
+    """Bytes in a size like '25M', '500 KB', '1.5G' or '1048576'."""
+    m = _SIZE_RE.match(text or "")
+    if not m:
+        raise ValueError(f"Invalid size '{text}' (e.g. 25M, 500K, 1G)")
+    size = int(float(m.group("number")) * _UNITS[m.group("unit").lower()])
+    if size < 1:
+        raise ValueError(f"Invalid size '{text}'")
+    return size
+
+
+def plan_every(num_pages: int, every: int) -> List[List[int]]:
+    if every < 1:
+        raise ValueError("Pages per chunk must be at least 1")
+    return [list(range(start, min(start + every, num_pages))) for start in range(0, num_pages, every)]
+
+
+def plan_ranges(specs: Sequence[str], num_pages: int) -> List[List[int]]:
+    """One chunk per range string, each like '1-3,10' (see merge_backends._parse_page_ranges)."""
+    specs = [s for s in specs if s.strip()]
+    if not specs:
+        raise ValueError("No page ranges given")
+    return [_parse_page_ranges(spec, num_pages) for spec in specs]
+
+
+def _object_size(obj: Any) -> int:
+    import pikepdf
+
+    if isinstance(obj, pikepdf.Stream):
+        size = len(obj.read_raw_bytes())
+        filters = obj.get("/Filter")
+        first = filters[0] if isinstance(filters, pikepdf.Array) and len(filters) else filters
+        size = int(size * _ASCII_FILTERS.get(str(first), 1.0))
+        return size + len(obj.stream_dict.unparse(resolved=True)) + _OBJECT_OVERHEAD
+    return len(obj.unparse(resolved=True)) + _OBJECT_OVERHEAD
+
+
+def _page_objects(page: Any, sizes: Dict[ObjGen, int]) -> Dict[ObjGen, int]:
+    """Indirect objects copied along with `page` (the page tree and other pages excluded) and their sizes."""
+    import pikepdf
+
+    found: Dict[ObjGen, int] = {}
+    stack = [page]
+    while stack:
+        obj = stack.pop()
+        if obj.is_indirect:
+            if obj.objgen in found:
+                continue
+            if obj.objgen not in sizes:
+                sizes[obj.objgen] = _object_size(obj)
+            found[obj.objgen] = sizes[obj.objgen]
+        if isinstance(obj, pikepdf.Array):
+            children = list(obj)
+        elif isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+            children = [obj[k] for k in obj.keys() if k != "/Parent"]
+        else:
+            continue
+        for child in children:
+            if isinstance(child, (pikepdf.Dictionary, pikepdf.Stream)):
+                # links and annotations pointing at other pages do not copy them
+                if child.get("/Type") == pikepdf.Name.Page:
+                    continue
+            elif not isinstance(child, pikepdf.Array):
+                continue
+            stack.append(child)
+    return found
+
+
+def plan_max_size(pdf: Any, max_bytes: int) -> List[List[int]]:
+    """Consecutive pages grouped so that each chunk's estimated size stays under `max_bytes`."""
+    sizes: Dict[ObjGen, int] = {}
+    chunks: List[List[int]] = []
+    current: List[int] = []
+    seen: set = set()
+    size = _FILE_OVERHEAD
+    for index, page in enumerate(pdf.pages):
+        objects = _page_objects(page.obj, sizes)
+        extra = sum(s for objgen, s in objects.items() if objgen not in seen)
+        if current and size + extra > max_bytes:
+            chunks.append(current)
+            current, seen, size = [], set(), _FILE_OVERHEAD
+            extra = sum(objects.values())
+        current.append(index)
+        seen.update(objects)
+        size += extra
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def plan_split(
+    src: str | Path,
+    ranges: Optional[Sequence[str]] = None,
+    every: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    limits: Optional[Limits] = None,
+) -> List[List[int]]:
+    """Page indices of each chunk; exactly one of `ranges`, `every` and `max_bytes` is given.
+
+    Raises ValueError (LimitExceeded past pdf_limits) for unreadable inputs and bad options.
+    """
+    import pikepdf
+
+    if sum(option is not None for option in (ranges, every, max_bytes)) != 1:
+        raise ValueError("Choose one of: page ranges, pages per chunk, maximum size")
+    try:
+        pdf = pikepdf.Pdf.open(str(src))
+    except pikepdf.PasswordError:
+        raise ValueError("Cannot read encrypted PDF without password")
+    except pikepdf.PdfError as exc:
+        raise ValueError(f"There was a problem reading the document: {exc}")
+    with pdf:
+        # pages are copied, never decoded: the counts are the limits that apply
+        num_pages = check_counts(pdf, limits or Limits.from_env())
+        if num_pages < 1:
+            raise ValueError("Document has no pages")
+        if ranges is not None:
+            return plan_ranges(ranges, num_pages)
+        if every is not None:
+            return plan_every(num_pages, every)
+        return plan_max_size(pdf, max_bytes)
+
+
+def _chunk_path(output_dir: Path, stem: str, pages: List[int], taken: set) -> Path:
+    label = _label(pages)
+    name = f"{stem}_{label}.pdf"
+    n = 1
+    while name in taken:
+        n += 1
+        name = f"{stem}_{label}_{n}.pdf"
+    taken.add(name)
+    return output_dir / name
+
+
+def _write_chunk(
+    src: str, dst: str, pages: List[int], output_format: str, max_bytes: Optional[int], stem: str,
+) -> List[dict]:
+    """Write `pages` of `src` to `dst`, in halves while over `max_bytes`. Runs in a worker."""
+    import pikepdf
+
+    with pikepdf.Pdf.open(src) as pdf:
+        return _write_pages(pdf, Path(dst), pages, output_format, max_bytes, stem)
+
+
+def _write_pages(
+    pdf: Any, dst: Path, pages: List[int], output_format: str, max_bytes: Optional[int], stem: str,
+) -> List[dict]:
+    import pikepdf
+
+    with pikepdf.Pdf.new() as out:
+        out.pages.extend(pdf.pages[i] for i in pages)
+        buf = io.BytesIO()
+        if output_format == "compact":
+            _save_compact(out, buf)
+        else:
+            out.save(buf)
+    data = buf.getvalue()
+    if max_bytes is not None and len(data) > max_bytes and len(pages) > 1:
+        half = len(pages) // 2
+        written = []
+        for part in (pages[:half], pages[half:]):
+            dst_part = dst.with_name(f"{stem}_{_label(part)}.pdf")
+            written += _write_pages(pdf, dst_part, part, output_format, max_bytes, stem)
+        return written
+    dst.write_bytes(data)
+    return [{"path": str(dst), "pages": pages, "size": len(data)}]
+
+
+def write_chunks(
+    src: str | Path,
+    output_dir: str | Path,
+    plan: List[List[int]],
+    output_format: str = "standard",
+    max_bytes: Optional[int] = None,
+    jobs: Optional[int] = None,
+    prefix: Optional[str] = None,
+    pool: Optional[Executor] = None,
+) -> Iterator[Chunk]:
+    """Write the chunks of `plan` into `output_dir` in parallel; yields each in order as soon as it is done.
+
+    Files are named '<prefix>_p<first>-<last>.pdf' (prefix: the input's
+    name). Closing the iterator early cancels chunks not started yet.
+    With `pool` (a process pool shared by the caller, of `jobs` workers),
+    chunks are submitted to it instead of a pool of its own.
+    """
+    _check_output_format(output_format)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = prefix or Path(src).stem
+    taken: set = set()
+    tasks = [(str(_chunk_path(output_dir, stem, pages, taken)), pages) for pages in plan]
+    workers = min(jobs or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        for dst, pages in tasks:
+            for written in _write_chunk(str(src), dst, pages, output_format, max_bytes, stem):
+                yield Chunk(**written)
+        return
+    own = pool is None
+    if own:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    futures: List[Future] = []
+    try:
+        futures = [
+            pool.submit(_write_chunk, str(src), dst, pages, output_format, max_bytes, stem) for dst, pages in tasks
+        ]
+        for future in futures:
+            for written in future.result():
+                yield Chunk(**written)
+    finally:
+        if own:
+            pool.shutdown(cancel_futures=True)
+        else:
+            for future in futures:
+                future.cancel()
+
+
+def split_pdf(
+    src: str | Path,
+    output_dir: str | Path,
+    ranges: Optional[Sequence[str]] = None,
+    every: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    output_format: str = "standard",
+    jobs: Optional[int] = None,
+    prefix: Optional[str] = None,
+) -> List[Chunk]:
+    """Split `src` into `output_dir` by page ranges, every N pages or a maximum file size."""
+    plan = plan_split(src, ranges=ranges, every=every, max_bytes=max_bytes)
+    return list(write_chunks(src, output_dir, plan, output_format, max_bytes, jobs, prefix))
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable file for zipfile that keeps what was written until taken."""
+
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+        self.offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self.parts.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """ZIP archive of (path, name in archive) pairs, produced piece by piece.
+
+    Files are stored (PDF streams are compressed already) and read in
+    blocks, so neither they nor the archive are held in memory; `files` may
+    be a generator still producing them.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        for path, name in files:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            force_zip64 = os.path.getsize(path) > zipfile.ZIP64_LIMIT
+            with open(path, "rb") as src, archive.open(info, "w", force_zip64=force_zip64) as dst:
+                while True:
+                    block = src.read(_ZIP_BLOCK)
+                    if not block:
+                        break
+                    dst.write(block)
+                    yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Split a PDF file into several")
+    p.add_argument("input", help="PDF file to split")
+    p.add_argument("-o", "--output-dir", required=True, help="Directory for the parts")
+    mode = p.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--ranges", nargs="+", metavar="RANGE", help="One part per page range, e.g. 1-3 4-10,12 13-")
+    mode.add_argument("--every", type=int, metavar="N", help="A part every N pages")
+    mode.add_argument("--max-size", metavar="SIZE", help="Parts of at most SIZE each, e.g. 25M")
+    p.add_argument("--prefix", default=None, help="File name prefix of the parts (default: the input's name)")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    p.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default="standard",
+        help="'compact' packs objects into compressed object streams (needs a PDF 1.5+ reader)",
+    )
+    args = p.parse_args(argv)
+
+    t0 = time.perf_counter()
+    try:
+        max_bytes = parse_size(args.max_size) if args.max_size else None
+        plan = plan_split(args.input, ranges=args.ranges, every=args.every, max_bytes=max_bytes)
+        chunks = []
+        for chunk in write_chunks(
+            args.input, args.output_dir, plan, args.output_format, max_bytes, args.jobs, args.prefix,
+        ):
+            chunks.append(chunk)
+            print(f"{chunk.path}: {len(chunk.pages)} page(s), {chunk.size} bytes")
+    except Exception as exc:
+        print("Error:", exc, file=sys.stderr)
+        return 1
+    print(f"Split {args.input} into {len(chunks)} file(s) in {time.perf_counter() - t0:.1f}s")
+    if max_bytes is not None:
+        over = [c for c in chunks if c.size > max_bytes]
+        for chunk in over:
+            print(f"Warning: {chunk.path} is a single page larger than {args.max_size}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -19,3 +19,10 @@ def client() -> Iterator:
     flask_app.testing = True
     with flask_app.test_client() as c:
         yield c
+
+
+@fixture(autouse=True)
+def _results_dir(tmp_path: Path, monkeypatch) -> None:
+    # keep stored merge/compress results out of the shared temp directory
+    monkeypatch.setenv("RESULTS_DIR", str(tmp_path / "results"))
+    monkeypatch.setenv("STAGING_DIR", str(tmp_path / "staging"))
@@ -0,0 +1,146 @@
+import io
+import threading
+import time
+
+import pytest
+from PyPDF2 import PdfWriter
+
+from webapp import admission
+from webapp.admission import Budget, Cost, Rejected, estimate
+
+
+def _pdf(pages: int) -> bytes:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def test_estimate_depends_on_algorithm_size_and_pages() -> None:
+    mib = 1024 * 1024
+    assert estimate("downscale", 10 * mib, 10).memory > 10 * estimate("lossless", 10 * mib, 10).memory
+    assert estimate("merge", mib, 1000).seconds > estimate("merge", mib, 10).seconds
+    assert estimate("lossless", 100 * mib, 1).seconds > estimate("lossless", mib, 1).seconds
+
+
+def test_budget_queues_what_fits_soon_and_rejects_the_rest() -> None:
+    budget = Budget(memory=1000, slots=1, max_wait=5)
+    running = Cost(memory=100, seconds=1)
+    budget.acquire(running)
+
+    # a slot frees up within the expected second: wait for it
+    threading.Timer(0.2, budget.release, [running]).start()
+    t0 = time.monotonic()
+    second = Cost(memory=100, seconds=1)
+    budget.acquire(second)
+    assert 0.1 < time.monotonic() - t0 < 3
+    budget.release(second)
+
+    # 60 s of work ahead is beyond max_wait: reject at once with an estimate
+    budget.acquire(Cost(memory=100, seconds=60))
+    with pytest.raises(Rejected) as exc:
+        budget.acquire(Cost(memory=100, seconds=1))
+    assert exc.value.retry_after >= 30
+
+
+def test_requests_larger_than_the_budget_run_alone() -> None:
+    budget = Budget(memory=1000, slots=4, max_wait=0.2)
+    huge = Cost(memory=10_000, seconds=0.1)
+    budget.acquire(huge)
+    assert budget.usage()["memory"] == 1000
+    with pytest.raises(Rejected):
+        budget.acquire(Cost(memory=1, seconds=0.1))
+    budget.release(huge)
+    budget.acquire(Cost(memory=1, seconds=0.1))
+
+
+def test_route_rejects_with_retry_after_when_busy(client, monkeypatch) -> None:
+    budget = Budget(memory=10 ** 9, slots=1, max_wait=1)
+    monkeypatch.setattr(admission, "budget", budget)
+    long_running = Cost(memory=0, seconds=120)
+    budget.acquire(long_running)
+
+    data = {"file": (io.BytesIO(_pdf(3)), "a.pdf"), "algorithm": "lossless"}
+    resp = client.post("/compress", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 503
+    assert int(resp.headers["Retry-After"]) >= 60
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'pdftools_admission_rejected_total{route="/compress"} 1' in text
+    assert 'pdftools_admission_cpu_slots{kind="in_use"} 1' in text
+
+    budget.release(long_running)
+    data = {"file": (io.BytesIO(_pdf(3)), "a.pdf"), "algorithm": "lossless"}
+    resp = client.post("/compress", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    # the request gave its share back when it finished
+    assert budget.usage() == {"memory": 0, "slots": 0, "queued": 0}
+
+
+def test_share_of_a_killed_process_is_reclaimed() -> None:
+    import multiprocessing
+    import os
+
+    budget = Budget(memory=1000, slots=1, max_wait=0.2)
+
+    def hold_and_die() -> None:
+        budget.acquire(Cost(memory=500, seconds=100))
+        os._exit(1)  # killed mid-request: no release
+
+    for reclaim in (False, True):
+        child = multiprocessing.get_context("fork").Process(target=hold_and_die)
+        child.start()
+        child.join()
+        assert budget.usage()["slots"] == 1
+        if reclaim:
+            # what gunicorn's child_exit hook does
+            assert budget.reclaim(child.pid)
+            assert budget.usage() == {"memory": 0, "slots": 0, "queued": 0}
+        # otherwise the next request that would have to wait sweeps dead PIDs
+        budget.acquire(Cost(memory=100, seconds=1))
+        assert budget.usage()["memory"] == 100
+        budget.release(Cost(memory=100, seconds=1))
+
+
+def test_rejected_upload_is_not_read(monkeypatch) -> None:
+    from werkzeug.test import EnvironBuilder
+
+    from webapp import app
+
+    budget = Budget(memory=10 ** 9, slots=1, max_wait=1)
+    monkeypatch.setattr(admission, "budget", budget)
+    budget.acquire(Cost(memory=0, seconds=120))
+
+    builder = EnvironBuilder(
+        path="/compress?algorithm=downscale", method="POST",
+        data={"file": (io.BytesIO(_pdf(3)), "a.pdf"), "algorithm": "downscale"},
+    )
+    environ = builder.get_environ()
+    body = environ["wsgi.input"]
+    statuses: list = []
+    b"".join(app(environ, lambda status, headers: statuses.append(status)))
+    assert statuses == ["503 SERVICE UNAVAILABLE"]
+    # decided on Content-Length and the query string: the upload was never read
+    assert body.tell() == 0
+
+
+def test_page_count_can_turn_a_small_upload_away(client, monkeypatch) -> None:
+    budget = Budget(memory=10 ** 7, slots=4, max_wait=0.2)
+    monkeypatch.setattr(admission, "budget", budget)
+    other = Cost(memory=6 * 10 ** 6, seconds=60)
+    budget.acquire(other)
+
+    # a few KB of upload fit, but 200 pages are charged 8 MB when merged
+    pages = _pdf(200)
+    assert estimate("merge", len(pages), 0).memory < 10 ** 6
+    data = {"files": [(io.BytesIO(pages), "a.pdf")]}
+    resp = client.post("/merge", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 503
+    assert budget.usage() == {"memory": other.memory, "slots": 1, "queued": 0}
+
+    budget.release(other)
+    resp = client.post("/merge", data={"files": [(io.BytesIO(pages), "a.pdf")]}, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    assert budget.usage() == {"memory": 0, "slots": 0, "queued": 0}
@@ -0,0 +1,165 @@
+import asyncio
+import io
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from webapp.asgi import Application
+
+
+def _pdf(pages: int) -> bytes:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def _multipart(fields: dict, files: list) -> tuple[bytes, str]:
+    boundary = "pdftoolsboundary"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        head = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        )
+        parts.append(head.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def _request(app, method: str, path: str, body: bytes = b"", headers=(), chunk: int = 0) -> tuple:
+    """Drive one ASGI http request; the body arrives in `chunk`-sized messages like a slow upload."""
+    pieces = [body[i:i + chunk] for i in range(0, len(body), chunk)] if chunk else [body]
+    messages = [{"type": "http.request", "body": p, "more_body": i < len(pieces) - 1} for i, p in enumerate(pieces)]
+    sent: list = []
+
+    async def receive():
+        await asyncio.sleep(0)
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "path": path, "query_string": b"",
+        "root_path": "", "scheme": "http", "server": ("testserver", 80), "client": ("127.0.0.1", 1234),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+    }
+    await app(scope, receive, send)
+    start = sent[0]
+    data = b"".join(m.get("body", b"") for m in sent[1:])
+    assert not sent[-1].get("more_body")
+    return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}, data
+
+
+@pytest.fixture()
+def app():
+    application = Application(workers=2)
+    application.start()
+    yield application
+    application.stop()
+
+
+def test_offloaded_merge_matches_wsgi_route(app) -> None:
+    body, content_type = _multipart({}, [("files", "a.pdf", _pdf(2)), ("files", "b.pdf", _pdf(3))])
+    status, headers, data = asyncio.run(_request(
+        app, "POST", "/merge", body, [("Content-Type", content_type), ("Content-Length", str(len(body)))], chunk=1000,
+    ))
+    assert status == 200
+    assert headers["content-type"] == "application/pdf"
+    assert len(PdfReader(io.BytesIO(data)).pages) == 5
+    assert int(headers["content-length"]) == len(data)
+
+    # the request ran in a worker process but is counted here
+    status, _, text = asyncio.run(_request(app, "GET", "/metrics"))
+    assert status == 200
+    assert 'pdftools_request_duration_seconds_count{route="/merge",method="POST",status="200",algorithm=""}' in text.decode()
+
+
+def test_offloaded_errors_and_chunked_uploads(app, monkeypatch) -> None:
+    import webapp.asgi
+
+    # bodies past the spool size go to a temporary file the worker reads
+    monkeypatch.setattr(webapp.asgi, "SPOOL_BYTES", 100)
+    body, content_type = _multipart({"algorithm": "lossless"}, [("file", "x.pdf", b"not a pdf")])
+    headers = [("Content-Type", content_type), ("Transfer-Encoding", "chunked")]
+    status, _, data = asyncio.run(_request(app, "POST", "/compress", body, headers, chunk=64))
+    assert status == 400
+    assert data.endswith(b"\n") and b"No file uploaded" not in data, data
+
+
+def test_threaded_routes_and_lifespan() -> None:
+    application = Application(workers=1)
+    events = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent: list = []
+
+    async def receive():
+        return events.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    async def run():
+        await application({"type": "lifespan"}, receive, send)
+
+    asyncio.run(run())
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert application.pool is None
+
+    status, headers, data = asyncio.run(_request(application, "GET", "/"))
+    assert status == 200 and b"<html" in data.lower()
+    assert application.pool is None
+
+
+def test_chunked_body_past_the_limit_is_not_received(app, monkeypatch) -> None:
+    import webapp.asgi
+    from webapp import app as flask_app
+
+    assert app.pool._mp_context.get_start_method() == "fork"
+    received: list = []
+    write = webapp.asgi._Body.write
+    monkeypatch.setattr(webapp.asgi._Body, "write", lambda self, data: (received.append(len(data)), write(self, data)))
+    monkeypatch.setitem(flask_app.config, "MAX_CONTENT_LENGTH", 1000)
+    body, content_type = _multipart({"algorithm": "lossless"}, [("file", "x.pdf", b"x" * 10000)])
+    headers = [("Content-Type", content_type), ("Transfer-Encoding", "chunked")]
+    status, _, data = asyncio.run(_request(app, "POST", "/compress", body, headers, chunk=100))
+    assert status == 413 and b"too large" in data
+    # reading stopped at the limit, not at the end of the upload
+    assert sum(received) <= 1100
+
+
+def test_file_responses_are_sent_in_large_blocks() -> None:
+    import webapp.asgi
+
+    blocks = list(webapp.asgi._FileBody(io.BytesIO(b"x" * (3 * webapp.asgi._CHUNK)), 8192))
+    assert [len(b) for b in blocks] == [webapp.asgi._CHUNK] * 3
+
+
+def test_pool_is_replaced_after_a_worker_dies() -> None:
+    import os
+    import signal
+    import time
+
+    application = Application(workers=1)
+    body, content_type = _multipart({}, [("files", "a.pdf", _pdf(1))])
+    headers = [("Content-Type", content_type), ("Content-Length", str(len(body)))]
+    try:
+        assert asyncio.run(_request(application, "POST", "/merge", body, headers))[0] == 200
+        broken = application.pool
+        for pid in list(broken._processes):
+            os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while not broken._broken and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        # the request that finds the pool broken fails; the next one gets a new pool
+        assert asyncio.run(_request(application, "POST", "/merge", body, headers))[0] == 500
+        assert application.pool is None
+        status, _, data = asyncio.run(_request(application, "POST", "/merge", body, headers))
+        assert status == 200 and len(PdfReader(io.BytesIO(data)).pages) == 1
+    finally:
+        application.stop()
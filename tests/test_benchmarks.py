@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from PyPDF2 import PdfReader
+
+from benchmarks.corpus import ensure_corpus
+from benchmarks.run import CASES, compare
+
+
+def _report(seconds: float, rss: int) -> dict:
+    return {"results": {"merge_pdfs/many_small": {"seconds_median": seconds, "peak_rss_kb": rss}}}
+
+
+def test_compare_flags_regressions() -> None:
+    base = _report(1.0, 100_000)
+    assert compare(_report(1.05, 100_000), base, threshold=0.15) == []
+    assert compare(_report(1.5, 100_000), base, threshold=0.15) == ["merge_pdfs/many_small"]
+    assert compare(_report(1.0, 150_000), base, threshold=0.15) == ["merge_pdfs/many_small"]
+
+
+def test_compare_ignores_jitter_on_tiny_cases() -> None:
+    assert compare(_report(0.002, 100), _report(0.001, 100), threshold=0.15) == []
+
+
+def test_corpus_is_cached_and_readable(tmp_path: Path) -> None:
+    files = ensure_corpus(tmp_path, "mixed_sizes", scale=0.01)
+    assert len(files) == 5
+    assert ensure_corpus(tmp_path, "mixed_sizes", scale=0.01) == files
+    sizes = {tuple(int(float(v)) for v in PdfReader(f).pages[0].mediabox[2:]) for f in files}
+    assert len(sizes) == 5
+
+
+def test_every_hot_path_has_a_case() -> None:
+    prefixes = {name.rsplit("/", 1)[0] for name in CASES}
+    assert {"merge_pdfs", "merge_pdfs_bytes", "compress/lossless", "compress/optimize",
+            "compress/downscale", "add_signature"} <= prefixes
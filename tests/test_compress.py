@@ -0,0 +1,396 @@
+import io
+from pathlib import Path
+
+import pikepdf
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+from compress_pdfs import LOSSLESS_PHASES, compress_lossless
+from merge_pdfs import merge_pdfs_bytes
+
+
+def _texts(data: bytes) -> list[str]:
+    return [p.extract_text().strip() for p in PdfReader(io.BytesIO(data)).pages]
+
+
+@pytest.fixture()
+def merged(tmp_path: Path) -> bytes:
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+
+    logo = io.BytesIO()
+    Image.effect_noise((64, 64), 50).convert("RGB").save(logo, format="PNG")
+    files = []
+    for n in range(4):
+        path = tmp_path / f"l{n}.pdf"
+        c = canvas.Canvas(str(path))
+        c.drawImage(ImageReader(io.BytesIO(logo.getvalue())), 10, 700, width=100, height=100)
+        c.drawString(10, 10, f"letter{n}")
+        c.save()
+        files.append(str(path))
+    # merged without sharing: every letter keeps its own copy of the logo
+    return merge_pdfs_bytes(files, dedup=False)
+
+
+def test_lossless_collapses_duplicates(merged: bytes) -> None:
+    stats: dict = {}
+    out = compress_lossless(merged, stats=stats)
+
+    assert _texts(out) == [f"letter{n}" for n in range(4)]
+    assert len(out) < len(merged) / 2
+    phases = stats["phases"]
+    assert tuple(phases) == LOSSLESS_PHASES
+    assert phases["collapse"]["objects"] >= 3
+    assert phases["collapse"]["bytes_saved"] > 0
+    assert stats["output_size"] == len(out)
+    assert stats["input_size"] - sum(p["bytes_saved"] for p in phases.values()) == len(out)
+
+
+def test_lossless_keeps_identical_pages_apart() -> None:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    for _ in range(3):
+        c.drawString(10, 10, "same")
+        c.showPage()
+    c.save()
+    out = compress_lossless(buf.getvalue())
+    assert _texts(out) == ["same"] * 3
+
+
+def test_lossless_keeps_equal_layers_and_actions_apart() -> None:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    c.drawString(10, 10, "layers")
+    c.showPage()
+    c.save()
+    with pikepdf.Pdf.open(io.BytesIO(buf.getvalue())) as pdf:
+        # two layers with the same name, one shown and one hidden
+        on, off = (pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.OCG, Name="Notes")) for _ in range(2))
+        pdf.Root.OCProperties = pikepdf.Dictionary(
+            OCGs=[on, off], D=pikepdf.Dictionary(ON=[on], OFF=[off]),
+        )
+        page = pdf.pages[0].obj
+        page.Resources.Properties = pikepdf.Dictionary(L1=on, L2=off)
+        actions = [pdf.make_indirect(pikepdf.Dictionary(S=pikepdf.Name.JavaScript, JS="app.alert(1)")) for _ in range(2)]
+        page.AA = pikepdf.Dictionary(O=actions[0], C=actions[1])
+        src = io.BytesIO()
+        pdf.save(src)
+
+    with pikepdf.Pdf.open(io.BytesIO(compress_lossless(src.getvalue()))) as pdf:
+        default = pdf.Root.OCProperties.D
+        assert default.ON[0].objgen != default.OFF[0].objgen
+        aa = pdf.pages[0].obj.AA
+        assert aa.O.objgen != aa.C.objgen
+
+
+def test_compress_route_reports_phases(client, merged: bytes) -> None:
+    resp = client.post(
+        "/compress", data={"file": (io.BytesIO(merged), "m.pdf"), "algorithm": "lossless"},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 200
+    timing = resp.headers["Server-Timing"]
+    assert all(f"{name};dur=" in timing for name in LOSSLESS_PHASES)
+    saved = dict(part.split("=") for part in resp.headers["X-Compress-Bytes-Saved"].split(", "))
+    assert int(saved["collapse"]) > 0
+    assert _texts(resp.data) == [f"letter{n}" for n in range(4)]
+
+
+def _image_pdf(img, width: float = 200, height: float = 280) -> bytes:
+    from reportlab.lib.utils import ImageReader
+
+    png = io.BytesIO()
+    img.save(png, format="PNG")
+    png.seek(0)
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(width, height))
+    c.drawImage(ImageReader(png), 0, 0, width=width, height=height)
+    c.save()
+    return buf.getvalue()
+
+
+def _scan():
+    from PIL import Image, ImageDraw
+
+    img = Image.new("L", (800, 1100), 250)
+    draw = ImageDraw.Draw(img)
+    for y in range(50, 1050, 30):
+        draw.rectangle((50, y, 50 + (y * 7) % 600, y + 12), fill=20)
+    return img.convert("RGB")
+
+
+def _only_image(pdf):
+    import pikepdf
+
+    (image,) = pdf.pages[0].get_images().values()
+    return pikepdf.PdfImage(image)
+
+
+def test_classify_image() -> None:
+    from PIL import Image
+
+    from compress_pdfs import classify_image
+
+    assert classify_image(_scan()) == "bilevel"
+    assert classify_image(Image.linear_gradient("L").resize((300, 300)).convert("RGB")) == "gray"
+    chart = Image.new("RGB", (300, 300), "white")
+    chart.paste((200, 30, 30), (20, 20, 120, 280))
+    chart.paste((30, 30, 200), (150, 100, 250, 280))
+    assert classify_image(chart) == "palette"
+    noise = Image.merge("RGB", [Image.effect_noise((300, 300), 60 + i) for i in range(3)])
+    assert classify_image(noise) == "photo"
+
+
+def test_downscale_encodes_scans_as_bilevel() -> None:
+    from PIL import ImageChops
+
+    from compress_pdfs import compress_downscale
+
+    data = _image_pdf(_scan())
+    stats: dict = {}
+    out = compress_downscale(data, max_px=550, stats=stats)
+
+    pdf = pikepdf.open(io.BytesIO(out))
+    image = _only_image(pdf)
+    assert image.bits_per_component == 1
+    assert image.width == 400 and image.height == 550
+    assert set(stats["images"]) == {"bilevel"}
+    assert len(out) < len(data) / 4
+    expected = _scan().convert("L").resize((400, 550)).point(lambda v: 255 if v >= 128 else 0)
+    diff = ImageChops.difference(image.as_pil_image().convert("L"), expected).histogram()
+    # resampling may flip a few edge pixels, the rest must match
+    assert sum(diff[128:]) < 400 * 550 * 0.02
+
+
+def test_downscale_keeps_gray_images_gray() -> None:
+    from PIL import Image
+
+    from compress_pdfs import compress_downscale
+
+    gradient = Image.linear_gradient("L").resize((600, 600)).convert("RGB")
+    out = compress_downscale(_image_pdf(gradient, 300, 300), max_px=300)
+    pdf = pikepdf.open(io.BytesIO(out))
+    image = _only_image(pdf)
+    assert str(image.filters[0]) == "/DCTDecode"
+    assert str(image.colorspace) == "/DeviceGray"
+
+
+def test_small_palette_images_reencoded_losslessly() -> None:
+    import random
+
+    from PIL import Image, ImageChops
+
+    from compress_pdfs import compress_downscale
+
+    # 16 colours in random blocks: big as RGB Flate, exact as 4-bit indexed
+    rng = random.Random(1)
+    colours = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(16)]
+    chart = Image.new("RGB", (600, 600))
+    chart.putdata([colours[rng.randrange(16)] for _ in range(600 * 600)])
+    data = _image_pdf(chart)
+    stats: dict = {}
+    out = compress_downscale(data, stats=stats)
+
+    pdf = pikepdf.open(io.BytesIO(out))
+    image = _only_image(pdf)
+    assert image.width == 600
+    assert set(stats["images"]) == {"palette"}
+    assert len(out) < len(data) * 0.75
+    assert ImageChops.difference(image.as_pil_image().convert("RGB"), chart).getbbox() is None
+
+
+def _placed_pdf(img, placements: list[tuple[float, float]], pagesize=(612, 792)) -> bytes:
+    """One page drawing the same image at each (width, height) in points."""
+    from reportlab.lib.utils import ImageReader
+
+    png = io.BytesIO()
+    img.save(png, format="PNG")
+    png.seek(0)
+    reader = ImageReader(png)
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=pagesize)
+    for i, (width, height) in enumerate(placements):
+        c.drawImage(reader, 10 + i * 20, 10 + i * 20, width=width, height=height)
+    c.save()
+    return buf.getvalue()
+
+
+def test_image_placements_follow_forms_and_matrices() -> None:
+    from PIL import Image
+
+    from compress_pdfs import image_placements
+
+    # reportlab wraps each drawImage in a Form XObject; the same image twice
+    data = _placed_pdf(Image.new("RGB", (100, 50), "red"), [(72, 36), (288, 144)])
+    pdf = pikepdf.open(io.BytesIO(data))
+    ((objgen, (width, height)),) = image_placements(pdf).items()
+    assert pdf.get_object(objgen).Width == 100
+    assert (round(width), round(height)) == (288, 144)
+
+
+def _colour_gradient(size: int):
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((size, size))
+    return Image.merge("RGB", [gradient, gradient.rotate(90), Image.radial_gradient("L").resize((size, size))])
+
+
+def test_downscale_uses_effective_dpi() -> None:
+    from compress_pdfs import compress_downscale
+
+    img = _colour_gradient(1200)
+    # 1200 px shown as a 1 inch thumbnail: 1200 dpi -> 150 px
+    pdf = pikepdf.open(io.BytesIO(compress_downscale(_placed_pdf(img, [(72, 72)]))))
+    assert (_only_image(pdf).width, _only_image(pdf).height) == (150, 150)
+
+    # shown 6.4 inches wide: 187 dpi, above 150 * margin -> 960 px
+    pdf = pikepdf.open(io.BytesIO(compress_downscale(_placed_pdf(img, [(460.8, 460.8)]))))
+    assert _only_image(pdf).width == 960
+
+    # shown 7.2 inches wide: 167 dpi, close enough to 150 -> untouched
+    pdf = pikepdf.open(io.BytesIO(compress_downscale(_placed_pdf(img, [(518.4, 518.4)]))))
+    assert _only_image(pdf).width == 1200
+
+
+def test_downscale_sizes_for_largest_placement() -> None:
+    from compress_pdfs import compress_downscale
+
+    data = _placed_pdf(_colour_gradient(1000), [(72, 72), (288, 288)])
+    pdf = pikepdf.open(io.BytesIO(compress_downscale(data, target_dpi=100)))
+    # 4 inches at 100 dpi, not 1 inch
+    assert _only_image(pdf).width == 400
+
+
+def _full_font_pdf(text: str) -> pikepdf.Pdf:
+    """One page showing `text` in Vera, embedded whole (reportlab always subsets)."""
+    import reportlab
+
+    ttf = (Path(reportlab.__file__).parent / "fonts" / "Vera.ttf").read_bytes()
+    pdf = pikepdf.new()
+    program = pdf.make_stream(ttf)
+    program.Length1 = len(ttf)
+    descriptor = pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.FontDescriptor, FontName=pikepdf.Name.BitstreamVeraSans, Flags=32,
+        FontBBox=[-183, -236, 1287, 928], ItalicAngle=0, Ascent=928, Descent=-236, CapHeight=700,
+        StemV=80, FontFile2=program,
+    ))
+    font = pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.TrueType, BaseFont=pikepdf.Name.BitstreamVeraSans,
+        Encoding=pikepdf.Name.WinAnsiEncoding, FontDescriptor=descriptor,
+    ))
+    pdf.add_blank_page(page_size=(200, 100))
+    page = pdf.pages[0]
+    page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+    page.Contents = pdf.make_stream(f"BT /F1 12 Tf 10 40 Td ({text}) Tj ET".encode())
+    return pdf
+
+
+def _save(pdf: pikepdf.Pdf, **kwargs) -> bytes:
+    buf = io.BytesIO()
+    pdf.save(buf, **kwargs)
+    return buf.getvalue()
+
+
+def test_lossless_collapses_fonts_stored_differently(tmp_path: Path) -> None:
+    # the same font program, once Flate-compressed and once stored raw
+    first, second = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    first.write_bytes(_save(_full_font_pdf("first")))
+    second.write_bytes(_save(_full_font_pdf("second"), compress_streams=False))
+    merged = merge_pdfs_bytes([str(first), str(second)], dedup=False)
+
+    stats: dict = {}
+    out = compress_lossless(merged, stats=stats)
+    assert _texts(out) == ["first", "second"]
+    assert stats["fonts"]["BitstreamVeraSans"]["duplicates"] == 1
+    assert stats["fonts"]["BitstreamVeraSans"]["bytes_saved"] > 0
+    assert stats["phases"]["fonts"]["objects"] == 1
+    pdf = pikepdf.open(io.BytesIO(out))
+    programs = {page.Resources.Font.F1.FontDescriptor.FontFile2.objgen for page in pdf.pages}
+    assert len(programs) == 1
+
+
+def test_lossless_subsets_fonts_to_used_glyphs() -> None:
+    pytest.importorskip("fontTools")
+    from fontTools.ttLib import TTFont
+
+    data = _save(_full_font_pdf("Hello"))
+    stats: dict = {}
+    out = compress_lossless(data, subset_fonts=True, stats=stats)
+
+    assert _texts(out) == ["Hello"]
+    assert len(out) < len(data) / 2
+    ((name, report),) = stats["fonts"].items()
+    assert name == "BitstreamVeraSans" and report["bytes_saved"] > 0
+    pdf = pikepdf.open(io.BytesIO(out))
+    font = pdf.pages[0].Resources.Font.F1
+    assert str(font.BaseFont).endswith("+BitstreamVeraSans")
+    ttfont = TTFont(io.BytesIO(font.FontDescriptor.FontFile2.read_bytes()))
+    glyf = ttfont["glyf"]
+    drawn = {g for g in ttfont.getGlyphOrder() if glyf[g].numberOfContours != 0}
+    assert drawn == {".notdef", "H", "e", "l", "o"}
+
+
+def test_subsetting_skips_fonts_used_by_form_fields() -> None:
+    pytest.importorskip("fontTools")
+
+    pdf = _full_font_pdf("Hello")
+    font = pdf.pages[0].Resources.Font.F1
+    pdf.Root.AcroForm = pikepdf.Dictionary(Fields=[], DR=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font)))
+    stats: dict = {}
+    compress_lossless(_save(pdf), subset_fonts=True, stats=stats)
+    assert stats["fonts"] == {}
+
+
+def test_cli_compresses_tree_and_skips_up_to_date(tmp_path: Path, merged: bytes, capsys) -> None:
+    import os
+
+    from compress_pdfs import main
+
+    src = tmp_path / "in"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.pdf").write_bytes(merged)
+    (src / "sub" / "b.pdf").write_bytes(merged)
+    (src / "sub" / "broken.pdf").write_bytes(b"%PDF-1.4 not really")
+    out = tmp_path / "out"
+
+    assert main([str(src), "-r", "-o", str(out), "--jobs", "2"]) == 1
+    assert _texts((out / "sub" / "b.pdf").read_bytes()) == [f"letter{n}" for n in range(4)]
+    assert (out / "a.pdf").stat().st_size < len(merged) / 2
+    assert sorted(p.name for p in out.rglob("*")) == ["a.pdf", "b.pdf", "sub"]
+    captured = capsys.readouterr()
+    assert "broken.pdf" in captured.err
+    assert "Compressed 2 file(s), skipped 0 up to date, 1 failed" in captured.out
+
+    # only the input touched since the last run is compressed again
+    os.utime(src / "a.pdf", ns=((out / "a.pdf").stat().st_mtime_ns + 10**9,) * 2)
+    (src / "sub" / "broken.pdf").unlink()
+    assert main([str(src), "-r", "-o", str(out)]) == 0
+    assert "Compressed 1 file(s), skipped 1 up to date, 0 failed" in capsys.readouterr().out
+
+
+def test_cli_gives_clashing_destinations_their_own_names(tmp_path: Path, merged: bytes, capsys) -> None:
+    from compress_pdfs import main
+
+    for folder, data in (("a", merged), ("b", _save(pikepdf.new()))):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "x.pdf").write_bytes(data)
+    a, b = str(tmp_path / "a" / "x.pdf"), str(tmp_path / "b" / "x.pdf")
+    out = tmp_path / "out"
+
+    assert main([a, b, a, str(tmp_path / "b"), "-o", str(out)]) == 0
+    assert "Compressed 2 file(s)" in capsys.readouterr().out
+    assert sorted(p.name for p in out.iterdir()) == ["x.pdf", "x_2.pdf"]
+    with pikepdf.open(out / "x.pdf") as first, pikepdf.open(out / "x_2.pdf") as second:
+        assert (len(first.pages), len(second.pages)) == (4, 0)
+
+
+def test_optimize_route_uses_library(client, merged: bytes) -> None:
+    resp = client.post(
+        "/compress", data={"file": (io.BytesIO(merged), "m.pdf"), "algorithm": "optimize"},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 200
+    assert "serialize;dur=" in resp.headers["Server-Timing"]
+    assert len(resp.data) < len(merged)
+    assert _texts(resp.data) == [f"letter{n}" for n in range(4)]
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+import encrypt_env
+from encrypt_env import KEY_FD_VAR, decrypt_bytes, encrypt_bytes, load_encrypted_env, new_params, share_key
+
+PLAIN = b"FLASK_SECRET=s3cret\nGOOGLE_CLIENT_ID=abc # comment\n"
+
+
+@pytest.fixture(autouse=True)
+def _clean_env(monkeypatch) -> None:
+    for name in ("ENV_PASSWORD", "ENV_PASSWORD_FILE", KEY_FD_VAR, "FLASK_SECRET", "GOOGLE_CLIENT_ID"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(encrypt_env, "_key_cache", {})
+
+
+@pytest.mark.parametrize("kdf,cost", [("scrypt", 10), ("pbkdf2", 1000)])
+def test_roundtrip_with_salted_kdf(kdf: str, cost: int) -> None:
+    params = new_params(kdf, cost)
+    blob = encrypt_bytes(PLAIN, "pw", params)
+    assert blob.startswith(encrypt_env.HEADER)
+    assert decrypt_bytes(blob, "pw") == PLAIN
+    with pytest.raises(InvalidToken):
+        decrypt_bytes(blob, "wrong")
+    # a fresh salt gives a different key for the same password
+    assert encrypt_env.derive_key("pw", params) != encrypt_env.derive_key("pw", new_params(kdf, cost))
+
+
+def test_legacy_files_still_decrypt() -> None:
+    legacy_key = base64.urlsafe_b64encode(hashlib.sha256(b"pw").digest())
+    blob = Fernet(legacy_key).encrypt(PLAIN)
+    assert decrypt_bytes(blob, "pw") == PLAIN
+
+
+def test_load_encrypted_env_in_memory_with_key_cache(tmp_path: Path, monkeypatch) -> None:
+    path = tmp_path / ".env.encrypted"
+    path.write_bytes(encrypt_bytes(PLAIN, "pw", new_params("scrypt", 10)))
+    monkeypatch.setenv("ENV_PASSWORD", "pw")
+
+    values = load_encrypted_env(path)
+    assert values == {"FLASK_SECRET": "s3cret", "GOOGLE_CLIENT_ID": "abc"}
+    assert os.environ["FLASK_SECRET"] == "s3cret"
+    assert "ENV_PASSWORD" not in os.environ
+    # the key stays in this process: nothing a child process would inherit holds it
+    key = next(iter(encrypt_env._key_cache.values())).decode()
+    assert not any(key in value for value in os.environ.values())
+    assert sorted(p.name for p in tmp_path.iterdir()) == [".env.encrypted"]
+
+    # a worker inheriting the cache loads without the password or the KDF
+    monkeypatch.delenv("FLASK_SECRET")
+    monkeypatch.setattr(encrypt_env, "derive_key", lambda *a: pytest.fail("KDF ran again"))
+    load_encrypted_env(path)
+    assert os.environ["FLASK_SECRET"] == "s3cret"
+
+
+def test_key_cache_is_bound_to_the_file_parameters(tmp_path: Path, monkeypatch) -> None:
+    first = tmp_path / "a.env.encrypted"
+    second = tmp_path / "b.env.encrypted"
+    first.write_bytes(encrypt_bytes(PLAIN, "pw", new_params("scrypt", 10)))
+    second.write_bytes(encrypt_bytes(PLAIN, "pw", new_params("scrypt", 10)))
+    monkeypatch.setenv("ENV_PASSWORD", "pw")
+    load_encrypted_env(first)
+
+    # different salt: the cached key does not apply and there is no password left
+    with pytest.raises(ValueError, match="No password"):
+        load_encrypted_env(second)
+
+
+def test_key_is_handed_to_an_exec_d_child_on_an_inherited_fd(tmp_path: Path, monkeypatch) -> None:
+    path = tmp_path / ".env.encrypted"
+    path.write_bytes(encrypt_bytes(PLAIN, "pw", new_params("scrypt", 10)))
+    assert share_key() is None
+    load_encrypted_env(path, password="pw")
+
+    fd = share_key()
+    env = {k: v for k, v in os.environ.items() if k != "FLASK_SECRET"}
+    env[KEY_FD_VAR] = str(fd)
+    code = (
+        "import os, sys; sys.path.insert(0, sys.argv[1]); import encrypt_env; "
+        "encrypt_env.load_encrypted_env(sys.argv[2]); print(os.environ['FLASK_SECRET'])"
+    )
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-c", code, str(Path(encrypt_env.__file__).parent), str(path)],
+            env=env, pass_fds=(fd,), capture_output=True, text=True,
+        )
+    finally:
+        os.close(fd)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "s3cret"
@@ -0,0 +1,91 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from hot_folder import HotFolder
+
+
+def _pdf_bytes(pages: int) -> bytes:
+    import io
+
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def _wait_for(predicate, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize("poll", [None, 0.1], ids=["inotify", "polling"])
+def test_hot_folder_merges_settled_arrivals(tmp_path: Path, poll) -> None:
+    inbox, out, archive = tmp_path / "inbox", tmp_path / "out", tmp_path / "done"
+    (inbox / "sub").mkdir(parents=True)
+    (inbox / "old.pdf").write_bytes(_pdf_bytes(5))
+    messages: list = []
+    folder = HotFolder(
+        inbox, out, recursive=True, archive=archive, settle=0.3, batch_size=3, batch_window=30,
+        jobs=1, poll=poll, log=messages.append,
+    )
+    thread = threading.Thread(target=folder.run)
+    thread.start()
+    try:
+        _wait_for(lambda: any("Watching" in m for m in messages))
+        (inbox / "a.pdf").write_bytes(_pdf_bytes(1))
+        # a scan still being written: only the first half is there for a while
+        data = _pdf_bytes(2)
+        with open(inbox / "sub" / "b.pdf", "wb") as f:
+            f.write(data[: len(data) // 2])
+        time.sleep(0.8)
+        assert folder.batches == 0
+        with open(inbox / "sub" / "b.pdf", "ab") as f:
+            f.write(data[len(data) // 2:])
+        (inbox / "c.pdf").write_bytes(_pdf_bytes(3))
+
+        # three ready files fill a batch long before the window ends
+        _wait_for(lambda: folder.batches == 1)
+    finally:
+        folder.stop()
+        thread.join()
+
+    (merged,) = out.glob("batch-*.pdf")
+    assert len(PdfReader(str(merged)).pages) == 6
+    assert sorted(str(p.relative_to(archive)) for p in archive.rglob("*.pdf")) == ["a.pdf", "c.pdf", "sub/b.pdf"]
+    # files there before the watch started are left alone
+    assert sorted(p.name for p in inbox.rglob("*.pdf")) == ["old.pdf"]
+
+
+def test_hot_folder_flushes_by_window_and_skips_bad_inputs(tmp_path: Path) -> None:
+    inbox, out = tmp_path / "inbox", tmp_path / "out"
+    inbox.mkdir()
+    (inbox / "good.pdf").write_bytes(_pdf_bytes(2))
+    (inbox / "bad.pdf").write_bytes(b"%PDF-1.4\n" + b"x" * 100 + b"\nstartxref\n9\n%%EOF\n")
+    messages: list = []
+    folder = HotFolder(
+        inbox, out, existing=True, settle=0.1, batch_size=50, batch_window=0.5, jobs=1, log=messages.append,
+    )
+    thread = threading.Thread(target=folder.run)
+    thread.start()
+    try:
+        _wait_for(lambda: folder.batches == 1)
+    finally:
+        folder.stop()
+        thread.join()
+
+    (merged,) = out.glob("batch-*.pdf")
+    assert len(PdfReader(str(merged)).pages) == 2
+    assert any("bad.pdf" in m and m.startswith("Error:") for m in messages)
+
+
+def test_output_inside_watched_folder_is_refused(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="must not be inside"):
+        HotFolder(tmp_path, tmp_path / "out", recursive=True)
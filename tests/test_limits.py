@@ -0,0 +1,175 @@
+import base64
+import io
+import os
+import random
+import zlib
+from pathlib import Path
+
+import pikepdf
+import pytest
+from PyPDF2 import PdfWriter
+
+from pdf_limits import LimitExceeded, Limits, check_document, decoded_size, inflated_size
+from preflight import PreflightError, preflight
+
+
+def _pdf(pages: int = 1) -> bytes:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def _with_stream(data: bytes, **entries) -> bytes:
+    """A one-page PDF holding an extra stream with `data` stored as is."""
+    with pikepdf.Pdf.open(io.BytesIO(_pdf())) as pdf:
+        stream = pikepdf.Stream(pdf, b"")
+        stream.write(data, filter=entries.pop("Filter", None))
+        for key, value in entries.items():
+            stream[f"/{key}"] = value
+        pdf.Root.Bomb = pdf.make_indirect(stream)
+        out = io.BytesIO()
+        pdf.save(out)
+        return out.getvalue()
+
+
+def _lzw(data: bytes) -> bytes:
+    """LZW-encode `data` as PDF writers do (EarlyChange 1, clearing the table when full)."""
+    table = {bytes([i]): i for i in range(256)}
+    width, acc, bits, out = 9, 0, 0, bytearray()
+
+    def emit(code: int) -> None:
+        nonlocal acc, bits
+        acc, bits = (acc << width) | code, bits + width
+        while bits >= 8:
+            bits -= 8
+            out.append((acc >> bits) & 0xFF)
+        acc &= (1 << bits) - 1
+
+    emit(256)
+    word = b""
+    for byte in data:
+        if word + bytes([byte]) in table:
+            word += bytes([byte])
+            continue
+        emit(table[word])
+        table[word + bytes([byte])] = len(table) + 2
+        if len(table) + 3 > 1 << width:
+            if width == 12:
+                emit(256)
+                table = {bytes([i]): i for i in range(256)}
+                width = 9
+            else:
+                width += 1
+        word = bytes([byte])
+    emit(table[word])
+    emit(257)
+    if bits:
+        out.append((acc << (8 - bits)) & 0xFF)
+    return bytes(out)
+
+
+def _check(data: bytes, **limits) -> None:
+    with pikepdf.Pdf.open(io.BytesIO(data)) as pdf:
+        check_document(pdf, Limits(**limits))
+
+
+def test_flate_bomb_is_measured_without_being_kept() -> None:
+    bomb = zlib.compress(b"\0" * (64 * 1024 * 1024), 9)
+    assert len(bomb) < 100_000
+    # counting stops shortly after the cap
+    assert 10 * 1024 * 1024 <= inflated_size(bomb, 10 * 1024 * 1024) < 12 * 1024 * 1024
+
+    data = _with_stream(bomb, Filter=pikepdf.Name.FlateDecode)
+    _check(data, max_decoded_bytes=128 * 1024 * 1024)
+    with pytest.raises(LimitExceeded, match="decode to more than"):
+        _check(data, max_decoded_bytes=32 * 1024 * 1024)
+
+
+def test_image_dimensions_and_page_count() -> None:
+    image = _with_stream(
+        b"\xff\xd8tiny", Filter=pikepdf.Name.DCTDecode, Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image,
+        Width=100_000, Height=100_000, ColorSpace=pikepdf.Name.DeviceRGB, BitsPerComponent=8,
+    )
+    with pytest.raises(LimitExceeded, match="image too large"):
+        _check(image)
+    # 30 GB once decoded, even where the pixel count is allowed
+    with pytest.raises(LimitExceeded, match="decode to more than"):
+        _check(image, max_image_pixels=10 ** 12)
+
+    with pytest.raises(LimitExceeded, match="too many pages"):
+        _check(_pdf(5), max_pages=4)
+    _check(_pdf(5), max_pages=5)
+
+
+def test_preflight_and_routes_refuse_with_422(tmp_path: Path, client, monkeypatch) -> None:
+    monkeypatch.setenv("PDF_MAX_PAGES", "4")
+    big = tmp_path / "big.pdf"
+    big.write_bytes(_pdf(5))
+    with pytest.raises(PreflightError) as exc:
+        preflight([str(big)])
+    assert exc.value.failures[0].limit
+
+    resp = client.post(
+        "/merge", data={"files": [(io.BytesIO(_pdf(5)), "big.pdf"), (io.BytesIO(_pdf(1)), "a.pdf")]},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 422
+    assert b"big.pdf: too many pages" in resp.data
+
+    for algorithm in ("lossless", "optimize", "downscale"):
+        data = {"file": (io.BytesIO(_pdf(5)), "big.pdf"), "algorithm": algorithm}
+        resp = client.post("/compress", data=data, content_type="multipart/form-data")
+        assert resp.status_code == 422, algorithm
+        assert b"too many pages" in resp.data
+
+
+def test_decoded_size_is_checked_where_pages_are_rewritten(tmp_path: Path, client, monkeypatch) -> None:
+    from merge_pdfs import merge_pdfs_bytes
+
+    # a page whose content stream inflates to 4 MiB
+    with pikepdf.Pdf.open(io.BytesIO(_pdf())) as pdf:
+        pdf.pages[0].obj.Contents = pdf.make_indirect(pikepdf.Stream(pdf, b" " * (4 * 1024 * 1024)))
+        bomb = tmp_path / "bomb.pdf"
+        pdf.save(bomb, compress_streams=True)
+    assert bomb.stat().st_size < 50_000
+    monkeypatch.setenv("PDF_MAX_DECODED_BYTES", "1000000")
+
+    # kept as is, the page is copied without being decoded
+    assert merge_pdfs_bytes([str(bomb)])
+    for options in ({"global_size": "A4"}, {"per_file_sizes": ["letter"]}):
+        with pytest.raises(PreflightError) as exc:
+            merge_pdfs_bytes([str(bomb)], **options)
+        assert exc.value.failures[0].limit
+
+    data = {"file": (io.BytesIO(bomb.read_bytes()), "bomb.pdf"), "text": "hello"}
+    resp = client.post("/edit/add-text", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 422
+    assert b"decode to more than" in resp.data
+
+
+def test_filter_chains_are_decoded_not_estimated() -> None:
+    rng = random.Random(1)
+    words = [bytes(rng.choice(b"abcdefghij") for _ in range(rng.randint(2, 8))) for _ in range(3000)]
+    text = b" ".join(rng.choice(words) for _ in range(400_000))
+    lzw = _lzw(text)
+    assert len(lzw) > 1_000_000
+    # Flate after ASCII85: the stream is larger than what it decodes to
+    noise = os.urandom(2_600_000)
+    a85 = base64.a85encode(zlib.compress(noise), wrapcol=72) + b"~>"
+    chain = pikepdf.Array([pikepdf.Name.ASCII85Decode, pikepdf.Name.FlateDecode])
+
+    for raw, filters, size in ((lzw, pikepdf.Name.LZWDecode, len(text)), (a85, chain, len(noise))):
+        data = _with_stream(raw, Filter=filters)
+        _check(data)
+        with pikepdf.Pdf.open(io.BytesIO(data)) as pdf:
+            assert decoded_size(pdf.Root.Bomb, Limits().max_decoded_bytes) == size == len(pdf.Root.Bomb.read_bytes())
+        with pytest.raises(LimitExceeded, match="decode to more than"):
+            _check(data, max_decoded_bytes=size - 1)
+
+    # a bomb behind another filter is still stopped at the cap
+    bomb = base64.a85encode(zlib.compress(b"\0" * (64 * 1024 * 1024), 9)) + b"~>"
+    with pytest.raises(LimitExceeded, match="decode to more than"):
+        _check(_with_stream(bomb, Filter=chain), max_decoded_bytes=32 * 1024 * 1024)
@@ -0,0 +1,58 @@
+import json
+import logging
+
+from webapp import log
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_json_formatter_inlines_extra_fields():
+    record = logging.LogRecord("pdftools", logging.DEBUG, __file__, 1, "request finished", (), None)
+    record.duration_ms = 12.5
+    record.route = "/merge"
+    entry = json.loads(log.JsonFormatter().format(record))
+    assert entry["msg"] == "request finished"
+    assert entry["level"] == "DEBUG"
+    assert entry["duration_ms"] == 12.5
+    assert entry["route"] == "/merge"
+
+
+def test_request_debug_records_are_sampled(client, monkeypatch):
+    handler = _ListHandler()
+    log.logger.addHandler(handler)
+    level = log.logger.level
+    log.logger.setLevel(logging.DEBUG)
+    try:
+        monkeypatch.setattr(log, "_sample_rate", 0.0)
+        client.get("/").close()
+        assert handler.records == []
+
+        monkeypatch.setattr(log, "_sample_rate", 1.0)
+        client.get("/").close()
+        messages = [r.getMessage() for r in handler.records]
+        assert messages == ["request started", "request finished"]
+        assert handler.records[1].duration_ms >= 0
+        assert handler.records[1].route == "/"
+    finally:
+        log.logger.setLevel(level)
+        log.logger.removeHandler(handler)
+
+
+def test_no_debug_records_at_info_level(client):
+    handler = _ListHandler()
+    log.logger.addHandler(handler)
+    level = log.logger.level
+    log.logger.setLevel(logging.INFO)
+    try:
+        client.get("/").close()
+        assert handler.records == []
+    finally:
+        log.logger.setLevel(level)
+        log.logger.removeHandler(handler)
@@ -0,0 +1,150 @@
+from pathlib import Path
+
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+from merge_backends import get_backend
+from merge_pdfs import main, merge_pdfs, merge_pdfs_bytes
+import io
+
+
+BACKENDS = ("pypdf2", "pikepdf")
+
+
+def _create_pdf(path: Path, label: str, sizes: list[tuple[float, float]]) -> None:
+    # each page carries its label and number so the order can be checked
+    c = canvas.Canvas(str(path))
+    for i, size in enumerate(sizes):
+        c.setPageSize(size)
+        c.drawString(10, 10, f"{label}{i + 1}")
+        c.showPage()
+    c.save()
+
+
+def _describe(reader: PdfReader) -> list[tuple[str, int, int]]:
+    return [
+        (p.extract_text().strip(), round(float(p.mediabox.width)), round(float(p.mediabox.height)))
+        for p in reader.pages
+    ]
+
+
+@pytest.fixture()
+def inputs(tmp_path: Path) -> list[str]:
+    a = tmp_path / "a.pdf"
+    b = tmp_path / "b.pdf"
+    _create_pdf(a, "a", [(200, 300), (300, 200), (200, 300)])
+    _create_pdf(b, "b", [(400, 600), (612, 792)])
+    return [str(a), str(b)]
+
+
+def test_backends_agree_without_resizing(tmp_path: Path, inputs: list[str]) -> None:
+    results = []
+    for name in BACKENDS:
+        out = tmp_path / f"{name}.pdf"
+        merge_pdfs([f"{inputs[0]}[3,1-2]", inputs[1]], str(out), backend=name)
+        results.append(_describe(PdfReader(str(out))))
+    assert results[0] == results[1]
+    assert [label for label, _, _ in results[0]] == ["a3", "a1", "a2", "b1", "b2"]
+
+
+@pytest.mark.parametrize("size", ["largest", "smallest", "a4"])
+def test_backends_agree_when_resizing(inputs: list[str], size: str) -> None:
+    results = []
+    for name in BACKENDS:
+        if size == "a4":
+            data = merge_pdfs_bytes(inputs, per_file_sizes=["a4", "preserve"], backend=name)
+        else:
+            data = merge_pdfs_bytes(inputs, global_size=size, backend=name)
+        results.append(_describe(PdfReader(io.BytesIO(data))))
+    assert results[0] == results[1]
+    assert len(results[0]) == 5
+
+
+def test_cli_backend_flag(tmp_path: Path, inputs: list[str]) -> None:
+    out = tmp_path / "out.pdf"
+    assert main([*inputs, "-o", str(out), "--backend", "pikepdf"]) == 0
+    assert {(w, h) for _, w, h in _describe(PdfReader(str(out)))} == {(612, 792)}
+
+
+def test_backend_from_env(monkeypatch) -> None:
+    monkeypatch.setenv("MERGE_BACKEND", "pikepdf")
+    assert get_backend().name == "pikepdf"
+    monkeypatch.setenv("MERGE_BACKEND", "nope")
+    with pytest.raises(ValueError):
+        get_backend()
+
+
+def _create_letter(path: Path, n: int, logo: bytes) -> None:
+    import os
+
+    import reportlab
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    font_path = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+    pdfmetrics.registerFont(TTFont("TestVera", font_path))
+    c = canvas.Canvas(str(path))
+    c.drawImage(ImageReader(io.BytesIO(logo)), 10, 700, width=100, height=100)
+    c.setFont("TestVera", 12)
+    c.drawString(10, 10, f"letter{n}")
+    c.save()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dedup_shares_identical_resources(tmp_path: Path, backend: str) -> None:
+    from PIL import Image
+
+    logo = io.BytesIO()
+    Image.effect_noise((64, 64), 50).convert("RGB").save(logo, format="PNG")
+    files = []
+    for n in range(4):
+        path = tmp_path / f"l{n}.pdf"
+        _create_letter(path, n, logo.getvalue())
+        files.append(str(path))
+
+    plain = merge_pdfs_bytes(files, backend=backend, dedup=False)
+    stats: dict = {}
+    shared = merge_pdfs_bytes(files, backend=backend, stats=stats)
+
+    assert stats["dedup_objects"] > 0
+    assert stats["dedup_bytes_saved"] > 0
+    assert len(shared) < len(plain) - stats["dedup_bytes_saved"] // 2
+    assert _describe(PdfReader(io.BytesIO(shared))) == _describe(PdfReader(io.BytesIO(plain)))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_compact_output_uses_object_streams(inputs: list[str], backend: str) -> None:
+    standard = merge_pdfs_bytes(inputs, global_size="largest", backend=backend)
+    compact = merge_pdfs_bytes(inputs, global_size="largest", backend=backend, output_format="compact")
+
+    assert b"/ObjStm" in compact and b"/XRef" in compact
+    assert b"\nxref\n" not in compact
+    assert len(compact) < len(standard)
+    assert _describe(PdfReader(io.BytesIO(compact))) == _describe(PdfReader(io.BytesIO(standard)))
+
+
+def test_merge_route_output_format(client, inputs: list[str]) -> None:
+    def post(fmt: str):
+        files = [(io.BytesIO(Path(f).read_bytes()), Path(f).name) for f in inputs]
+        return client.post(
+            "/merge", data={"files": files, "output_format": fmt}, content_type="multipart/form-data"
+        )
+
+    resp = post("compact")
+    assert resp.status_code == 200
+    assert b"/ObjStm" in resp.data
+    assert post("tiny").status_code == 400
+
+
+def test_backend_missing_a_method_fails_when_created() -> None:
+    from merge_backends import MergeBackend, PyPDF2Backend
+
+    class Partial(MergeBackend):
+        def open(self, path: str):
+            return None
+
+    with pytest.raises(TypeError, match="abstract"):
+        Partial()
+    assert isinstance(PyPDF2Backend(), MergeBackend)
@@ -0,0 +1,58 @@
+import io
+
+from PyPDF2 import PdfWriter
+
+
+def _make_pdf_bytes(pages=1):
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=100, height=100)
+    buf = io.BytesIO()
+    w.write(buf)
+    buf.seek(0)
+    return buf
+
+
+def _metric_lines(client, prefix):
+    text = client.get("/metrics").get_data(as_text=True)
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_metrics_endpoint_is_prometheus_text(client):
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"].startswith("text/plain")
+    text = resp.get_data(as_text=True)
+    assert "# TYPE pdftools_request_duration_seconds histogram" in text
+    assert "# TYPE pdftools_request_phase_seconds histogram" in text
+
+
+def test_merge_records_phases_and_pages(client):
+    resp = client.post("/merge", data={"files": [(_make_pdf_bytes(2), "a.pdf"), (_make_pdf_bytes(3), "b.pdf")]},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 200
+    resp.close()
+
+    phases = _metric_lines(client, 'pdftools_request_phase_seconds_count{route="/merge"')
+    for name in ("receive", "parse", "transform", "serialize", "send"):
+        assert any(f'phase="{name}"' in line for line in phases), name
+    pages = _metric_lines(client, 'pdftools_request_pages_sum{route="/merge"')
+    assert pages and float(pages[0].rsplit(" ", 1)[1]) >= 5
+
+
+def test_compress_is_labelled_by_algorithm(client):
+    resp = client.post("/compress", data={"file": (_make_pdf_bytes(), "a.pdf"), "algorithm": "lossless"},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 200
+    resp.close()
+    lines = _metric_lines(client, "pdftools_request_duration_seconds_count")
+    assert any('route="/compress"' in line and 'algorithm="lossless"' in line for line in lines)
+
+
+def test_unknown_algorithm_is_refused_before_labelling(client):
+    resp = client.post("/compress", data={"file": (_make_pdf_bytes(), "a.pdf"), "algorithm": "x" * 40},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 400
+    assert b"choose from lossless, optimize, downscale" in resp.data
+    text = client.get("/metrics").get_data(as_text=True)
+    assert "x" * 40 not in text
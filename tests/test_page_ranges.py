@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from merge_pdfs import _parse_page_ranges, merge_pdfs, merge_pdfs_bytes
+import io
+
+
+def _create_pdf(path: Path, pages: int) -> None:
+    # page i is (100 + i) points wide so the order can be checked after merging
+    w = PdfWriter()
+    for i in range(pages):
+        w.add_blank_page(width=100 + i, height=100)
+    with open(path, "wb") as f:
+        w.write(f)
+
+
+def _widths(reader: PdfReader) -> list[int]:
+    return [int(float(p.mediabox.width)) for p in reader.pages]
+
+
+def test_parse_page_ranges() -> None:
+    assert _parse_page_ranges("1-3,10", 12) == [0, 1, 2, 9]
+    assert _parse_page_ranges("11-", 12) == [10, 11]
+    with pytest.raises(ValueError):
+        _parse_page_ranges("5-20", 12)
+
+
+def test_merge_with_inline_ranges(tmp_path: Path) -> None:
+    a = tmp_path / "a.pdf"
+    b = tmp_path / "b.pdf"
+    out = tmp_path / "out.pdf"
+    _create_pdf(a, pages=5)
+    _create_pdf(b, pages=3)
+    merge_pdfs([f"{a}[2-3,5]", str(b)], str(out))
+    assert _widths(PdfReader(str(out))) == [101, 102, 104, 100, 101, 102]
+
+
+def test_merge_bytes_with_ranges(tmp_path: Path) -> None:
+    a = tmp_path / "a.pdf"
+    _create_pdf(a, pages=4)
+    data = merge_pdfs_bytes([str(a), str(a)], page_ranges=["4", "1-2"])
+    assert _widths(PdfReader(io.BytesIO(data))) == [103, 100, 101]
+
+
+def test_selected_pages_resolve_each_kid_once(tmp_path: Path, monkeypatch) -> None:
+    from PyPDF2.generic import IndirectObject
+
+    from merge_backends import _iter_pages
+
+    path = tmp_path / "flat.pdf"
+    _create_pdf(path, pages=400)
+    reader = PdfReader(str(path))
+    calls = []
+    get_object = IndirectObject.get_object
+    monkeypatch.setattr(IndirectObject, "get_object", lambda self: (calls.append(1), get_object(self))[1])
+
+    pages = list(_iter_pages(reader, "2-400"))
+    assert [int(float(p.mediabox.width)) for p in pages] == list(range(101, 500))
+    # a flat tree: a few lookups per page (reading its MediaBox too), not one per page before it
+    assert len(calls) <= 3 * 400, len(calls)
@@ -0,0 +1,92 @@
+import io
+import time
+from pathlib import Path
+
+import pikepdf
+import pytest
+from PyPDF2 import PdfWriter
+
+from merge_pdfs import main, merge_pdfs_bytes
+from preflight import PreflightError, check_file, preflight
+
+
+def _create_pdf(path: Path, pages: int = 2) -> None:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    with open(path, "wb") as f:
+        w.write(f)
+
+
+@pytest.fixture()
+def batch(tmp_path: Path) -> dict:
+    good = tmp_path / "good.pdf"
+    _create_pdf(good, pages=3)
+
+    garbage = tmp_path / "garbage.pdf"
+    garbage.write_text("this is not a valid pdf file")
+
+    truncated = tmp_path / "truncated.pdf"
+    truncated.write_bytes(good.read_bytes()[:-60])
+
+    locked = tmp_path / "locked.pdf"
+    with pikepdf.Pdf.open(good) as pdf:
+        pdf.save(locked, encryption=pikepdf.Encryption(user="secret", owner="secret"))
+
+    return {"good": str(good), "garbage": str(garbage), "truncated": str(truncated), "locked": str(locked)}
+
+
+def test_check_file_reads_page_count(batch: dict) -> None:
+    info = check_file(batch["good"])
+    assert info.pages == 3
+    assert not info.encrypted
+
+
+def test_preflight_reports_every_failure(batch: dict) -> None:
+    paths = [batch["good"], batch["garbage"], batch["truncated"], batch["locked"], batch["good"]]
+    with pytest.raises(PreflightError) as excinfo:
+        preflight(paths, page_ranges=["", "", "", "", "2-9"])
+
+    reasons = {(f.path, f.page_selection): f.reason for f in excinfo.value.failures}
+    assert len(reasons) == 4
+    assert "no %PDF- header" in reasons[(batch["garbage"], False)]
+    assert "%%EOF" in reasons[(batch["truncated"], False)]
+    assert "password" in reasons[(batch["locked"], False)]
+    assert "outside 1-3" in reasons[(batch["good"], True)]
+
+
+def test_bad_input_fails_before_merging(batch: dict, tmp_path: Path, capsys) -> None:
+    many = [batch["good"]] * 200 + [batch["garbage"]]
+    t0 = time.perf_counter()
+    with pytest.raises(PreflightError):
+        merge_pdfs_bytes(many)
+    assert time.perf_counter() - t0 < 5
+
+    out = tmp_path / "out.pdf"
+    assert main([batch["garbage"], batch["locked"], batch["good"], "-o", str(out)]) == 1
+    err = capsys.readouterr().err
+    assert err.count("There was a problem reading the document") == 2
+    assert not out.exists()
+
+
+def test_merge_route_lists_bad_uploads(client, batch: dict) -> None:
+    files = [(io.BytesIO(Path(batch[k]).read_bytes()), f"{k}.pdf") for k in ("good", "garbage", "locked")]
+    resp = client.post("/merge", data={"files": files}, content_type="multipart/form-data")
+    assert resp.status_code == 400
+    body = resp.get_data(as_text=True)
+    assert "garbage.pdf: not a PDF" in body and "locked.pdf: encrypted" in body
+
+
+def test_padding_after_eof_is_accepted(batch: dict, tmp_path: Path) -> None:
+    good = Path(batch["good"]).read_bytes()
+    padded = tmp_path / "padded.pdf"
+    # scanners and SMB copies append NULs or junk after %%EOF
+    padded.write_bytes(good + b"\0" * 5000 + b"\r\n" * 2000)
+    assert check_file(str(padded)).pages == 3
+    assert len(pikepdf.Pdf.open(io.BytesIO(merge_pdfs_bytes([str(padded), batch["good"]]))).pages) == 6
+
+    # an incremental update cut off after the last %%EOF is still truncated
+    cut = tmp_path / "cut.pdf"
+    cut.write_bytes(good + b"\n4 0 obj\n<< /Type /Page " + b"x" * 3000)
+    with pytest.raises(ValueError, match="incomplete update"):
+        check_file(str(cut))
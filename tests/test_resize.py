@@ -1,3 +1,4 @@
+import io
 from pathlib import Path
 
 from PyPDF2 import PdfReader, PdfWriter
@@ -39,3 +40,60 @@ def test_resize_to_largest(tmp_path: Path) -> None:
     assert abs(w0 - w1) < 1e-6
     assert abs(h0 - h1) < 1e-6
     assert int(w0) == 400 and int(h0) == 600
+
+
+def test_plan_matches_merge_without_merging(tmp_path: Path) -> None:
+    import io
+
+    a = tmp_path / "a.pdf"
+    b = tmp_path / "b.pdf"
+    _create_pdf(a, width=200, height=300)
+    w = PdfWriter()
+    for _ in range(3):
+        w.add_blank_page(width=400, height=600)
+    with open(b, "wb") as f:
+        w.write(f)
+
+    options = dict(per_file_sizes=["global", "A4"], global_size="largest", page_ranges=[None, "2-3"])
+    plan = merge_pdfs.plan_merge([str(a), str(b)], **options)
+    merged = PdfReader(io.BytesIO(merge_pdfs.merge_pdfs_bytes([str(a), str(b)], **options)))
+
+    assert plan["pages"] == len(merged.pages) == 3
+    targets = [p["target"] for f in plan["files"] for p in f["page_plan"]]
+    actual = [[round(float(p.mediabox.width), 2), round(float(p.mediabox.height), 2)] for p in merged.pages]
+    assert targets == actual
+    assert [p["page"] for p in plan["files"][1]["page_plan"]] == [2, 3]
+    # largest of the selected pages; A4 fit by the height of 600 x 400
+    assert plan["files"][0]["page_plan"][0]["scale"] == 2.0
+    assert plan["files"][1]["page_plan"][0]["scale"] == 1.4031
+    assert plan["estimated_bytes"] > 0
+
+
+def test_dry_run_and_plan_route(tmp_path: Path, client, capsys) -> None:
+    a = tmp_path / "a.pdf"
+    b = tmp_path / "b.pdf"
+    out = tmp_path / "out.pdf"
+    _create_pdf(a, width=200, height=300)
+    _create_pdf(b, width=400, height=600)
+
+    assert _main([str(a), str(b), "-o", str(out), "--page-size", "A4", "--dry-run"]) == 0
+    assert not out.exists()
+    text = capsys.readouterr().out
+    assert "page 1: 200x300 pt -> 595.28x841.89 pt (scale 2.8063)" in text
+    assert "Total: 2 page(s)" in text
+
+    data = {
+        "files": [(io.BytesIO(a.read_bytes()), "first.pdf"), (io.BytesIO(b.read_bytes()), "first.pdf")],
+        "file_resize": ["preserve", "letter"],
+        "file_pages": ["", "1"],
+    }
+    resp = client.post("/merge/plan", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    plan = resp.get_json()
+    assert [f["file"] for f in plan["files"]] == ["first.pdf", "first.pdf"]
+    assert [f["target"] for f in plan["files"]] == [None, [612.0, 792.0]]
+
+    data = {"files": [(io.BytesIO(a.read_bytes()), "a.pdf")], "file_pages": ["2"]}
+    resp = client.post("/merge/plan", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 400
+    assert "a.pdf" in resp.get_json()["error"]
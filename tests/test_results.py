@@ -0,0 +1,118 @@
+import io
+
+import pikepdf
+from PyPDF2 import PdfWriter
+
+
+def _pdf_bytes(pages: int = 3) -> bytes:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def _merge(client):
+    return client.post(
+        "/merge",
+        data={"files": [(io.BytesIO(_pdf_bytes()), "a.pdf"), (io.BytesIO(_pdf_bytes()), "b.pdf")]},
+        content_type="multipart/form-data",
+    )
+
+
+def test_merge_result_is_stored_and_linearized(client) -> None:
+    resp = _merge(client)
+    assert resp.status_code == 200
+    result_id = resp.headers["X-Result-Id"]
+    with pikepdf.Pdf.open(io.BytesIO(resp.data)) as pdf:
+        assert pdf.is_linearized
+        assert len(pdf.pages) == 6
+
+    stored = client.get(f"/results/{result_id}")
+    assert stored.status_code == 200
+    assert stored.data == resp.data
+    assert stored.headers["Accept-Ranges"] == "bytes"
+    assert "inline" in stored.headers["Content-Disposition"]
+    assert "attachment" in client.get(f"/results/{result_id}?download=1").headers["Content-Disposition"]
+
+
+def test_result_range_and_conditional_requests(client) -> None:
+    result_id = _merge(client).headers["X-Result-Id"]
+
+    part = client.get(f"/results/{result_id}", headers={"Range": "bytes=0-99"})
+    assert part.status_code == 206
+    assert len(part.data) == 100
+    assert part.headers["Content-Range"].startswith("bytes 0-99/")
+
+    etag = part.headers["ETag"]
+    assert client.get(f"/results/{result_id}", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_unknown_result(client) -> None:
+    assert client.get("/results/" + "0" * 32).status_code == 404
+    assert client.get("/results/..%2Fetc").status_code == 404
+
+
+def test_json_response_returns_result_id(client) -> None:
+    resp = client.post(
+        "/edit/add-text",
+        data={"file": (io.BytesIO(_pdf_bytes(1)), "a.pdf"), "text": "hello"},
+        content_type="multipart/form-data",
+        headers={"Accept": "application/json"},
+    )
+    assert resp.status_code == 200
+    result = resp.get_json()
+    assert result["filename"] == "annotated.pdf"
+    assert result["url"] == f"/results/{result['result_id']}"
+    stored = client.get(result["download_url"])
+    assert stored.status_code == 200
+    assert len(stored.data) == result["size"]
+
+
+def test_result_removed_before_it_is_described(client, monkeypatch) -> None:
+    from webapp import app, results
+
+    # cleanup for another request's result can remove this one first
+    monkeypatch.setattr(results, "get", lambda result_id: None)
+    assert results.describe("0" * 32) is None
+    with app.test_request_context(headers={"Accept": "application/json"}):
+        resp = results.respond("0" * 32)
+    assert resp.status_code == 404
+    assert resp.get_json()["error"] == "Result not found or expired"
+
+
+def test_cleanup_expires_and_caps_results(monkeypatch) -> None:
+    import time
+
+    from webapp import results
+
+    first = results.store_pdf(_pdf_bytes(), "a.pdf", linearize=False)
+    second = results.store_pdf(_pdf_bytes(), "b.pdf", linearize=False)
+    size = results.get(second)[1]["size"]
+
+    # over the cap: the oldest result makes room for the new one
+    monkeypatch.setenv("RESULTS_MAX_BYTES", str(size * 2))
+    third = results.store_pdf(_pdf_bytes(), "c.pdf", linearize=False)
+    assert results.get(first) is None
+    assert results.get(second) is not None and results.get(third) is not None
+
+    assert results.cleanup(now=time.time() + 2 * results.ttl_seconds()) == 2
+    assert list(results.results_dir().iterdir()) == []
+
+
+def test_stored_result_keeps_server_file_wrapper(client) -> None:
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wsgi import FileWrapper
+
+    from webapp import app, metrics
+
+    result_id = _merge(client).headers["X-Result-Id"]
+    environ = EnvironBuilder(path=f"/results/{result_id}").get_environ()
+    environ["wsgi.file_wrapper"] = FileWrapper
+    body = app(environ, lambda status, headers: None)
+    # the server gets its own wrapper back, so it can still use sendfile()
+    assert isinstance(body, FileWrapper)
+    in_flight = metrics.IN_FLIGHT._values[()]
+    body.close()
+    assert metrics.IN_FLIGHT._values[()] == in_flight - 1
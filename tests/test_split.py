@@ -0,0 +1,122 @@
+import io
+import zipfile
+from pathlib import Path
+
+import pikepdf
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+from split_pdfs import main, parse_size, plan_split, split_pdf
+from webapp import admission
+
+
+def _pdf_with_images(path: Path, pages: int = 6) -> None:
+    """Each page shows its own noise image (~30 KB), and links to the last page."""
+    import os
+
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+
+    c = canvas.Canvas(str(path), pagesize=(300, 300))
+    for i in range(pages):
+        img = Image.frombytes("L", (100, 100), os.urandom(10_000)).convert("RGB")
+        c.bookmarkPage(f"p{i}")
+        c.drawImage(ImageReader(img), 10, 10, 200, 200)
+        c.drawString(20, 250, f"page {i + 1}")
+        c.linkAbsolute("last", f"p{pages - 1}", (10, 10, 50, 50))
+        c.showPage()
+    c.save()
+
+
+def _images(pdf: pikepdf.Pdf) -> int:
+    return sum(1 for obj in pdf.objects if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image")
+
+
+def test_parts_carry_only_their_own_resources(tmp_path: Path) -> None:
+    src = tmp_path / "scan.pdf"
+    _pdf_with_images(src)
+
+    parts = split_pdf(src, tmp_path / "every", every=4, jobs=2)
+    assert [Path(c.path).name for c in parts] == ["scan_p1-4.pdf", "scan_p5-6.pdf"]
+    assert [c.pages for c in parts] == [[0, 1, 2, 3], [4, 5]]
+    with pikepdf.Pdf.open(parts[1].path) as pdf:
+        assert len(pdf.pages) == 2
+        # neither the other pages nor their images came along with the links
+        assert _images(pdf) == 2
+
+    parts = split_pdf(src, tmp_path / "ranges", ranges=["1-2", "6", "1-2"])
+    assert [Path(c.path).name for c in parts] == ["scan_p1-2.pdf", "scan_p6.pdf", "scan_p1-2_2.pdf"]
+    with pytest.raises(ValueError, match="outside 1-6"):
+        plan_split(src, ranges=["5-9"])
+
+
+def test_max_size_parts_stay_under_the_limit(tmp_path: Path) -> None:
+    src = tmp_path / "scan.pdf"
+    _pdf_with_images(src, pages=10)
+    limit = src.stat().st_size // 3
+
+    parts = split_pdf(src, tmp_path / "out", max_bytes=limit)
+    assert 3 <= len(parts) <= 5
+    assert all(c.size <= limit for c in parts)
+    assert [i for c in parts for i in c.pages] == list(range(10))
+    assert all(Path(c.path).stat().st_size == c.size for c in parts)
+
+    # a page larger than the limit still becomes a part of its own
+    parts = split_pdf(src, tmp_path / "tiny", max_bytes=1000)
+    assert [c.pages for c in parts] == [[i] for i in range(10)]
+
+    assert parse_size("25M") == 25 * 1024 * 1024
+    assert parse_size("1.5 KiB") == 1536
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_cli(tmp_path: Path, capsys) -> None:
+    src = tmp_path / "scan.pdf"
+    _pdf_with_images(src, pages=3)
+    assert main([str(src), "-o", str(tmp_path / "out"), "--every", "2", "--prefix", "part"]) == 0
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["part_p1-2.pdf", "part_p3.pdf"]
+    assert main([str(src), "-o", str(tmp_path / "out"), "--ranges", "4"]) == 1
+    assert "outside 1-3" in capsys.readouterr().err
+
+
+def test_split_route_streams_a_zip(client, tmp_path: Path) -> None:
+    src = tmp_path / "scan.pdf"
+    _pdf_with_images(src, pages=5)
+
+    data = {"file": (io.BytesIO(src.read_bytes()), "scan.pdf"), "mode": "every", "every": "2"}
+    resp = client.post("/split", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.mimetype == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(resp.get_data()))
+    assert archive.namelist() == ["scan_p1-2.pdf", "scan_p3-4.pdf", "scan_p5.pdf"]
+    assert [len(PdfReader(archive.open(n)).pages) for n in archive.namelist()] == [2, 2, 1]
+    resp.close()
+    # held while the parts were being written, given back when the stream closed
+    assert admission.budget.usage()["slots"] == 0
+
+    data = {"file": (io.BytesIO(src.read_bytes()), "scan.pdf"), "mode": "ranges", "ranges": "1-2\n7"}
+    resp = client.post("/split", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 400
+    assert b"outside 1-5" in resp.data
+
+    assert b"Split PDF" in client.get("/split").data
+
+
+def test_split_route_charges_the_workers_it_uses(client, tmp_path: Path, monkeypatch) -> None:
+    src = tmp_path / "scan.pdf"
+    _pdf_with_images(src, pages=4)
+    monkeypatch.setenv("SPLIT_JOBS", "2")
+    monkeypatch.setattr(admission, "budget", admission.Budget(memory=10 ** 10, slots=4, max_wait=1))
+
+    data = {"file": (io.BytesIO(src.read_bytes()), "scan.pdf"), "mode": "every", "every": "1"}
+    resp = client.post("/split", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    # one slot per worker process, held while the parts are written
+    assert admission.budget.usage()["slots"] == 2
+    archive = zipfile.ZipFile(io.BytesIO(resp.get_data()))
+    assert len(archive.namelist()) == 4
+    resp.close()
+    assert admission.budget.usage()["slots"] == 0
@@ -0,0 +1,89 @@
+import hashlib
+import io
+import time
+
+import pikepdf
+import pytest
+from PyPDF2 import PdfWriter
+
+from webapp import staging
+
+
+def _pdf_bytes(pages: int = 1, width: float = 200) -> bytes:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=width, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def _stage(client, data: bytes, name: str) -> dict:
+    resp = client.post("/staging", data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_stage_once_and_ask_by_hash(client) -> None:
+    data = _pdf_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    assert client.head(f"/staging/{digest}").status_code == 404
+
+    info = _stage(client, data, "a.pdf")
+    assert info["id"] == digest
+    assert info["size"] == len(data)
+    assert client.head(f"/staging/{digest}").status_code == 200
+    assert client.get(f"/staging/{digest}").get_json()["filename"] == "a.pdf"
+
+    # the same content again is the same staged file
+    assert _stage(client, data, "copy.pdf")["id"] == digest
+    assert len(list(staging.staging_dir().glob("*.pdf"))) == 1
+    assert client.get("/staging/..%2Fetc").status_code == 404
+
+
+def test_merge_and_plan_by_staged_ids(client) -> None:
+    a = _stage(client, _pdf_bytes(1, width=200), "a.pdf")["id"]
+    b = _stage(client, _pdf_bytes(2, width=400), "b.pdf")["id"]
+
+    # reordered and with other options, without sending the files again
+    data = {"staged": [b, a], "file_pages": ["2", ""], "file_resize": ["preserve", "preserve"]}
+    resp = client.post("/merge", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    with pikepdf.Pdf.open(io.BytesIO(resp.data)) as pdf:
+        assert [float(p.mediabox[2]) for p in pdf.pages] == [400, 200]
+
+    plan = client.post("/merge/plan", data={"staged": [a, b]}, content_type="multipart/form-data").get_json()
+    assert plan["pages"] == 3
+    assert [f["file"] for f in plan["files"]] == ["a.pdf", "b.pdf"]
+
+    # staged files come first, uploads after them
+    data = {"staged": [a], "files": [(io.BytesIO(_pdf_bytes(1, width=300)), "c.pdf")]}
+    with pikepdf.Pdf.open(io.BytesIO(client.post("/merge", data=data).data)) as pdf:
+        assert [float(p.mediabox[2]) for p in pdf.pages] == [200, 300]
+
+    missing = "0" * 64
+    resp = client.post("/merge", data={"staged": [a, missing]}, content_type="multipart/form-data")
+    assert resp.status_code == 404
+    resp = client.post("/merge/plan", data={"staged": [missing]}, content_type="multipart/form-data")
+    assert resp.status_code == 404
+    assert resp.get_json()["unknown"] == [missing]
+
+
+def test_expiry_and_quota(monkeypatch) -> None:
+    first = staging.stage(io.BytesIO(_pdf_bytes(1)), "a.pdf")
+    second = staging.stage(io.BytesIO(_pdf_bytes(2)), "b.pdf")
+
+    # over the quota: the least recently used file makes room
+    staging.touch(first)
+    total = len(_pdf_bytes(1)) + len(_pdf_bytes(2)) + len(_pdf_bytes(3))
+    monkeypatch.setenv("STAGING_MAX_BYTES", str(total - 1))
+    third = staging.stage(io.BytesIO(_pdf_bytes(3)), "c.pdf")
+    assert staging.get(second) is None
+    assert staging.get(first) is not None and staging.get(third) is not None
+
+    monkeypatch.setenv("STAGING_MAX_BYTES", "10")
+    with pytest.raises(staging.QuotaExceeded):
+        staging.stage(io.BytesIO(_pdf_bytes()), "big.pdf")
+
+    assert staging.cleanup(now=time.time() + 2 * staging.ttl_seconds()) == 2
+    assert list(staging.staging_dir().iterdir()) == []
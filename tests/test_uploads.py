@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pikepdf
+from PyPDF2 import PdfWriter
+
+
+def _pdf_bytes(pages: int = 20) -> bytes:
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=200, height=300)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+def _digest(data: bytes) -> str:
+    return "sha-256=:" + base64.b64encode(hashlib.sha256(data).digest()).decode() + ":"
+
+
+def _put(client, upload_id: str, data: bytes, offset: int, chunk: int, digest: bool = True):
+    body = data[offset:offset + chunk]
+    headers = {"Content-Digest": _digest(body)} if digest else {}
+    return client.put(f"/uploads/{upload_id}?offset={offset}", data=body, headers=headers)
+
+
+def test_chunks_in_any_order_past_the_request_limit(client) -> None:
+    from webapp import app as flask_app
+
+    data = _pdf_bytes()
+    chunk = 700
+    # each request stays under the limit, the file does not
+    flask_app.config["MAX_CONTENT_LENGTH"] = 1024
+    try:
+        resp = client.post("/uploads", json={"filename": "scan.pdf", "size": len(data)})
+        assert resp.status_code == 201
+        upload_id = resp.get_json()["id"]
+        assert resp.headers["Location"].endswith(f"/uploads/{upload_id}")
+
+        offsets = list(range(0, len(data), chunk))
+        last = offsets.pop()
+        # in parallel and out of order
+        with ThreadPoolExecutor(4) as pool:
+            sent = pool.map(lambda o: _put(flask_app.test_client(), upload_id, data, o, chunk), reversed(offsets))
+            codes = [resp.status_code for resp in sent]
+        assert set(codes) == {200}
+
+        status = client.get(f"/uploads/{upload_id}").get_json()
+        assert status["received"] == [[0, last]]
+        assert status["offset"] == last and not status["complete"]
+        resp = client.post(f"/uploads/{upload_id}/finalize")
+        assert resp.status_code == 409
+
+        # a damaged chunk is refused and not recorded; sent again, it completes the file
+        headers = {"Content-Digest": _digest(b"something else")}
+        resp = client.put(f"/uploads/{upload_id}?offset={last}", data=data[last:], headers=headers)
+        assert resp.status_code == 422
+        assert not client.get(f"/uploads/{upload_id}").get_json()["complete"]
+        assert _put(client, upload_id, data, last, chunk).get_json()["complete"]
+
+        resp = client.post(f"/uploads/{upload_id}/finalize", json={"sha256": hashlib.sha256(data).hexdigest()})
+        assert resp.status_code == 200
+        staged = resp.get_json()
+        assert staged["id"] == hashlib.sha256(data).hexdigest()
+        assert staged["size"] == len(data)
+        assert client.get(f"/uploads/{upload_id}").status_code == 404
+    finally:
+        flask_app.config["MAX_CONTENT_LENGTH"] = 500 * 1024 * 1024
+
+    resp = client.post("/compress", data={"staged": staged["id"], "algorithm": "lossless"})
+    assert resp.status_code == 200
+    resp = client.post("/merge", data={"staged": [staged["id"], staged["id"]]})
+    with pikepdf.Pdf.open(io.BytesIO(resp.data)) as pdf:
+        assert len(pdf.pages) == 40
+
+
+def test_bad_chunks_and_whole_file_digest(client) -> None:
+    data = _pdf_bytes(2)
+    wrong = hashlib.sha256(b"other").hexdigest()
+    upload_id = client.post("/uploads", json={"filename": "a.pdf", "size": len(data), "sha256": wrong}).get_json()["id"]
+
+    assert client.put(f"/uploads/{upload_id}?offset=x", data=b"1").status_code == 400
+    assert client.put(f"/uploads/{upload_id}?offset={len(data)}", data=b"1").status_code == 400
+    assert client.put(f"/uploads/{'0' * 32}?offset=0", data=b"1").status_code == 404
+    resp = client.put(f"/uploads/{upload_id}?offset=0", data=b"1", headers={"Content-Digest": "sha-256=:abc:"})
+    assert resp.status_code == 400
+
+    # without a digest per chunk, the whole-file digest still catches a mix-up
+    assert _put(client, upload_id, data, 0, len(data), digest=False).get_json()["complete"]
+    resp = client.post(f"/uploads/{upload_id}/finalize")
+    assert resp.status_code == 422
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+    assert client.post("/uploads", json={"filename": "a.pdf", "size": 0}).status_code == 400
+    upload_id = client.post("/uploads", data={"filename": "a.pdf", "size": "10"}).get_json()["id"]
+    assert client.delete(f"/uploads/{upload_id}").status_code == 204
+    assert client.head(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_received_bytes_cannot_be_overwritten(client) -> None:
+    from webapp import uploads
+
+    data = _pdf_bytes(4)
+    upload_id = client.post("/uploads", json={"filename": "a.pdf", "size": len(data)}).get_json()["id"]
+    # without a declared sha256 for the file, every chunk needs its own digest
+    assert client.put(f"/uploads/{upload_id}?offset=0", data=data[:100]).status_code == 400
+
+    assert _put(client, upload_id, data, 0, 100).status_code == 200
+    # sent again unchanged (a lost response): fine; overlapping with other bytes: refused
+    assert _put(client, upload_id, data, 0, 100).status_code == 200
+    evil = b"x" * 50
+    resp = client.put(f"/uploads/{upload_id}?offset=50", data=evil, headers={"Content-Digest": _digest(evil)})
+    assert resp.status_code == 409
+    assert _put(client, upload_id, data, 100, len(data)).get_json()["complete"]
+
+    # damaged on disk after it was received: finalize drops it to be sent again
+    chunk = next((uploads.uploads_dir() / upload_id / "chunks").glob("0-100.*"))
+    chunk.write_bytes(b"y" * 100)
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 422
+    assert client.get(f"/uploads/{upload_id}").get_json()["received"] == [[100, len(data)]]
+    assert _put(client, upload_id, data, 0, 100).status_code == 200
+
+    resp = client.post(f"/uploads/{upload_id}/finalize")
+    assert resp.status_code == 200
+    assert resp.get_json()["id"] == hashlib.sha256(data).hexdigest()
+
+
+def test_uploads_in_progress_count_against_the_quota(client, monkeypatch) -> None:
+    from webapp import staging
+
+    monkeypatch.setenv("STAGING_MAX_BYTES", "1000")
+    monkeypatch.setenv("UPLOAD_MAX_ACTIVE", "2")
+    assert client.post("/uploads", json={"filename": "a.pdf", "size": 600}).status_code == 201
+    assert staging.reserved_bytes() == 600
+    resp = client.post("/uploads", json={"filename": "b.pdf", "size": 600})
+    assert resp.status_code == 413
+    assert client.post("/uploads", json={"filename": "b.pdf", "size": 300}).status_code == 201
+    resp = client.post("/uploads", json={"filename": "c.pdf", "size": 10})
+    assert resp.status_code == 413
+    assert "Too many uploads" in resp.get_json()["error"]
@@ -0,0 +1,7 @@
+def test_warm_loads_modules_and_templates(client):
+    from webapp import warmup
+
+    timings = warmup.warm(client.application)
+    for name in ("PyPDF2", "pikepdf", "PIL.Image", "reportlab.pdfgen.canvas", "exercise", "templates"):
+        assert name in timings
+    assert client.application.jinja_env.cache
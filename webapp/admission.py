@@ -0,0 +1,355 @@
+"""Cost-based admission control for the PDF-processing routes.
+
+Before a heavy POST (/merge, /compress, /split, /edit/add-text, /edit/add-signature)
+runs, its memory and CPU cost are estimated in two steps. First from
+Content-Length and the kind of work (for /compress, an ``algorithm`` in the
+query string, else lossless), before the upload is read: a request turned
+away is never received. Then, with the body in, from the form's algorithm,
+the staged inputs and the page count (read from each input's xref); a rise
+waits or is rejected the same way. A global budget of memory and CPU slots
+is shared by every worker process (it lives in shared memory created before
+gunicorn or the ASGI pool fork):
+
+* a request that fits runs at once;
+* one that does not is queued if the work ahead of it should finish within
+  ADMISSION_MAX_WAIT seconds;
+* otherwise it is rejected with 503 and a Retry-After estimate.
+
+A request larger than the whole memory budget is not refused outright; it
+waits until it can run alone. Budget use is exported as metrics.
+
+Environment:
+  ADMISSION_MEMORY_BYTES  estimated memory for concurrent requests (default: half of RAM)
+  ADMISSION_CPU_SLOTS     requests processed at once (default: CPU count)
+  ADMISSION_MAX_WAIT      longest expected queueing before rejecting, seconds (default 15)
+  SPLIT_JOBS              worker processes per /split request, each charged a slot (default 1)
+"""
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Flask, Response, g, request
+
+from webapp import metrics, staging
+
+MIB = 1024 * 1024
+
+# per kind of work: (memory per input byte, memory per page, CPU seconds per MiB, CPU seconds per page),
+# fitted to the benchmark corpus; downscale holds decoded images in memory
+COST_MODEL: Dict[str, Tuple[float, float, float, float]] = {
+    "merge": (3.0, 40 * 1024, 0.02, 0.0015),
+    "lossless": (4.0, 4 * 1024, 0.7, 0.0005),
+    "optimize": (3.0, 4 * 1024, 1.0, 0.0003),
+    "downscale": (100.0, 8 * 1024, 1.3, 0.0005),
+    "edit": (4.0, 16 * 1024, 0.2, 0.002),
+    "split": (2.0, 8 * 1024, 0.05, 0.001),
+}
+
+# routes under admission control -> kind of work (None: the 'algorithm' form field)
+ROUTES: Dict[str, Optional[str]] = {
+    "/merge": "merge",
+    "/compress": None,
+    "/split": "split",
+    "/edit/add-text": "edit",
+    "/edit/add-signature": "edit",
+}
+
+MEMORY_GAUGE = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftools_admission_memory_bytes", "Estimated memory of admitted requests ('in_use') and the budget.", ("kind",),
+))
+SLOTS_GAUGE = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftools_admission_cpu_slots", "CPU slots held by admitted requests ('in_use') and the budget.", ("kind",),
+))
+QUEUED_GAUGE = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftools_admission_queued_requests", "Requests waiting for budget.",
+))
+REJECTED = metrics.REGISTRY.register(metrics.Counter(
+    "pdftools_admission_rejected_total", "Requests rejected with 503 because the budget would not free up in time.",
+    ("route",),
+))
+
+
+@dataclass
+class Cost:
+    memory: float
+    seconds: float
+    slots: int = 1
+
+
+def split_jobs() -> int:
+    """Worker processes one /split request writes its parts with (SPLIT_JOBS, default 1)."""
+    return max(1, int(os.environ.get("SPLIT_JOBS", "1")))
+
+
+def estimate(kind: str, size: int, pages: int) -> Cost:
+    """Estimated peak memory (bytes) and CPU time of `kind` work on `size` bytes with `pages` pages."""
+    per_byte, per_page, per_mib, per_page_s = COST_MODEL.get(kind, COST_MODEL["lossless"])
+    memory = size * per_byte + pages * per_page
+    seconds = size / MIB * per_mib + pages * per_page_s
+    if kind == "split":
+        # every worker opens the whole input; the CPU time is spread over them
+        jobs = split_jobs()
+        return Cost(memory=memory * jobs, seconds=seconds, slots=jobs)
+    return Cost(memory=memory, seconds=seconds)
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"over budget, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+# indexes into the shared state: totals, then one row per process holding budget
+_MEMORY, _SLOTS, _RUNNING_S, _QUEUED_S, _QUEUED = range(5)
+_PID = 5
+_ROW = 6  # pid, then the same five fields as the totals
+_MAX_HOLDERS = 256
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Budget:
+    """Memory and CPU-slot budget shared by all processes forked after it was created.
+
+    What each process holds is also recorded under its PID, so the share of
+    a worker killed mid-request (timeout, OOM kill) is given back: by
+    gunicorn's ``child_exit`` hook via `reclaim`, and by a sweep for dead
+    PIDs whenever a request has to wait.
+    """
+
+    def __init__(self, memory: float, slots: int, max_wait: float) -> None:
+        self.memory = memory
+        self.slots = slots
+        self.max_wait = max_wait
+        self._cond = multiprocessing.Condition()
+        self._state = multiprocessing.RawArray("d", 5 + _ROW * _MAX_HOLDERS)
+
+    @classmethod
+    def from_env(cls) -> "Budget":
+        memory = float(os.environ.get("ADMISSION_MEMORY_BYTES", 0)) or _half_of_ram()
+        slots = int(os.environ.get("ADMISSION_CPU_SLOTS", 0)) or os.cpu_count() or 1
+        return cls(memory, slots, float(os.environ.get("ADMISSION_MAX_WAIT", 15)))
+
+    def usage(self) -> Dict[str, float]:
+        with self._cond:
+            s = self._state
+            return {"memory": s[_MEMORY], "slots": s[_SLOTS], "queued": s[_QUEUED]}
+
+    def _row(self, pid: int) -> Optional[int]:
+        """Offset of `pid`'s row, taking a free one if it has none; None when all are taken."""
+        s = self._state
+        free = None
+        for base in range(5, len(s), _ROW):
+            if s[base] == pid:
+                return base
+            if free is None and s[base] == 0:
+                free = base
+        if free is not None:
+            s[free] = pid
+        return free
+
+    def _book(self, delta: Tuple[float, float, float, float, float], pid: Optional[int] = None) -> None:
+        """Add (memory, slots, running s, queued s, queued) to the totals and to `pid`'s row."""
+        s = self._state
+        for field, value in zip((_MEMORY, _SLOTS, _RUNNING_S, _QUEUED_S, _QUEUED), delta):
+            s[field] += value
+        base = self._row(os.getpid() if pid is None else pid)
+        if base is None:
+            return
+        for field, value in enumerate(delta, start=1):
+            s[base + field] += value
+        if all(abs(value) < 1e-6 for value in s[base + 1:base + _ROW]):
+            s[base] = 0
+
+    def _reclaim(self, pid: int) -> bool:
+        s = self._state
+        for base in range(5, len(s), _ROW):
+            if s[base] == pid:
+                self._book(tuple(-s[base + field] for field in range(1, _ROW)), pid)
+                s[base] = 0
+                self._cond.notify_all()
+                return True
+        return False
+
+    def reclaim(self, pid: int) -> bool:
+        """Give back everything the (dead) process `pid` held; False if it held nothing."""
+        # bounded: the gunicorn master must not hang on a lock a killed worker held
+        if not self._cond.acquire(timeout=5):
+            return False
+        try:
+            return self._reclaim(pid)
+        finally:
+            self._cond.release()
+
+    def _sweep(self) -> None:
+        s = self._state
+        for base in range(5, len(s), _ROW):
+            pid = int(s[base])
+            if pid and pid != os.getpid() and not _alive(pid):
+                self._reclaim(pid)
+
+    def _fits(self, cost: Cost) -> bool:
+        s = self._state
+        # a request wanting more slots than there are runs alone
+        if s[_SLOTS] + min(cost.slots, self.slots) > self.slots:
+            return False
+        # a request bigger than the whole budget runs alone
+        return s[_MEMORY] + min(cost.memory, self.memory) <= self.memory
+
+    def _expected_wait(self) -> float:
+        s = self._state
+        return (s[_RUNNING_S] + s[_QUEUED_S]) / self.slots
+
+    def acquire(self, cost: Cost) -> None:
+        """Take `cost` out of the budget, waiting if it should free up in time; raises Rejected."""
+        with self._cond:
+            if not self._fits(cost):
+                self._sweep()
+            if not self._fits(cost):
+                wait = self._expected_wait()
+                if wait > self.max_wait:
+                    raise Rejected(max(1, math.ceil(wait)))
+                self._book((0, 0, 0, cost.seconds, 1))
+                try:
+                    deadline = time.monotonic() + self.max_wait
+                    while not self._fits(cost):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Rejected(max(1, math.ceil(self._expected_wait())))
+                        self._cond.wait(remaining)
+                finally:
+                    self._book((0, 0, 0, -cost.seconds, -1))
+            self._book((min(cost.memory, self.memory), min(cost.slots, self.slots), cost.seconds, 0, 0))
+
+    def adjust(self, held: Cost, cost: Cost) -> None:
+        """Replace the admitted `held` by `cost`, waiting or raising Rejected like `acquire`.
+
+        `held` is given back first, so a request waiting for more holds
+        nothing meanwhile; once Rejected, it holds nothing at all.
+        """
+        with self._cond:  # reentrant: nobody gets between the two
+            self.release(held)
+            self.acquire(cost)
+
+    def release(self, cost: Cost) -> None:
+        with self._cond:
+            self._book((-min(cost.memory, self.memory), -min(cost.slots, self.slots), -cost.seconds, 0, 0))
+            self._cond.notify_all()
+
+
+def _half_of_ram() -> float:
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2
+    except (AttributeError, OSError, ValueError):
+        return 2 * 1024 * MIB
+
+
+budget = Budget.from_env()
+
+
+def _staged_files() -> List[Tuple[str, int]]:
+    """(path, size) of the staged files named by the request (form field 'staged')."""
+    found = (staging.get(staged_id) for staged_id in request.form.getlist("staged"))
+    return [(str(path), meta["size"]) for path, meta in filter(None, found)]
+
+
+def _count_pages(staged: List[Tuple[str, int]]) -> int:
+    """Pages in all uploaded and staged PDFs; unreadable ones count as none (the route reports them)."""
+    import pikepdf
+
+    total = 0
+    for storage in request.files.values():
+        stream = storage.stream
+        try:
+            with pikepdf.Pdf.open(stream) as pdf:
+                total += len(pdf.pages)
+        except Exception:
+            pass
+        finally:
+            stream.seek(0)
+    for path, _ in staged:
+        try:
+            with pikepdf.Pdf.open(path) as pdf:
+                total += len(pdf.pages)
+        except Exception:
+            pass
+    return total
+
+
+def _collect() -> None:
+    usage = budget.usage()
+    MEMORY_GAUGE.set(usage["memory"], kind="in_use")
+    MEMORY_GAUGE.set(budget.memory, kind="budget")
+    SLOTS_GAUGE.set(usage["slots"], kind="in_use")
+    SLOTS_GAUGE.set(budget.slots, kind="budget")
+    QUEUED_GAUGE.set(usage["queued"])
+
+
+def detach() -> Callable[[], None]:
+    """Keep the current request's share of the budget past its teardown.
+
+    For streamed responses, whose work happens after the view returned:
+    call the returned function once the stream is done.
+    """
+    cost = g.pop("_admission_cost", None)
+    if cost is None:
+        return lambda: None
+    return lambda: budget.release(cost)
+
+
+def _busy(rule: str, exc: Rejected) -> Response:
+    REJECTED.inc(route=rule)
+    return Response("Server is busy, please retry later\n", status=503, headers={"Retry-After": str(exc.retry_after)})
+
+
+def init_app(app: Flask) -> None:
+    """Admit heavy requests against the shared budget (register after metrics.init_app)."""
+    metrics.REGISTRY.add_collector(_collect)
+    # the body is read here, once the request is admitted on its declared size
+    metrics.LAZY_BODY_ROUTES.update(ROUTES)
+
+    @app.before_request
+    def _admit() -> Optional[Response]:
+        rule = request.url_rule.rule if request.url_rule else None
+        if request.method != "POST" or rule not in ROUTES:
+            return None
+        size = request.content_length or 0
+        cost = estimate(ROUTES[rule] or request.args.get("algorithm", "lossless"), size, 0)
+        try:
+            with metrics.phase("admission"):
+                budget.acquire(cost)
+        except Rejected as exc:
+            return _busy(rule, exc)
+        g._admission_cost = cost  # released on teardown whatever happens next
+
+        metrics.receive()
+        staged = _staged_files()
+        kind = ROUTES[rule] or request.form.get("algorithm", "lossless")
+        full = estimate(kind, size + sum(size for _, size in staged), _count_pages(staged))
+        del g._admission_cost
+        try:
+            with metrics.phase("admission"):
+                budget.adjust(cost, full)
+        except Rejected as exc:
+            return _busy(rule, exc)
+        g._admission_cost = full
+        return None
+
+    @app.teardown_request
+    def _release(exc: Optional[BaseException]) -> None:
+        cost = g.pop("_admission_cost", None)
+        if cost is not None:
+            budget.release(cost)
@@ -3,33 +3,51 @@ from __future__ import annotations
 import os
 import sys
 import tempfile
+import threading
 import uuid
 from pathlib import Path
 from typing import List
+from urllib.parse import quote
 
 # CRITICAL: Set Werkzeug limits BEFORE importing anything else
 # For Werkzeug 3.x, we need to set limits through flask.Config
 os.environ['WERKZEUG_MAX_CONTENT_LENGTH'] = str(500 * 1024 * 1024)
 
-# Load environment variables from .env file
-from dotenv import load_dotenv
 project_root = Path(__file__).resolve().parent.parent
+# Add parent directory to path so we can import merge_pdfs
+sys.path.insert(0, str(project_root))
+
+# Load environment variables: .env.encrypted is decrypted in memory (never
+# written out) when a password or a key handed over by the parent process
+# is available, then the plain .env fills in anything not set yet
+from dotenv import load_dotenv
+_encrypted_env = Path(os.environ.get("ENV_ENCRYPTED_FILE") or project_root / ".env.encrypted")
+if _encrypted_env.is_file() and any(
+    os.environ.get(name) for name in ("ENV_PASSWORD", "ENV_PASSWORD_FILE", "ENV_KEY_FD")
+):
+    from encrypt_env import load_encrypted_env
+    load_encrypted_env(_encrypted_env)
 load_dotenv(project_root / ".env")
 
 # Allow HTTP for localhost development (required for OAuth2 on http://localhost)
 if os.environ.get("OAUTHLIB_INSECURE_TRANSPORT") == "1":
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
-# Add parent directory to path so we can import merge_pdfs
-sys.path.insert(0, str(project_root))
-
-from flask import Flask, Response, flash, redirect, render_template, request, send_file, url_for, session, jsonify
+from flask import Flask, Response, flash, redirect, render_template, request, send_file, stream_with_context, url_for, session, jsonify
 from werkzeug.exceptions import RequestEntityTooLarge
 
 import importlib
 import merge_pdfs
-# ensure latest edits are available in long-running test environment
-merge_pdfs = importlib.reload(merge_pdfs)
+from pdf_limits import LimitExceeded, check_bytes
+from preflight import PreflightError
+from webapp import admission, log, metrics, results, staging, uploads
+from webapp.log import logger
+
+# PDFTOOLS_PRODUCTION=1 skips development conveniences that slow down startup
+PRODUCTION = os.environ.get("PDFTOOLS_PRODUCTION") == "1"
+if not PRODUCTION:
+    # ensure latest edits are available in long-running test environment
+    merge_pdfs = importlib.reload(merge_pdfs)
 merge_pdfs_bytes = getattr(merge_pdfs, "merge_pdfs_bytes", None)
 merge_pdfs_fn = getattr(merge_pdfs, "merge_pdfs")
 
@@ -46,6 +64,17 @@ app = Flask(__name__, template_folder=str(TEMPLATES_DIR))
 app.secret_key = os.environ.get("FLASK_SECRET", "change-me")
 # Set Flask's MAX_CONTENT_LENGTH to 500MB
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
+# behind Apache/lighttpd, let the front end send stored results itself
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE") == "1"
+metrics.init_app(app)
+log.init_app(app)
+admission.init_app(app)
+
+# PDFTOOLS_WARMUP=1 imports and exercises the heavy libraries now instead of
+# on the first request of each kind (see gunicorn.conf.py / webapp/warmup.py)
+if os.environ.get("PDFTOOLS_WARMUP") == "1":
+    from webapp import warmup
+    warmup.warm(app)
 
 
 @app.route("/", methods=["GET"])
@@ -58,24 +87,72 @@ def index():
 
 @app.before_request
 def log_request_info():
-    """Log request info for debugging"""
-    print(f"[DEBUG] {request.method} {request.path}")
-    print(f"[DEBUG] Content-Length header: {request.content_length}")
-    print(f"[DEBUG] MAX_CONTENT_LENGTH config: {app.config.get('MAX_CONTENT_LENGTH')}")
-    
+    """Log request info for debugging (sampled, see webapp/log.py)"""
+    if log.request_debug_enabled():
+        logger.debug(
+            "request started",
+            extra={
+                "method": request.method,
+                "path": request.path,
+                "content_length": request.content_length,
+                "max_content_length": app.config.get("MAX_CONTENT_LENGTH"),
+            },
+        )
+
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
     """Handle 413 Request Entity Too Large errors"""
     max_size_mb = app.config.get('MAX_CONTENT_LENGTH', 0) / (1024 * 1024)
-    print(f"[ERROR] 413 - Content-Length: {request.content_length}, Max: {app.config.get('MAX_CONTENT_LENGTH')}")
+    logger.warning(
+        "request entity too large",
+        extra={"content_length": request.content_length, "max_content_length": app.config.get("MAX_CONTENT_LENGTH")},
+    )
     return Response(f"413 - Request entity too large (max {max_size_mb:.1f}MB). Content-Length: {request.content_length} bytes.\n", status=413)
 
 
+def _merge_inputs(tmpdir: str) -> tuple[List[str], List[str], List[str]]:
+    """(paths, names, unknown staged ids) of the inputs of /merge and /merge/plan.
+
+    Staged files (ids in the form field 'staged', in order) are read where
+    they are; uploaded 'files' follow them and are saved to `tmpdir`.
+    """
+    paths: List[str] = []
+    names: List[str] = []
+    unknown: List[str] = []
+    for staged_id in request.form.getlist("staged"):
+        found = staging.get(staged_id)
+        if found is None:
+            unknown.append(staged_id)
+            continue
+        path, meta = found
+        paths.append(str(path))
+        names.append(meta["filename"])
+    with metrics.phase("receive"):
+        for idx, f in enumerate(request.files.getlist("files")):
+            names.append(f.filename or "upload.pdf")
+            # numbered: two uploads may share a name
+            target = Path(tmpdir) / f"{idx}.pdf"
+            f.save(str(target))
+            paths.append(str(target))
+    return paths, names, unknown
+
+
+def _merge_error(exc: Exception, paths: List[str], names: List[str]) -> tuple[str, int]:
+    """Message naming inputs by their own names, not their paths here, and its status."""
+    message = str(exc)
+    for path, name in zip(paths, names):
+        message = message.replace(path, name)
+    # inputs beyond the resource limits are well-formed but refused
+    too_large = isinstance(exc, LimitExceeded) or (
+        isinstance(exc, PreflightError) and any(f.limit for f in exc.failures)
+    )
+    return message, 422 if too_large else 400
+
+
 @app.route("/merge", methods=["POST"])
 def merge():
-    files = request.files.getlist("files")
-    if not files:
+    if not request.files.getlist("files") and not request.form.getlist("staged"):
         flash("No files uploaded", "error")
         return redirect(url_for("index"))
 
@@ -83,6 +160,12 @@ def merge():
     # per-file resize instructions (one per uploaded file). Values:
     # 'preserve' | 'global' | WIDTHxHEIGHT
     per_file_sizes = request.form.getlist("file_resize") or None
+    # per-file page selection (one per uploaded file), e.g. '1-3,10'; empty = all pages
+    page_ranges = request.form.getlist("file_pages") or None
+    # 'standard' or 'compact' (object streams + xref stream)
+    output_format = request.form.get("output_format") or "standard"
+    if output_format not in ("standard", "compact"):
+        return Response(f"Unknown output format: {output_format}\n", status=400)
     
     # Get custom output filename
     output_filename = request.form.get("output_filename", "").strip()
@@ -92,16 +175,18 @@ def merge():
         output_filename += ".pdf"
 
     with tempfile.TemporaryDirectory() as tmpdir:
-        paths: List[str] = []
-        for f in files:
-            filename = f.filename or "upload.pdf"
-            target = Path(tmpdir) / filename
-            f.save(str(target))
-            paths.append(str(target))
+        paths, names, unknown = _merge_inputs(tmpdir)
+        if unknown:
+            return Response(f"Staged file not found or expired: {', '.join(unknown)}\n", status=404)
 
         try:
             if merge_pdfs_bytes:
-                data = merge_pdfs_bytes(paths, per_file_sizes=per_file_sizes, global_size=page_size)
+                merge_stats: dict = {}
+                data = merge_pdfs_bytes(
+                    paths, per_file_sizes=per_file_sizes, global_size=page_size, page_ranges=page_ranges,
+                    phase=metrics.phase, stats=merge_stats, output_format=output_format,
+                )
+                metrics.record_pages(merge_stats.get("pages", 0))
             else:
                 # fallback to file-based merge
                 out_path = Path(tmpdir) / "merged.pdf"
@@ -109,13 +194,144 @@ def merge():
                 with open(out_path, "rb") as f:
                     data = f.read()
         except Exception as exc:
-            return Response(f"Error merging files: {exc}\n", status=400)
+            message, status = _merge_error(exc, paths, names)
+            return Response(f"Error merging files: {message}\n", status=status)
+
+        with metrics.phase("store"):
+            result_id = results.store_pdf(data, output_filename)
+        resp = results.respond(result_id)
+        if merge_pdfs_bytes:
+            resp.headers["X-Dedup-Bytes-Saved"] = str(merge_stats.get("dedup_bytes_saved", 0))
+        return resp
+
+
+@app.route("/merge/plan", methods=["POST"])
+def merge_plan():
+    """Page count, page sizes and estimated size of a /merge with the same fields, without merging."""
+    if not request.files.getlist("files") and not request.form.getlist("staged"):
+        return jsonify({"error": "No files uploaded"}), 400
+    page_size = request.form.get("page_size") or None
+    per_file_sizes = request.form.getlist("file_resize") or None
+    page_ranges = request.form.getlist("file_pages") or None
 
-        import io
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths, names, unknown = _merge_inputs(tmpdir)
+        if unknown:
+            return jsonify({"error": "Staged file not found or expired", "unknown": unknown}), 404
+        try:
+            with metrics.phase("preflight"):
+                plan = merge_pdfs.plan_merge(
+                    paths, per_file_sizes=per_file_sizes, global_size=page_size, page_ranges=page_ranges,
+                )
+        except Exception as exc:
+            message, status = _merge_error(exc, paths, names)
+            return jsonify({"error": message}), status
+    for entry, name in zip(plan["files"], names):
+        entry["file"] = name
+    metrics.record_pages(plan["pages"])
+    return jsonify(plan)
 
-        bio = io.BytesIO(data)
-        bio.seek(0)
-        return send_file(bio, as_attachment=True, download_name=output_filename, mimetype="application/pdf")
+
+@app.route("/staging", methods=["POST"])
+def stage_file():
+    """Stage an uploaded file for /merge; answers its content-hash id."""
+    f = request.files.get("file")
+    if not f:
+        return jsonify({"error": "No file uploaded"}), 400
+    try:
+        with metrics.phase("store"):
+            staged_id = staging.stage(f.stream, f.filename or "upload.pdf")
+    except staging.QuotaExceeded as exc:
+        return jsonify({"error": str(exc)}), 413
+    return jsonify(staging.describe(staged_id))
+
+
+@app.route("/staging/<staged_id>", methods=["GET"])
+def get_staged(staged_id: str):
+    """Whether a file is staged (HEAD to ask without a body); refreshes its expiry."""
+    info = staging.describe(staged_id)
+    if info is None:
+        return jsonify({"error": "Staged file not found or expired"}), 404
+    return jsonify(info)
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """Start a resumable upload (JSON or form: filename, size, optional sha256)."""
+    params = request.get_json(silent=True) or request.form
+    try:
+        info = uploads.create(
+            params.get("filename") or "upload.pdf", int(params.get("size") or 0), params.get("sha256") or None,
+        )
+    except staging.QuotaExceeded as exc:
+        return jsonify({"error": str(exc)}), 413
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    resp = jsonify(info)
+    resp.status_code = 201
+    resp.headers["Location"] = url_for("upload_status", upload_id=info["id"])
+    return resp
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id: str):
+    """Which byte ranges of an upload arrived (HEAD to ask without a body)."""
+    try:
+        return jsonify(uploads.status(upload_id))
+    except uploads.UnknownUpload:
+        return jsonify({"error": "Upload not found or expired"}), 404
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id: str):
+    """Receive the request body as the bytes at `offset` of the upload; chunks may arrive in any order."""
+    offset = request.args.get("offset", "")
+    if not offset.isdigit():
+        return jsonify({"error": "offset must be a byte offset"}), 400
+    try:
+        digest = uploads.parse_digest(request.headers.get("Content-Digest"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if (request.content_length or 0) > uploads.max_chunk_bytes():
+        return jsonify({"error": f"Chunk is larger than {uploads.max_chunk_bytes()} bytes"}), 413
+    try:
+        with metrics.phase("receive"):
+            # read in blocks straight from the connection, never buffered whole
+            info = uploads.write_chunk(upload_id, int(offset), request.stream, request.content_length, digest)
+    except uploads.UnknownUpload:
+        return jsonify({"error": "Upload not found or expired"}), 404
+    except uploads.ChecksumMismatch as exc:
+        return jsonify({"error": str(exc)}), 422
+    except uploads.Conflict as exc:
+        return jsonify({"error": str(exc)}), 409
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return jsonify(info)
+
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id: str):
+    """Turn a complete upload into a staged file; answers like POST /staging."""
+    params = request.get_json(silent=True) or request.form
+    try:
+        with metrics.phase("store"):
+            staged_id = uploads.finalize(upload_id, params.get("sha256") or None)
+    except uploads.UnknownUpload:
+        return jsonify({"error": "Upload not found or expired"}), 404
+    except uploads.Incomplete as exc:
+        return jsonify({"error": str(exc)}), 409
+    except uploads.ChecksumMismatch as exc:
+        return jsonify({"error": str(exc)}), 422
+    return jsonify(staging.describe(staged_id))
+
+
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def abort_upload(upload_id: str):
+    try:
+        uploads.abort(upload_id)
+    except uploads.UnknownUpload:
+        return jsonify({"error": "Upload not found or expired"}), 404
+    return Response(status=204)
 
 
 @app.route("/compress", methods=["GET"])
@@ -126,6 +342,14 @@ def compress_page():
         return Response(f"Template error: {exc}\n", status=500)
 
 
+@app.route("/split", methods=["GET"])
+def split_page():
+    try:
+        return render_template("split.html")
+    except Exception as exc:
+        return Response(f"Template error: {exc}\n", status=500)
+
+
 @app.route("/edit", methods=["GET"])
 def edit_page():
     try:
@@ -231,7 +455,12 @@ def add_signature():
         sig_image = Image.open(io.BytesIO(sig_image_data))
         
         # Read the PDF
-        reader = PdfReader(io.BytesIO(pdf_data))
+        with metrics.phase("preflight"):
+            # merge_page decodes and rewrites the page's content streams
+            check_bytes(pdf_data)
+        with metrics.phase("parse"):
+            reader = PdfReader(io.BytesIO(pdf_data))
+            metrics.record_pages(len(reader.pages))
         writer = PdfWriter()
         
         # Get page dimensions
@@ -279,20 +508,24 @@ def add_signature():
             temp_overlay.seek(0)
             
             # Read the overlay and merge with original page
-            overlay_reader = PdfReader(temp_overlay)
-            overlay_page = overlay_reader.pages[0]
+            with metrics.phase("transform"):
+                overlay_reader = PdfReader(temp_overlay)
+                overlay_page = overlay_reader.pages[0]
+
+                # Add all pages from original PDF, overlaying signature on specified page
+                for i, orig_page in enumerate(reader.pages):
+                    if i == page_num:
+                        orig_page.merge_page(overlay_page)
+                    writer.add_page(orig_page)
             
-            # Add all pages from original PDF, overlaying signature on specified page
-            for i, orig_page in enumerate(reader.pages):
-                if i == page_num:
-                    orig_page.merge_page(overlay_page)
-                writer.add_page(orig_page)
+            with metrics.phase("serialize"):
+                out = io.BytesIO()
+                writer.write(out)
+                out.seek(0)
             
-            out = io.BytesIO()
-            writer.write(out)
-            out.seek(0)
-            
-            return send_file(out, as_attachment=True, download_name="signed.pdf", mimetype="application/pdf")
+            with metrics.phase("store"):
+                result_id = results.store_pdf(out.getvalue(), "signed.pdf")
+            return results.respond(result_id)
         finally:
             # Clean up temporary file
             import os
@@ -300,9 +533,10 @@ def add_signature():
                 os.unlink(sig_path)
             except:
                 pass
+    except LimitExceeded as exc:
+        return Response(f"Document exceeds processing limits: {exc}\n", status=422)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("add-signature failed")
         return Response(f"Error adding signature: {str(e)}\n", status=400)
 
 
@@ -329,7 +563,12 @@ def add_text():
         
         # Read the PDF
         pdf_data = f.read()
-        reader = PdfReader(io.BytesIO(pdf_data))
+        with metrics.phase("preflight"):
+            # merge_page decodes and rewrites the page's content streams
+            check_bytes(pdf_data)
+        with metrics.phase("parse"):
+            reader = PdfReader(io.BytesIO(pdf_data))
+            metrics.record_pages(len(reader.pages))
         writer = PdfWriter()
         
         if page_num < 0 or page_num >= len(reader.pages):
@@ -347,30 +586,75 @@ def add_text():
         c.save()
         
         temp_overlay.seek(0)
-        overlay_reader = PdfReader(temp_overlay)
-        overlay_page = overlay_reader.pages[0]
-        
-        # Add all pages, overlaying text on specified page
-        for i, orig_page in enumerate(reader.pages):
-            if i == page_num:
-                orig_page.merge_page(overlay_page)
-            writer.add_page(orig_page)
+        with metrics.phase("transform"):
+            overlay_reader = PdfReader(temp_overlay)
+            overlay_page = overlay_reader.pages[0]
+
+            # Add all pages, overlaying text on specified page
+            for i, orig_page in enumerate(reader.pages):
+                if i == page_num:
+                    orig_page.merge_page(overlay_page)
+                writer.add_page(orig_page)
         
-        out = io.BytesIO()
-        writer.write(out)
-        out.seek(0)
+        with metrics.phase("serialize"):
+            out = io.BytesIO()
+            writer.write(out)
+            out.seek(0)
         
-        return send_file(out, as_attachment=True, download_name="annotated.pdf", mimetype="application/pdf")
+        with metrics.phase("store"):
+            result_id = results.store_pdf(out.getvalue(), "annotated.pdf")
+        return results.respond(result_id)
+    except LimitExceeded as exc:
+        return Response(f"Document exceeds processing limits: {exc}\n", status=422)
     except Exception as e:
         return Response(f"Error adding text: {str(e)}\n", status=400)
 
+# compress_lossless steps reported under the shared metric phase names
+_COMPRESS_METRIC_PHASES = {"fonts": "dedup", "collapse": "dedup", "prune": "dedup", "recompress": "transform"}
+
+
+def _add_compress_headers(resp: Response, stats: dict) -> None:
+    """Per-step timing (Server-Timing) and size reduction of a compress_pdfs run."""
+    phases = stats["phases"]
+    resp.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={p['seconds'] * 1000:.1f}" for name, p in phases.items()
+    )
+    resp.headers["X-Compress-Bytes-Saved"] = ", ".join(
+        f"{name}={p['bytes_saved']}" for name, p in phases.items() if name != "parse"
+    )
+    resp.headers["X-Compress-Objects"] = ", ".join(
+        f"{name}={p['objects']}" for name, p in phases.items() if name not in ("parse", "serialize")
+    )
+    resp.headers["X-Compress-Sizes"] = f"input={stats['input_size']}, output={stats['output_size']}"
+    if stats.get("images"):
+        # downscale: images re-encoded per detected kind and what that saved
+        resp.headers["X-Compress-Images"] = ", ".join(
+            f"{kind}={n['count']};saved={n['bytes_before'] - n['bytes_after']}" for kind, n in stats["images"].items()
+        )
+    if stats.get("fonts"):
+        # lossless: bytes saved per font by deduplication and subsetting
+        resp.headers["X-Compress-Fonts"] = ", ".join(
+            f"{quote(name)}={n['bytes_saved']}" for name, n in stats["fonts"].items()
+        )
+
+
 @app.route("/compress", methods=["POST"])
 def compress():
     f = request.files.get("file")
-    if not f:
+    staged_id = request.form.get("staged")
+    if not f and not staged_id:
         return Response("No file uploaded\n", status=400)
+    staged = staging.get(staged_id) if not f else None
+    if not f and staged is None:
+        return Response(f"Staged file not found or expired: {staged_id}\n", status=404)
+
+    from compress_pdfs import ALGORITHMS
 
     algo = request.form.get("algorithm", "lossless")
+    # checked first: the value becomes a metrics label
+    if algo not in ALGORITHMS:
+        return Response(f"Unknown compression algorithm: choose from {', '.join(ALGORITHMS)}\n", status=400)
+    metrics.set_algorithm(algo)
     remove_meta = request.form.get("remove_metadata") == "on"
     linearize = request.form.get("linearize") == "on"
     
@@ -381,88 +665,36 @@ def compress():
     elif not output_filename.lower().endswith(".pdf"):
         output_filename += ".pdf"
 
-    import io
-    from PyPDF2 import PdfReader, PdfWriter
-
     try:
-        data = f.read()
-        # If using optimize, try pikepdf path first
+        with metrics.phase("receive"):
+            data = f.read() if f else staged[0].read_bytes()
         if algo == "optimize":
             try:
-                import pikepdf  # type: ignore
+                import pikepdf  # type: ignore  # noqa: F401
             except Exception:
                 return Response(
                     "Optimize requires 'pikepdf' to be installed. Try: pip install pikepdf\n",
                     status=400,
                 )
 
-            src_io = io.BytesIO(data)
-            pdf = pikepdf.Pdf.open(src_io)
-
-            # optionally remove metadata (DocInfo and XMP)
-            if remove_meta:
-                try:
-                    pdf.docinfo.clear()
-                except Exception:
-                    pass
-                try:
-                    if hasattr(pdf, "Root") and "Metadata" in pdf.Root:
-                        del pdf.Root["Metadata"]
-                except Exception:
-                    pass
-
-            input_size = len(data)
-
-            # First attempt: conservative optimization
-            out1 = io.BytesIO()
-            kwargs1: dict = {"compress_streams": True, "object_streams": True}
-            try:
-                if hasattr(pikepdf, "StreamDecodeLevel"):
-                    kwargs1["stream_decode_level"] = pikepdf.StreamDecodeLevel.special  # type: ignore[attr-defined]
-            except Exception:
-                pass
-            try:
-                kwargs1["recompress_flate"] = True
-            except Exception:
-                pass
-            if linearize:
-                kwargs1["linearize"] = True
+            from compress_pdfs import compress_optimize
 
+            compress_stats: dict = {}
             try:
-                pdf.save(out1, **kwargs1)
-            except TypeError:
-                # fallback: minimal safe options
-                pdf.save(out1, compress_streams=True, object_streams=True)
-
-            size1 = out1.getbuffer().nbytes
-
-            # Second attempt: aggressive optimization if not improved
-            use_second = size1 >= input_size
-            out_final = out1
-
-            if use_second and hasattr(pikepdf, "StreamDecodeLevel"):
-                out2 = io.BytesIO()
-                kwargs2: dict = {"compress_streams": True, "object_streams": True}
-                try:
-                    kwargs2["stream_decode_level"] = pikepdf.StreamDecodeLevel.all  # type: ignore[attr-defined]
-                except Exception:
-                    pass
-                try:
-                    kwargs2["recompress_flate"] = True
-                except Exception:
-                    pass
-                if linearize:
-                    kwargs2["linearize"] = True
-                try:
-                    pdf.save(out2, **kwargs2)
-                    if out2.getbuffer().nbytes < size1:
-                        out_final = out2
-                except Exception:
-                    # keep first attempt if second fails
-                    pass
-
-            out_final.seek(0)
-            return send_file(out_final, as_attachment=True, download_name=output_filename, mimetype="application/pdf")
+                out_data = compress_optimize(
+                    data, linearize=linearize, remove_metadata=remove_meta, stats=compress_stats, phase=metrics.phase,
+                )
+            except LimitExceeded as exc:
+                return Response(f"Document exceeds processing limits: {exc}\n", status=422)
+            except ValueError as exc:
+                return Response(f"{exc}\n", status=400)
+            metrics.record_pages(compress_stats["pages"])
+            with metrics.phase("store"):
+                # already linearized by the save above when requested
+                result_id = results.store_pdf(out_data, output_filename, linearize=not linearize)
+            resp = results.respond(result_id)
+            _add_compress_headers(resp, compress_stats)
+            return resp
 
         # Handle image downscale algorithm
         if algo == "downscale":
@@ -481,102 +713,143 @@ def compress():
                     status=400,
                 )
 
-            max_px = int(request.form.get("max_px", 2000))
+            # resample to target_dpi where drawn sharper; max_px optionally caps the pixel size
+            target_dpi = float(request.form.get("target_dpi") or 150)
+            max_px = int(request.form.get("max_px") or 0) or None
             jpeg_quality = int(request.form.get("jpeg_quality", 75))
 
-            pdf = pikepdf.Pdf.open(io.BytesIO(data))
-            changed = False
-            for page in pdf.pages:
-                try:
-                    resources = page.get("/Resources", pikepdf.Dictionary())
-                    xobj = resources.get("/XObject", pikepdf.Dictionary())
-                except Exception:
-                    continue
-                for name, obj in list(xobj.items()):
-                    try:
-                        if not isinstance(obj, pikepdf.Object):
-                            continue
-                        obj_dict = obj.get_object()
-                        if obj_dict.get("/Subtype") != pikepdf.Name("/Image"):
-                            continue
-                        # Extract image via PdfImage helper
-                        try:
-                            img = pikepdf.PdfImage(obj_dict)
-                            pil = img.as_pil_image()
-                        except Exception:
-                            continue
-                        # Only downscale if larger than threshold
-                        if pil.width <= max_px and pil.height <= max_px:
-                            continue
-                        # Resize in place with aspect ratio
-                        from PIL import Image as PILImage
-                        pil.thumbnail((max_px, max_px), PILImage.LANCZOS)
-                        # Ensure RGB for JPEG
-                        if pil.mode not in ("RGB",):
-                            pil = pil.convert("RGB")
-                        buf = io.BytesIO()
-                        pil.save(buf, format="JPEG", quality=jpeg_quality, optimize=True)
-                        buf.seek(0)
-                        # Replace stream and key metadata
-                        try:
-                            obj_dict["/Filter"] = pikepdf.Name("/DCTDecode")
-                            obj_dict["/ColorSpace"] = pikepdf.Name("/DeviceRGB")
-                            obj_dict["/BitsPerComponent"] = 8
-                            obj_dict["/Width"] = pil.width
-                            obj_dict["/Height"] = pil.height
-                            # remove potential incompatible keys
-                            for k in ("/SMask", "/Mask", "/DecodeParms", "/Decode"):
-                                if k in obj_dict:
-                                    del obj_dict[k]
-                            obj_dict.stream = buf.getvalue()
-                            changed = True
-                        except Exception:
-                            continue
-                    except Exception:
-                        continue
-            out = io.BytesIO()
+            from compress_pdfs import compress_downscale
+
+            compress_stats: dict = {}
             try:
-                pdf.save(out, compress_streams=True, object_streams=True)
-            except Exception:
-                pdf.save(out)
-            out.seek(0)
-            return send_file(out, as_attachment=True, download_name=output_filename, mimetype="application/pdf")
+                out_data = compress_downscale(
+                    data, target_dpi=target_dpi, max_px=max_px, jpeg_quality=jpeg_quality, remove_metadata=remove_meta,
+                    stats=compress_stats, phase=metrics.phase,
+                )
+            except LimitExceeded as exc:
+                return Response(f"Document exceeds processing limits: {exc}\n", status=422)
+            except ValueError as exc:
+                return Response(f"{exc}\n", status=400)
+            metrics.record_pages(compress_stats["pages"])
+            with metrics.phase("store"):
+                result_id = results.store_pdf(out_data, output_filename)
+            resp = results.respond(result_id)
+            _add_compress_headers(resp, compress_stats)
+            return resp
+
+        # lossless
+        from compress_pdfs import compress_lossless
+
+        compress_stats: dict = {}
+        try:
+            out_data = compress_lossless(
+                data, remove_metadata=remove_meta, stats=compress_stats,
+                subset_fonts=request.form.get("subset_fonts") == "on",
+                phase=lambda name: metrics.phase(_COMPRESS_METRIC_PHASES.get(name, name)),
+            )
+        except LimitExceeded as exc:
+            return Response(f"Document exceeds processing limits: {exc}\n", status=422)
+        except ValueError as exc:
+            return Response(f"{exc}\n", status=400)
+        metrics.record_pages(compress_stats["pages"])
+        with metrics.phase("store"):
+            result_id = results.store_pdf(out_data, output_filename)
+        resp = results.respond(result_id)
+        _add_compress_headers(resp, compress_stats)
+        return resp
+    except Exception as exc:
+        return Response(f"Error compressing file: {exc}\n", status=400)
 
-        reader = PdfReader(io.BytesIO(data))
-        if reader.is_encrypted:
-            return Response("Cannot read encrypted PDF without password\n", status=400)
 
-        writer = PdfWriter()
+_split_pool = None
+_split_pool_lock = threading.Lock()
 
-        for page in reader.pages:
-            try:
-                # best-effort lossless content stream compression (if available)
-                if hasattr(page, "compress_content_streams") and algo == "lossless":
-                    page.compress_content_streams()  # type: ignore[attr-defined]
-            except Exception:
-                # continue even if a page fails to compress
-                pass
-            writer.add_page(page)
 
-        if remove_meta:
-            # overwrite metadata with empty dict
-            try:
-                writer.add_metadata({})
-            except Exception:
-                pass
+def _get_split_pool():
+    """Process pool shared by all /split requests of this worker (None: write parts inline)."""
+    global _split_pool
+    jobs = admission.split_jobs()
+    if jobs <= 1:
+        return None
+    with _split_pool_lock:
+        if _split_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # forkserver: workers are not forked from a request thread of a threaded server
+            _split_pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("forkserver"))
+    return _split_pool
+
+
+@app.route("/split", methods=["POST"])
+def split():
+    f = request.files.get("file")
+    if not f:
+        return Response("No file uploaded\n", status=400)
+
+    import shutil
+
+    import split_pdfs
+
+    # 'ranges' (one part per line or ';'), 'every' N pages, or 'size' (largest part, e.g. 25M)
+    mode = request.form.get("mode", "every")
+    options: dict = {}
+    try:
+        if mode == "ranges":
+            text = request.form.get("ranges", "")
+            options["ranges"] = [r for r in text.replace(";", "\n").splitlines() if r.strip()]
+        elif mode == "every":
+            options["every"] = int(request.form.get("every") or 0)
+        elif mode == "size":
+            options["max_bytes"] = split_pdfs.parse_size(request.form.get("max_size", ""))
         else:
-            try:
-                if reader.metadata:
-                    writer.add_metadata(reader.metadata)  # type: ignore[arg-type]
-            except Exception:
-                pass
+            return Response(f"Unknown split mode: {mode}\n", status=400)
+    except ValueError as exc:
+        return Response(f"{exc}\n", status=400)
 
-        out = io.BytesIO()
-        writer.write(out)
-        out.seek(0)
-        return send_file(out, as_attachment=True, download_name=output_filename, mimetype="application/pdf")
-    except Exception as exc:
-        return Response(f"Error compressing file: {exc}\n", status=400)
+    stem = Path(f.filename or "document.pdf").stem or "document"
+    tmpdir = tempfile.mkdtemp(prefix="pdftools-split-")
+    try:
+        src = os.path.join(tmpdir, "input.pdf")
+        with metrics.phase("receive"):
+            f.save(src)
+        with metrics.phase("preflight"):
+            plan = split_pdfs.plan_split(src, **options)
+    except LimitExceeded as exc:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return Response(f"Document exceeds processing limits: {exc}\n", status=422)
+    except ValueError as exc:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return Response(f"Error splitting file: {exc}\n", status=400)
+    metrics.record_pages(sum(len(pages) for pages in plan))
+    # the parts are written while the response streams, after teardown
+    release = admission.detach()
+
+    def generate():
+        # parts are written in parallel and zipped as each one is done;
+        # the archive is never held in memory
+        try:
+            # as many workers as admission charged this request slots for
+            chunks = split_pdfs.write_chunks(
+                src, os.path.join(tmpdir, "parts"), plan, max_bytes=options.get("max_bytes"), prefix=stem,
+                jobs=admission.split_jobs(), pool=_get_split_pool(),
+            )
+            yield from split_pdfs.stream_zip((c.path, os.path.basename(c.path)) for c in chunks)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            release()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(stem)}_split.zip"},
+    )
+
+
+@app.route("/results/<result_id>", methods=["GET"])
+def get_result(result_id: str):
+    """Serve a stored merge/compress result (inline for previews, ?download=1 to save)."""
+    return results.send_result(result_id, as_attachment=request.args.get("download") == "1")
 
 
 # Google Drive integration
@@ -715,17 +988,26 @@ def drive_upload():
     try:
         from google.oauth2.credentials import Credentials
         from googleapiclient.discovery import build
-        from googleapiclient.http import MediaInMemoryUpload
+        from googleapiclient.http import MediaFileUpload, MediaInMemoryUpload
         
         credentials = Credentials(**creds_dict)
         service = build('drive', 'v3', credentials=credentials)
         
-        # Get file from request
-        file_data = request.files.get('file')
-        if not file_data:
-            return jsonify({"error": "No file provided"}), 400
-        
-        filename = request.form.get('filename', file_data.filename or 'document.pdf')
+        # Either a stored result (streamed from disk) or an uploaded file
+        result_id = request.form.get('result_id', '').strip()
+        if result_id:
+            stored = results.get(result_id)
+            if stored is None:
+                return jsonify({"error": "Result not found or expired"}), 404
+            result_path, result_meta = stored
+            filename = request.form.get('filename') or result_meta["filename"]
+            media = MediaFileUpload(str(result_path), mimetype=result_meta["mimetype"], resumable=True)
+        else:
+            file_data = request.files.get('file')
+            if not file_data:
+                return jsonify({"error": "No file provided"}), 400
+            filename = request.form.get('filename', file_data.filename or 'document.pdf')
+            media = MediaInMemoryUpload(file_data.read(), mimetype='application/pdf', resumable=True)
         folder_id = request.form.get('folder_id', '').strip()
         
         # Build file metadata
@@ -733,8 +1015,6 @@ def drive_upload():
         if folder_id:
             file_metadata['parents'] = [folder_id]
         
-        media = MediaInMemoryUpload(file_data.read(), mimetype='application/pdf', resumable=True)
-        
         file = service.files().create(
             body=file_metadata,
             media_body=media,
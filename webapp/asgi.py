@@ -0,0 +1,362 @@
+"""ASGI entry point: asynchronous I/O, PDF work in a process pool.
+
+    pip install uvicorn
+    uvicorn webapp.asgi:application --host 127.0.0.1 --port 5000
+
+The Flask routes are unchanged; this module only decides where they run.
+Request bodies are received by the event loop (a slow upload holds no
+thread or process), counted against ``MAX_CONTENT_LENGTH`` as they arrive
+(chunked ones declare no length), and spooled to memory, or to a temporary
+file past ``ASGI_SPOOL_BYTES``. Then:
+
+* POSTs to the CPU-heavy routes (``ASGI_OFFLOAD_ROUTES``, default /merge,
+  /compress and /edit/add-text) run inside a pool of ``ASGI_WORKERS``
+  processes (default: CPU count), forked after the app is imported, so
+  parse/transform/serialize run in parallel instead of sharing one GIL.
+  Stored results are handed back by path and streamed from here.
+* Everything else (pages, /results with Range support, Drive, the
+  in-memory signature store of /edit, /metrics) runs in a thread of this
+  process, and response bodies are streamed chunk by chunk.
+
+Offloaded requests are added to this process' /metrics, with receive and
+send timed here and the other phases as measured in the worker.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from webapp import metrics
+from webapp.app import app as flask_app
+from webapp.log import logger
+
+DEFAULT_OFFLOAD_ROUTES = ("/merge", "/compress", "/edit/add-text")
+
+# bodies up to this size are kept in memory and pickled to the worker
+SPOOL_BYTES = int(os.environ.get("ASGI_SPOOL_BYTES", 1024 * 1024))
+# each block sent is a hop to a thread and back; Flask asks files for 8 KiB
+_CHUNK = 1024 * 1024
+
+
+def offload_routes() -> frozenset:
+    value = os.environ.get("ASGI_OFFLOAD_ROUTES")
+    if value is None:
+        return frozenset(DEFAULT_OFFLOAD_ROUTES)
+    return frozenset(r.strip() for r in value.split(",") if r.strip())
+
+
+class _FileBody:
+    """wsgi.file_wrapper: marks a response that is a plain file, so it can be sent by path.
+
+    Read in blocks of at least ``_CHUNK``, and seekable, so a Range request
+    skips to its start instead of reading up to it.
+    """
+
+    def __init__(self, file: Any, block_size: int = 8192) -> None:
+        self.file = file
+        self.block_size = max(block_size, _CHUNK)
+
+    def __iter__(self) -> "_FileBody":
+        return self
+
+    def __next__(self) -> bytes:
+        block = self.file.read(self.block_size)
+        if not block:
+            raise StopIteration
+        return block
+
+    def seekable(self) -> bool:
+        return hasattr(self.file, "seek")
+
+    def seek(self, *args: Any) -> None:
+        self.file.seek(*args)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _Body:
+    """A request body being received: bytes in memory, or a named temporary file."""
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.file: Optional[Any] = None
+        self.size = 0
+        self.refused = False
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.file is None and self.size > SPOOL_BYTES:
+            self.file = tempfile.NamedTemporaryFile(prefix="pdftools-upload-", delete=False)
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+        if self.file is not None:
+            self.file.write(data)
+        else:
+            self.buffer += data
+
+    def payload(self) -> Tuple[Optional[bytes], Optional[str]]:
+        """(bytes, None) or (None, path) to rebuild wsgi.input from, in any process."""
+        if self.file is None:
+            return bytes(self.buffer), None
+        self.file.flush()
+        return None, self.file.name
+
+    def discard(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            os.unlink(self.file.name)
+            self.file = None
+        self.buffer = bytearray()
+
+    def refuse(self) -> None:
+        """Past the request limit: drop what was received, keep only its size."""
+        self.discard()
+        self.refused = True
+
+
+def _environ(scope: dict, body_size: Optional[int]) -> Dict[str, Any]:
+    """The picklable part of the WSGI environ for an ASGI http scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ: Dict[str, Any] = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": str(client[0]),
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    if body_size is not None:
+        # a chunked upload has no Content-Length; the WSGI app needs one,
+        # and the body it gets is no longer chunked
+        environ["CONTENT_LENGTH"] = str(body_size)
+        environ.pop("HTTP_TRANSFER_ENCODING", None)
+    return environ
+
+
+def _call_wsgi(environ: Dict[str, Any], data: Optional[bytes], path: Optional[str]) -> Tuple[str, List[Tuple[str, str]], Iterable[bytes]]:
+    stream = io.BytesIO(data or b"") if path is None else open(path, "rb")
+    environ = dict(environ, **{"wsgi.input": stream, "wsgi.errors": sys.stderr, "wsgi.file_wrapper": _FileBody})
+    started: list = []
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None) -> Callable:
+        started[:] = [status, headers]
+        return lambda chunk: None
+
+    body = flask_app(environ, start_response)
+    if path is not None:
+        # the form parser has read everything it needs by now
+        stream.close()
+    return started[0], started[1], body
+
+
+# --- worker processes
+
+_finished: List[dict] = []
+
+
+def _init_worker() -> None:
+    metrics.add_finish_callback(lambda state, status, bytes_out, method: _finished.append(state))
+
+
+def _run_in_worker(environ: Dict[str, Any], data: Optional[bytes], path: Optional[str]) -> dict:
+    """Run one request to completion; the body comes back as bytes or as a file path."""
+    _finished.clear()
+    status, headers, body = _call_wsgi(environ, data, path)
+    result: Dict[str, Any] = {"status": status, "headers": headers, "body": None, "file": None}
+    try:
+        if isinstance(body, _FileBody) and getattr(body.file, "name", None) and body.file.tell() == 0:
+            result["file"] = os.fspath(body.file.name)
+        else:
+            result["body"] = b"".join(body)
+    finally:
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+    result["metrics"] = _finished[-1] if _finished else None
+    return result
+
+
+# --- the ASGI application
+
+
+class Application:
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or int(os.environ.get("ASGI_WORKERS", 0)) or os.cpu_count() or 1
+        self.offload = offload_routes()
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self.pool is None:
+            # forked, not spawned: workers share the imported app and the admission budget's shared memory
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, mp_context=multiprocessing.get_context("fork"),
+            )
+
+    def stop(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.stop)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _receive_body(self, scope: dict, receive: Callable) -> Optional[_Body]:
+        """Read the whole request body; None if the client went away.
+
+        A body past ``MAX_CONTENT_LENGTH`` is not read further; it comes back
+        refused, with its size so far, for Flask to answer 413.
+        """
+        body = _Body()
+        declared = dict(scope.get("headers", [])).get(b"content-length")
+        limit = flask_app.config.get("MAX_CONTENT_LENGTH")
+        if declared is not None and limit and int(declared) > limit:
+            # Flask answers 413 from the header alone; do not read the upload
+            return body
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.discard()
+                return None
+            body.write(message.get("body", b""))
+            if limit and body.size > limit:
+                # chunked, so there was no Content-Length to refuse it by
+                body.refuse()
+                return body
+            if not message.get("more_body", False):
+                return body
+
+    async def _http(self, scope: dict, receive: Callable, send: Callable) -> None:
+        t0 = time.perf_counter()
+        body = await self._receive_body(scope, receive)
+        if body is None:
+            return
+        received = time.perf_counter() - t0
+        chunked = not any(name == b"content-length" for name, _ in scope.get("headers", []))
+        environ = _environ(scope, body.size if chunked and body.size else None)
+        data, path = body.payload()
+        try:
+            if scope["method"] == "POST" and scope["path"] in self.offload and not body.refused:
+                await self._offloaded(environ, data, path, send, t0, received)
+            else:
+                await self._threaded(environ, data, path, send)
+        finally:
+            body.discard()
+
+    async def _threaded(self, environ: dict, data: Optional[bytes], path: Optional[str], send: Callable) -> None:
+        status, headers, body = await asyncio.to_thread(_call_wsgi, environ, data, path)
+        try:
+            await _start(send, status, headers)
+            chunks = iter(body)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                await asyncio.to_thread(close)
+
+    async def _offloaded(
+        self, environ: dict, data: Optional[bytes], path: Optional[str], send: Callable, t0: float, received: float,
+    ) -> None:
+        self.start()
+        pool = self.pool
+        metrics.IN_FLIGHT.inc(1)
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(pool, _run_in_worker, environ, data, path)
+            except Exception as exc:
+                # Flask turns route errors into responses; this is the worker itself failing
+                logger.exception("worker process failed", extra={"route": environ["PATH_INFO"]})
+                if isinstance(exc, BrokenProcessPool) and self.pool is pool:
+                    # a worker died (OOM kill, crash in qpdf): the pool takes no more
+                    # work, so the next request forks a new one
+                    self.pool = None
+                    pool.shutdown(wait=False)
+                await _start(send, "500 INTERNAL SERVER ERROR", [("Content-Type", "text/plain; charset=utf-8")])
+                await send({"type": "http.response.body", "body": b"Internal Server Error\n", "more_body": False})
+                return
+            t_send = time.perf_counter()
+            await _start(send, result["status"], result["headers"])
+            if result["file"] is None:
+                await send({"type": "http.response.body", "body": result["body"], "more_body": False})
+            else:
+                await _send_file(send, result["file"])
+        finally:
+            metrics.IN_FLIGHT.inc(-1)
+        state = result["metrics"]
+        if state is not None:
+            now = time.perf_counter()
+            phases = state["phases"]
+            phases["receive"] = phases.get("receive", 0.0) + received
+            phases["send"] = phases.get("send", 0.0) + now - t_send
+            state["seconds"] = now - t0
+            length = dict((k.lower(), v) for k, v in result["headers"]).get("content-length")
+            metrics.record(state, int(result["status"].split()[0]), int(length) if length else None, environ["REQUEST_METHOD"])
+
+
+async def _start(send: Callable, status: str, headers: List[Tuple[str, str]]) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": int(status.split()[0]),
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+
+
+async def _send_file(send: Callable, path: str) -> None:
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, _CHUNK)
+            if not chunk:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+application = Application()
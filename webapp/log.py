@@ -0,0 +1,148 @@
+"""Structured, non-blocking logging for the webapp.
+
+Records are handed to a ``QueueHandler`` and written by a background
+``QueueListener`` thread, so request threads never block on console I/O.
+Per-request debug records are sampled: the decision is taken once per
+request, so a sampled request logs all of its debug lines and the others
+pay only an ``isEnabledFor`` check.
+
+Environment:
+  LOG_LEVEL               root level for the ``pdftools`` logger (default INFO)
+  LOG_FORMAT              'json' (default) or 'text'
+  LOG_DEBUG_SAMPLE_RATE   fraction of requests whose debug records are kept (default 1.0)
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Optional
+
+from flask import Flask, g, has_request_context, request
+
+logger = logging.getLogger("pdftools")
+
+# attributes every LogRecord has; anything else came in through ``extra=``
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_sample_rate = 1.0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the record's ``extra`` fields inlined."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _build_output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stderr)
+    if os.environ.get("LOG_FORMAT", "json").lower() == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def _start_listener() -> None:
+    global _listener
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    for h in list(logger.handlers):
+        if isinstance(h, logging.handlers.QueueHandler):
+            logger.removeHandler(h)
+    logger.addHandler(logging.handlers.QueueHandler(q))
+    _listener = logging.handlers.QueueListener(q, _build_output_handler(), respect_handler_level=False)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # flushes what is still queued
+        _listener = None
+
+
+def configure() -> None:
+    """Set up the queue handler/listener pair (idempotent)."""
+    global _sample_rate
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+    try:
+        _sample_rate = min(1.0, max(0.0, float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "1.0"))))
+    except ValueError:
+        _sample_rate = 1.0
+    if _listener is None:
+        _start_listener()
+        atexit.register(_stop_listener)
+        if hasattr(os, "register_at_fork"):
+            # the listener thread does not survive fork(); give each worker its own
+            os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork() -> None:
+    global _listener
+    _listener = None
+    _start_listener()
+
+
+def request_debug_enabled() -> bool:
+    """True if debug records for the current request should be emitted."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    if not has_request_context():
+        return True
+    return bool(g.get("_log_sampled", False))
+
+
+def _log_request_finished(state: dict, status: int, bytes_out: Optional[int], method: str) -> None:
+    if not logger.isEnabledFor(logging.DEBUG) or not state.get("log_sampled"):
+        return
+    logger.debug(
+        "request finished",
+        extra={
+            "method": method,
+            "route": state["route"],
+            "status": status,
+            "algorithm": state.get("algorithm") or None,
+            "duration_ms": round((time.perf_counter() - state["start"]) * 1000, 3),
+            "phases_ms": {k: round(v * 1000, 3) for k, v in state["phases"].items()},
+            "bytes_in": state["bytes_in"],
+            "bytes_out": bytes_out,
+            "pages": state.get("pages"),
+        },
+    )
+
+
+def init_app(app: Flask) -> None:
+    """Install per-request sampling and the 'request finished' record."""
+    from webapp import metrics
+
+    configure()
+    metrics.add_finish_callback(_log_request_finished)
+
+    @app.before_request
+    def _log_sample() -> None:
+        if logger.isEnabledFor(logging.DEBUG):
+            sampled = _sample_rate >= 1.0 or random.random() < _sample_rate
+            g._log_sampled = sampled
+            state = g.get("_metrics")
+            if state is not None:
+                state["log_sampled"] = sampled
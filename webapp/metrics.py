@@ -0,0 +1,339 @@
+"""Per-request performance metrics exposed in Prometheus text format.
+
+Every request records its total duration, the time spent in each phase
+(receive, parse, transform, serialize, send), bytes in/out, page count and
+the growth of the process' peak RSS. Routes mark phases with::
+
+    with metrics.phase("parse"):
+        pdf = pikepdf.Pdf.open(...)
+
+and tag the request with ``metrics.set_algorithm(...)`` /
+``metrics.record_pages(...)``. Everything is scraped from ``/metrics``.
+
+The registry is in-process: with several worker processes each one exposes
+its own series (scrape them individually or aggregate in Prometheus).
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, has_request_context, request
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+PHASES = ("receive", "parse", "transform", "serialize", "send")
+
+_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_BYTE_BUCKETS = tuple(float(1024 * 4 ** i) for i in range(11))  # 1 KiB .. 1 GiB
+_PAGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] | None = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = _TIME_BUCKETS) -> None:
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets + (float("inf"),), series[:-2] + [series[-1]]):
+                    labels = _format_labels(self.label_names, key, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """Call `fn()` before each render, e.g. to refresh gauges whose values live elsewhere."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            fn()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "pdftools_request_duration_seconds", "Total request duration including sending the response.",
+    ("route", "method", "status", "algorithm"),
+))
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    "pdftools_request_phase_seconds", "Time spent per request phase (receive, admission, preflight, parse, transform, dedup, serialize, store, send).",
+    ("route", "phase", "algorithm"),
+))
+REQUEST_BYTES = REGISTRY.register(Histogram(
+    "pdftools_request_bytes", "Request body size.", ("route", "algorithm"), _BYTE_BUCKETS,
+))
+RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "pdftools_response_bytes", "Response body size.", ("route", "algorithm"), _BYTE_BUCKETS,
+))
+PAGES = REGISTRY.register(Histogram(
+    "pdftools_request_pages", "Pages processed per request.", ("route", "algorithm"), _PAGE_BUCKETS,
+))
+PEAK_RSS_DELTA = REGISTRY.register(Histogram(
+    "pdftools_request_peak_rss_delta_bytes",
+    "Growth of the process peak RSS while the request ran (0 unless it set a new high-water mark).",
+    ("route", "algorithm"), _BYTE_BUCKETS,
+))
+IN_FLIGHT = REGISTRY.register(Gauge("pdftools_requests_in_flight", "Requests currently being processed."))
+
+
+_finish_callbacks: List[Callable[[dict, int, Optional[int], str], None]] = []
+
+
+def add_finish_callback(fn: Callable[[dict, int, Optional[int], str], None]) -> None:
+    """Call `fn(state, status, bytes_out, method)` whenever a request has been fully sent."""
+    _finish_callbacks.append(fn)
+
+
+def _peak_rss_bytes() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _state() -> Optional[dict]:
+    if not has_request_context():
+        return None
+    return g.get("_metrics")
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block as phase `name` of the current request (no-op outside requests)."""
+    state = _state()
+    if state is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        state["phases"][name] = state["phases"].get(name, 0.0) + time.perf_counter() - t0
+
+
+# routes whose body a later hook pulls in with receive() (see admission.py)
+LAZY_BODY_ROUTES: set = set()
+
+
+def receive() -> None:
+    """Pull a form upload in now, timed as phase "receive"."""
+    if request.mimetype in ("multipart/form-data", "application/x-www-form-urlencoded"):
+        with phase("receive"):
+            request.form
+            request.files
+
+
+def set_algorithm(algorithm: str) -> None:
+    state = _state()
+    if state is not None:
+        state["algorithm"] = algorithm or ""
+
+
+def record_pages(count: int) -> None:
+    state = _state()
+    if state is not None:
+        state["pages"] = state.get("pages", 0) + int(count)
+
+
+def record(state: dict, status: int, bytes_out: Optional[int], method: str) -> None:
+    """Add a finished request's figures ('seconds', 'phases', 'rss_delta'...) to the histograms.
+
+    Also used by webapp.asgi for requests run in a worker process, whose
+    own registry is never scraped.
+    """
+    labels = {"route": state["route"], "algorithm": state.get("algorithm", "")}
+    REQUEST_SECONDS.observe(state["seconds"], method=method, status=str(status), **labels)
+    for name, seconds in state["phases"].items():
+        PHASE_SECONDS.observe(seconds, phase=name, **labels)
+    if state["bytes_in"] is not None:
+        REQUEST_BYTES.observe(state["bytes_in"], **labels)
+    if bytes_out is not None:
+        RESPONSE_BYTES.observe(bytes_out, **labels)
+    if "pages" in state:
+        PAGES.observe(state["pages"], **labels)
+    PEAK_RSS_DELTA.observe(state["rss_delta"], **labels)
+
+
+def _finish(state: dict, status: int, bytes_out: Optional[int], method: str) -> None:
+    state["seconds"] = time.perf_counter() - state["start"]
+    state["rss_delta"] = max(0, _peak_rss_bytes() - state["rss_start"])
+    record(state, status, bytes_out, method)
+    IN_FLIGHT.inc(-1)
+    for fn in _finish_callbacks:
+        fn(state, status, bytes_out, method)
+
+
+def _chain_close(body: object, callback: Callable[[], None]) -> None:
+    close = getattr(body, "close", None)
+
+    def _close() -> None:
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+    body.close = _close  # type: ignore[attr-defined]
+
+
+def init_app(app: Flask) -> None:
+    """Install the request hooks and the /metrics endpoint on `app`."""
+
+    @app.before_request
+    def _metrics_start() -> None:
+        IN_FLIGHT.inc(1)
+        g._metrics = {
+            "start": time.perf_counter(),
+            "route": request.url_rule.rule if request.url_rule else "unmatched",
+            "phases": {},
+            "bytes_in": request.content_length,
+            "rss_start": _peak_rss_bytes(),
+            "finished": False,
+        }
+        # Pull the upload in here so the route's own timings exclude it.
+        if g._metrics["route"] not in LAZY_BODY_ROUTES:
+            receive()
+
+    @app.after_request
+    def _metrics_send(response: Response) -> Response:
+        state = _state()
+        if state is None or state["finished"]:
+            return response
+        state["finished"] = True
+        method, status, bytes_out = request.method, response.status_code, response.content_length
+        t_send = time.perf_counter()
+
+        def _on_close() -> None:
+            state["phases"]["send"] = time.perf_counter() - t_send
+            _finish(state, status, bytes_out, method)
+
+        if response.direct_passthrough:
+            # werkzeug hands passthrough bodies (send_file) to the server as-is
+            # and never runs call_on_close callbacks for them
+            body = response.response
+            file_wrapper = request.environ.get("wsgi.file_wrapper")
+            if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+                # keep the server's own wrapper so it can still use sendfile()
+                _chain_close(body, _on_close)
+            else:
+                response.response = ClosingIterator(body, _on_close)
+        else:
+            response.call_on_close(_on_close)
+        return response
+
+    @app.teardown_request
+    def _metrics_abort(exc: Optional[BaseException]) -> None:
+        # after_request is skipped for unhandled exceptions; still count the request
+        state = _state()
+        if state is not None and not state["finished"]:
+            state["finished"] = True
+            _finish(state, 500, None, request.method)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint() -> Response:
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
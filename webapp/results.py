@@ -0,0 +1,205 @@
+"""On-disk store for generated PDFs.
+
+Results are written once, linearized ("fast web view"), and served from the
+file with ``Accept-Ranges``/``Range``, ``ETag`` and conditional-request
+support, so a browser viewer can show page 1 of a large merge after fetching
+only the first part of the file. Downloads, previews and Drive uploads all
+read the same stored file by id instead of re-running or re-sending the
+operation. Files are served by path, so the WSGI server can use its
+``wsgi.file_wrapper`` (sendfile) or hand them to the front-end proxy with
+``USE_X_SENDFILE``.
+
+Environment:
+  RESULTS_DIR         directory for stored results (default: <tmp>/pdftools-results)
+  RESULTS_TTL         seconds a result is kept (default 3600)
+  RESULTS_MAX_BYTES   total size cap; the oldest results are evicted first (default 2 GiB)
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from flask import Response, jsonify, request, send_file, url_for
+
+from webapp.log import logger
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def ttl_seconds() -> float:
+    return float(os.environ.get("RESULTS_TTL", "3600"))
+
+
+def max_bytes() -> int:
+    return int(os.environ.get("RESULTS_MAX_BYTES", str(2 * 1024 ** 3)))
+
+
+def results_dir() -> Path:
+    path = Path(os.environ.get("RESULTS_DIR") or Path(tempfile.gettempdir()) / "pdftools-results")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _linearize(data: bytes) -> bytes:
+    import pikepdf
+
+    out = io.BytesIO()
+    with pikepdf.Pdf.open(io.BytesIO(data)) as pdf:
+        # keep whatever object stream layout the result already has
+        pdf.save(out, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.preserve)
+    return out.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".part")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(base: Path, result_id: str) -> None:
+    for suffix in (".pdf", ".json"):
+        (base / f"{result_id}{suffix}").unlink(missing_ok=True)
+
+
+def _age(path: Path, now: float) -> float:
+    try:
+        return now - path.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def cleanup(reserve: int = 0, now: Optional[float] = None) -> int:
+    """Drop expired results, then the oldest ones until `reserve` more bytes fit.
+
+    Returns the number of results removed.
+    """
+    base = results_dir()
+    now = time.time() if now is None else now
+    ttl = ttl_seconds()
+    entries = []
+    removed = 0
+    for meta_path in base.glob("*.json"):
+        result_id = meta_path.stem
+        try:
+            created = json.loads(meta_path.read_text())["created"]
+            size = (base / f"{result_id}.pdf").stat().st_size
+        except (OSError, ValueError, KeyError):
+            # half-written or already removed by another worker
+            if _age(meta_path, now) > ttl:
+                _remove(base, result_id)
+            continue
+        if now - created > ttl:
+            _remove(base, result_id)
+            removed += 1
+        else:
+            entries.append((created, result_id, size))
+    for part in base.glob("*.part"):
+        if _age(part, now) > ttl:
+            part.unlink(missing_ok=True)
+
+    total = sum(size for _, _, size in entries) + reserve
+    for _, result_id, size in sorted(entries):
+        if total <= max_bytes():
+            break
+        _remove(base, result_id)
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("results cleaned up", extra={"removed": removed})
+    return removed
+
+
+def store_pdf(data: bytes, filename: str, linearize: bool = True) -> str:
+    """Write `data` to the store (linearized unless told otherwise); returns its id."""
+    if linearize:
+        try:
+            data = _linearize(data)
+        except Exception:
+            # still serve the result, just without fast web view
+            logger.warning("could not linearize result", exc_info=True)
+    cleanup(reserve=len(data))
+    result_id = uuid.uuid4().hex
+    base = results_dir()
+    _write_atomic(base / f"{result_id}.pdf", data)
+    meta = {"filename": filename, "mimetype": "application/pdf", "size": len(data), "created": time.time()}
+    _write_atomic(base / f"{result_id}.json", json.dumps(meta).encode())
+    return result_id
+
+
+def get(result_id: str) -> Optional[tuple[Path, dict]]:
+    """(path, metadata) of a stored result, or None if unknown."""
+    if not _ID_RE.match(result_id or ""):
+        return None
+    base = results_dir()
+    path = base / f"{result_id}.pdf"
+    try:
+        meta = json.loads((base / f"{result_id}.json").read_text())
+    except (OSError, ValueError):
+        return None
+    if not path.is_file() or time.time() - meta["created"] > ttl_seconds():
+        return None
+    return path, meta
+
+
+def wants_json() -> bool:
+    """True if the client asked for the result id instead of the file."""
+    best = request.accept_mimetypes.best_match(["application/pdf", "application/json"])
+    return best == "application/json" and request.accept_mimetypes[best] > request.accept_mimetypes["application/pdf"]
+
+
+def describe(result_id: str) -> Optional[dict]:
+    """JSON description of a stored result for API clients and the web pages, or None if unknown."""
+    found = get(result_id)
+    if found is None:
+        return None
+    _, meta = found
+    url = url_for("get_result", result_id=result_id)
+    return {
+        "result_id": result_id,
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "url": url,
+        "download_url": url + "?download=1",
+        "expires_in": max(0, int(meta["created"] + ttl_seconds() - time.time())),
+    }
+
+
+def respond(result_id: str) -> Response:
+    """Answer a POST that produced `result_id`: its JSON description or the file."""
+    if wants_json():
+        info = describe(result_id)
+        if info is None:
+            # removed by cleanup (another request's quota) since it was stored
+            resp = jsonify({"error": "Result not found or expired"})
+            resp.status_code = 404
+            return resp
+        resp = jsonify(info)
+        resp.headers["X-Result-Id"] = result_id
+        return resp
+    return send_result(result_id)
+
+
+def send_result(result_id: str, as_attachment: bool = True) -> Response:
+    """Serve a stored result with Range/ETag/conditional-request support."""
+    found = get(result_id)
+    if found is None:
+        return Response("Result not found or expired\n", status=404)
+    path, meta = found
+    resp = send_file(
+        path,
+        mimetype=meta["mimetype"],
+        as_attachment=as_attachment,
+        download_name=meta["filename"],
+        conditional=True,
+        etag=True,
+    )
+    resp.headers["X-Result-Id"] = result_id
+    return resp
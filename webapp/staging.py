@@ -0,0 +1,183 @@
+"""Staged uploads: files uploaded once and merged many times.
+
+A file is stored under the SHA-256 of its content, which is also its id.
+A client that already knows the hash asks ``HEAD /staging/<id>`` first and
+only uploads (``POST /staging``) what the server does not have; ``/merge``
+and ``/merge/plan`` then take an ordered list of ids (form field
+``staged``) instead of files, so changing the order or the resize options
+re-sends a few bytes instead of every file.
+
+Every use refreshes a file's expiry. Files expire ``STAGING_TTL`` seconds
+after their last use, and the least recently used are evicted first when
+the store would exceed its quota. The quota also holds room for the
+resumable uploads in progress (``uploads.py``).
+
+Environment:
+  STAGING_DIR        directory for staged files (default: <tmp>/pdftools-staging)
+  STAGING_TTL        seconds a file is kept after its last use (default 3600)
+  STAGING_MAX_BYTES  total size cap (default 2 GiB)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from webapp.log import logger
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+_CHUNK = 1024 * 1024
+# resumable uploads in progress (uploads.py), whose declared sizes are reserved in the quota
+UPLOADS_SUBDIR = "uploads"
+
+
+class QuotaExceeded(ValueError):
+    """The file is larger than the whole staging quota."""
+
+
+def ttl_seconds() -> float:
+    return float(os.environ.get("STAGING_TTL", "3600"))
+
+
+def max_bytes() -> int:
+    return int(os.environ.get("STAGING_MAX_BYTES", str(2 * 1024 ** 3)))
+
+
+def staging_dir() -> Path:
+    path = Path(os.environ.get("STAGING_DIR") or Path(tempfile.gettempdir()) / "pdftools-staging")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _remove(base: Path, staged_id: str) -> None:
+    for suffix in (".pdf", ".json"):
+        (base / f"{staged_id}{suffix}").unlink(missing_ok=True)
+
+
+def reserved_bytes() -> int:
+    """Bytes declared by the resumable uploads in progress."""
+    total = 0
+    for meta in (staging_dir() / UPLOADS_SUBDIR).glob("*/meta.json"):
+        try:
+            total += json.loads(meta.read_text())["size"]
+        except (OSError, ValueError, KeyError):
+            continue
+    return total
+
+
+def cleanup(reserve: int = 0, now: Optional[float] = None) -> int:
+    """Drop expired files, then the least recently used until `reserve` more bytes fit.
+
+    Returns the number of files removed.
+    """
+    base = staging_dir()
+    now = time.time() if now is None else now
+    ttl = ttl_seconds()
+    entries = []
+    removed = 0
+    for path in base.glob("*.pdf"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        if now - st.st_mtime > ttl:
+            _remove(base, path.stem)
+            removed += 1
+        else:
+            entries.append((st.st_mtime, path.stem, st.st_size))
+    for part in base.glob("*.part"):
+        try:
+            if now - part.stat().st_mtime > ttl:
+                part.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+
+    total = sum(size for _, _, size in entries) + reserve + reserved_bytes()
+    for _, staged_id, size in sorted(entries):
+        if total <= max_bytes():
+            break
+        _remove(base, staged_id)
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("staged files cleaned up", extra={"removed": removed})
+    return removed
+
+
+def stage(stream: BinaryIO, filename: str) -> str:
+    """Store the content of `stream` (hashed while it is copied to disk); returns its id.
+
+    Raises QuotaExceeded for a file larger than the whole quota.
+    """
+    base = staging_dir()
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=base, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = stream.read(_CHUNK)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                size += len(block)
+        if size > max_bytes():
+            raise QuotaExceeded(f"File is larger than the staging quota ({max_bytes()} bytes)")
+        return adopt(tmp, digest.hexdigest(), filename, size)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def adopt(path: str | Path, staged_id: str, filename: str, size: int) -> str:
+    """Move the file at `path` (on the staging filesystem), whose SHA-256 is `staged_id`, into the store.
+
+    When that content is staged already, `path` is left where it is.
+    """
+    if touch(staged_id):
+        # already staged, by this client or another one
+        return staged_id
+    base = staging_dir()
+    cleanup(reserve=size)
+    meta = {"filename": filename, "size": size, "created": time.time()}
+    meta_tmp = base / f"{staged_id}.json.part"
+    meta_tmp.write_text(json.dumps(meta))
+    os.replace(meta_tmp, base / f"{staged_id}.json")
+    os.replace(path, base / f"{staged_id}.pdf")
+    return staged_id
+
+
+def touch(staged_id: str) -> bool:
+    """Refresh the expiry of a staged file; False if it is unknown or expired."""
+    return get(staged_id) is not None
+
+
+def get(staged_id: str) -> Optional[tuple[Path, dict]]:
+    """(path, metadata) of a staged file, refreshing its expiry; None if unknown or expired."""
+    if not _ID_RE.match(staged_id or ""):
+        return None
+    base = staging_dir()
+    path = base / f"{staged_id}.pdf"
+    try:
+        if time.time() - path.stat().st_mtime > ttl_seconds():
+            return None
+        meta = json.loads((base / f"{staged_id}.json").read_text())
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return path, meta
+
+
+def describe(staged_id: str) -> Optional[dict]:
+    """JSON description of a staged file for API clients, or None if unknown."""
+    found = get(staged_id)
+    if found is None:
+        return None
+    _, meta = found
+    return {"id": staged_id, "filename": meta["filename"], "size": meta["size"], "expires_in": int(ttl_seconds())}
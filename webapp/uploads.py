@@ -0,0 +1,325 @@
+"""Resumable uploads: large files sent in chunks, then staged.
+
+A single request is capped by ``MAX_CONTENT_LENGTH`` and a dropped
+connection loses all of it. Here a client declares the file first
+(``POST /uploads``), sends it in chunks at byte offsets, in any order and in
+parallel (``PUT /uploads/<id>?offset=N``), asks which ranges arrived after a
+failure (``GET /uploads/<id>``) and sends only the rest, then finalizes it
+(``POST /uploads/<id>/finalize``). The finalized file becomes a staged file
+(see ``staging.py``) that /merge and /compress take by id, so it is never
+held in memory as one request body.
+
+Each chunk must carry a ``Content-Digest: sha-256=:<base64>:`` header
+(RFC 9530), unless the SHA-256 of the whole file was declared at creation.
+A chunk is received into a scratch file and checked there. Only then is it
+kept, as its own file named after its byte range and digest. A chunk that
+overlaps one already kept is refused, except an identical resend. So a bad
+or late PUT can never change bytes that were already verified. Finalizing
+joins the chunks, checks each one against its digest again, and checks the
+whole file against its declared SHA-256, if there is one.
+
+Uploads share the staging store's directory and TTL (counted from the last
+chunk). Their declared sizes are reserved in its quota from creation on.
+Environment:
+  UPLOAD_CHUNK_BYTES      chunk size suggested to clients (default 8 MiB)
+  UPLOAD_MAX_CHUNK_BYTES  largest chunk accepted (default 64 MiB)
+  UPLOAD_MAX_ACTIVE       uploads in progress at once (default 16)
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from webapp import staging
+from webapp.log import logger
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+_CHUNK_RE = re.compile(r"^(\d+)-(\d+)\.([0-9a-f]{64})$")
+_BLOCK = 1024 * 1024
+
+
+class UnknownUpload(LookupError):
+    """No such upload, or it expired."""
+
+
+class ChecksumMismatch(ValueError):
+    """Content does not match the digest sent with it."""
+
+
+class Incomplete(ValueError):
+    """Finalized before every byte arrived."""
+
+
+class Conflict(ValueError):
+    """A chunk overlaps bytes already received with other content."""
+
+
+def chunk_bytes() -> int:
+    return int(os.environ.get("UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+
+
+def max_chunk_bytes() -> int:
+    return int(os.environ.get("UPLOAD_MAX_CHUNK_BYTES", str(64 * 1024 * 1024)))
+
+
+def max_active() -> int:
+    return int(os.environ.get("UPLOAD_MAX_ACTIVE", "16"))
+
+
+def uploads_dir() -> Path:
+    # inside the staging directory: finalizing is a rename on the same filesystem
+    path = staging.staging_dir() / staging.UPLOADS_SUBDIR
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@contextlib.contextmanager
+def _locked(directory: Path) -> Iterator[None]:
+    """Exclusive lock on `directory`, held across processes."""
+    with open(directory / ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def parse_digest(header: Optional[str]) -> Optional[bytes]:
+    """The SHA-256 in a ``Content-Digest`` header; None when it has none.
+
+    Raises ValueError for a malformed sha-256 entry.
+    """
+    for entry in (header or "").split(","):
+        name, _, value = entry.strip().partition("=")
+        if name.strip().lower() != "sha-256":
+            continue
+        value = value.strip()
+        if not (len(value) >= 2 and value[0] == value[-1] == ":"):
+            raise ValueError("Content-Digest sha-256 must be a byte sequence (:base64:)")
+        try:
+            digest = base64.b64decode(value[1:-1], validate=True)
+        except binascii.Error:
+            raise ValueError("Content-Digest sha-256 is not valid base64") from None
+        if len(digest) != 32:
+            raise ValueError("Content-Digest sha-256 must be 32 bytes")
+        return digest
+    return None
+
+
+def _path(upload_id: str) -> Path:
+    if not _ID_RE.match(upload_id or ""):
+        raise UnknownUpload(upload_id)
+    path = uploads_dir() / upload_id
+    if not (path / "meta.json").exists():
+        raise UnknownUpload(upload_id)
+    return path
+
+
+def _meta(path: Path) -> dict:
+    try:
+        return json.loads((path / "meta.json").read_text())
+    except FileNotFoundError:
+        raise UnknownUpload(path.name) from None
+
+
+def cleanup(now: Optional[float] = None) -> int:
+    """Drop uploads without a chunk for longer than the staging TTL; returns how many."""
+    now = time.time() if now is None else now
+    ttl = staging.ttl_seconds()
+    removed = 0
+    for path in uploads_dir().iterdir():
+        try:
+            if path.is_dir() and now - path.stat().st_mtime > ttl:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logger.info("abandoned uploads cleaned up", extra={"removed": removed})
+    return removed
+
+
+def create(filename: str, size: int, sha256: Optional[str] = None) -> dict:
+    """Start an upload of `size` bytes; returns its status.
+
+    Raises ValueError for a bad size or digest, staging.QuotaExceeded when
+    the uploads in progress leave no room for `size` bytes or there are
+    already UPLOAD_MAX_ACTIVE of them.
+    """
+    if size <= 0:
+        raise ValueError("size must be a positive number of bytes")
+    if sha256 is not None and not _SHA256_RE.match(sha256):
+        raise ValueError("sha256 must be 64 lowercase hex digits")
+    cleanup()
+    base = uploads_dir()
+    with _locked(base):
+        active = sum(1 for meta in base.glob("*/meta.json"))
+        if active >= max_active():
+            raise staging.QuotaExceeded(f"Too many uploads in progress ({active}); retry later")
+        if staging.reserved_bytes() + size > staging.max_bytes():
+            raise staging.QuotaExceeded(f"Not enough room in the staging quota ({staging.max_bytes()} bytes)")
+        upload_id = uuid.uuid4().hex
+        path = base / upload_id
+        (path / "chunks").mkdir(parents=True)
+        meta = {"filename": filename, "size": size, "sha256": sha256, "created": time.time()}
+        # written last: an upload exists, and its size is reserved, once its metadata does
+        (path / "meta.json.part").write_text(json.dumps(meta))
+        os.replace(path / "meta.json.part", path / "meta.json")
+    # make room now, evicting staged files, rather than when it completes
+    staging.cleanup()
+    return status(upload_id)
+
+
+def _chunks(path: Path) -> List[Tuple[int, int, str]]:
+    """(start, end, sha256 hex) of the chunks kept so far, sorted."""
+    found = []
+    for chunk in (path / "chunks").iterdir():
+        m = _CHUNK_RE.match(chunk.name)
+        if m:
+            found.append((int(m.group(1)), int(m.group(2)), m.group(3)))
+    return sorted(found)
+
+
+def _received(path: Path) -> List[List[int]]:
+    """Byte ranges [start, end) received so far, merged."""
+    merged: List[List[int]] = []
+    for start, end, _ in _chunks(path):
+        if merged and start == merged[-1][1]:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def status(upload_id: str) -> dict:
+    """JSON description of an upload: which ranges arrived, and whether all did."""
+    path = _path(upload_id)
+    meta = _meta(path)
+    received = _received(path)
+    size = meta["size"]
+    return {
+        "id": upload_id,
+        "filename": meta["filename"],
+        "size": size,
+        "received": received,
+        # where a sequential client resumes
+        "offset": received[0][1] if received and received[0][0] == 0 else 0,
+        "complete": received == [[0, size]],
+        "chunk_size": chunk_bytes(),
+        "max_chunk_size": max_chunk_bytes(),
+        "expires_in": int(staging.ttl_seconds()),
+    }
+
+
+def write_chunk(
+    upload_id: str, offset: int, stream: BinaryIO, length: Optional[int], sha256: Optional[bytes] = None,
+) -> dict:
+    """Receive the chunk read from `stream` for `offset`; returns the upload's status.
+
+    `length` is the declared chunk length (None: read to the end of the
+    stream). The chunk is kept only when all of it arrived, it matches
+    `sha256` and it overlaps nothing received before (Conflict otherwise;
+    resending a kept chunk unchanged is fine). A failed chunk is simply
+    sent again.
+    """
+    path = _path(upload_id)
+    meta = _meta(path)
+    size = meta["size"]
+    if sha256 is None and meta["sha256"] is None:
+        raise ValueError("Chunks need a Content-Digest sha-256 when the file's sha256 was not declared")
+    if length is not None and length > max_chunk_bytes():
+        raise ValueError(f"Chunk is larger than {max_chunk_bytes()} bytes")
+    if offset < 0 or offset + (length or 0) > size:
+        raise ValueError(f"Chunk at {offset} ({length} bytes) is outside the {size} bytes of the upload")
+
+    digest = hashlib.sha256()
+    written = 0
+    fd, scratch = tempfile.mkstemp(dir=path / "chunks", prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = stream.read(_BLOCK)
+                if not block:
+                    break
+                written += len(block)
+                if offset + written > size or written > max_chunk_bytes():
+                    raise ValueError(f"Chunk at {offset} runs past the {size} bytes of the upload")
+                digest.update(block)
+                f.write(block)
+        if length is not None and written != length:
+            raise ValueError(f"Chunk at {offset} is incomplete: {written} of {length} bytes arrived")
+        if sha256 is not None and digest.digest() != sha256:
+            raise ChecksumMismatch(f"Chunk at {offset} does not match its Content-Digest")
+        end = offset + written
+        if written:
+            with _locked(path):
+                for start, stop, kept in _chunks(path):
+                    if start == offset and stop == end and kept == digest.hexdigest():
+                        break  # the same chunk again, after a lost response
+                    if start < end and offset < stop:
+                        raise Conflict(f"Chunk {offset}-{end} overlaps bytes {start}-{stop} already received")
+                else:
+                    os.replace(scratch, path / "chunks" / f"{offset}-{end}.{digest.hexdigest()}")
+    finally:
+        if os.path.exists(scratch):
+            os.unlink(scratch)
+    # the TTL runs from the last chunk
+    os.utime(path)
+    return status(upload_id)
+
+
+def finalize(upload_id: str, sha256: Optional[str] = None) -> str:
+    """Join a complete upload's chunks into a staged file; returns its staged id.
+
+    Raises Incomplete while ranges are missing, and ChecksumMismatch when a
+    chunk no longer matches its digest (that chunk is dropped, to be sent
+    again) or the file does not match the SHA-256 given here or at creation
+    (the upload is discarded).
+    """
+    path = _path(upload_id)
+    with _locked(path):
+        meta = _meta(path)
+        info = status(upload_id)
+        if not info["complete"]:
+            missing = info["size"] - sum(end - start for start, end in info["received"])
+            raise Incomplete(f"{missing} of {info['size']} bytes have not arrived yet")
+        digest = hashlib.sha256()
+        with open(path / "data", "wb") as out:
+            for start, end, kept in _chunks(path):
+                chunk = path / "chunks" / f"{start}-{end}.{kept}"
+                check = hashlib.sha256()
+                with open(chunk, "rb") as f:
+                    for block in iter(lambda: f.read(_BLOCK), b""):
+                        check.update(block)
+                        digest.update(block)
+                        out.write(block)
+                if check.hexdigest() != kept:
+                    chunk.unlink()
+                    raise ChecksumMismatch(f"Bytes {start}-{end} were damaged on the server; send them again")
+        staged_id = digest.hexdigest()
+        expected = sha256 or meta["sha256"]
+        if expected and expected.lower() != staged_id:
+            shutil.rmtree(path, ignore_errors=True)
+            raise ChecksumMismatch("The uploaded file does not match its SHA-256; upload it again")
+        # no longer reserved: the staged file takes its place in the quota
+        (path / "meta.json").unlink()
+        staging.adopt(path / "data", staged_id, meta["filename"], meta["size"])
+    shutil.rmtree(path, ignore_errors=True)
+    return staged_id
+
+
+def abort(upload_id: str) -> None:
+    shutil.rmtree(_path(upload_id), ignore_errors=True)
@@ -0,0 +1,99 @@
+"""Pre-import and warm the heavy PDF/imaging libraries.
+
+The routes import PyPDF2, reportlab, Pillow, pikepdf and the Google client
+libraries lazily, so without warming the first request of each kind pays
+for the import (and for first-use work such as loading font metrics or
+codec plugins). Calling :func:`warm` in the gunicorn master before it forks
+(``preload_app``) moves that cost to startup and lets every worker share
+the loaded modules copy-on-write.
+"""
+from __future__ import annotations
+
+import importlib
+import io
+import time
+from typing import Dict, Optional
+
+from flask import Flask
+
+from webapp.log import logger
+
+# (module, required): optional modules are skipped when not installed
+HEAVY_MODULES = (
+    ("PyPDF2", True),
+    ("pikepdf", True),
+    ("PIL.Image", True),
+    ("reportlab.pdfgen.canvas", True),
+    ("google.oauth2.credentials", False),
+    ("google_auth_oauthlib.flow", False),
+    ("googleapiclient.discovery", False),
+    ("googleapiclient.http", False),
+)
+
+
+def preload() -> Dict[str, float]:
+    """Import the heavy modules; returns seconds spent per module."""
+    timings: Dict[str, float] = {}
+    for name, required in HEAVY_MODULES:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            if required:
+                raise
+            continue
+        timings[name] = time.perf_counter() - t0
+    return timings
+
+
+def _exercise() -> None:
+    """Run each library once on a tiny document so first-use setup is done."""
+    from PIL import Image
+    from PyPDF2 import PdfReader, PdfWriter
+    from reportlab.pdfgen import canvas
+    import pikepdf
+
+    # reportlab: loads Helvetica metrics used by add-text / add-signature
+    overlay = io.BytesIO()
+    c = canvas.Canvas(overlay, pagesize=(100, 100))
+    c.setFont("Helvetica", 9)
+    c.drawCentredString(50, 50, "warmup")
+    c.save()
+
+    # PyPDF2: parse, merge an overlay, write
+    reader = PdfReader(io.BytesIO(overlay.getvalue()))
+    writer = PdfWriter()
+    page = reader.pages[0]
+    page.merge_page(PdfReader(io.BytesIO(overlay.getvalue())).pages[0])
+    writer.add_page(page)
+    writer.write(io.BytesIO())
+
+    # pikepdf: open and save with the options /compress uses
+    with pikepdf.Pdf.open(io.BytesIO(overlay.getvalue())) as pdf:
+        pdf.save(io.BytesIO(), compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+    # Pillow: registers the PNG/JPEG plugins on first use
+    img = Image.new("RGB", (8, 8))
+    for fmt in ("PNG", "JPEG"):
+        buf = io.BytesIO()
+        img.save(buf, format=fmt)
+        buf.seek(0)
+        Image.open(buf).load()
+
+
+def warm(app: Optional[Flask] = None) -> Dict[str, float]:
+    """Preload and exercise the heavy modules (and compile `app`'s templates).
+
+    Returns per-step timings in seconds.
+    """
+    timings = preload()
+    t0 = time.perf_counter()
+    _exercise()
+    timings["exercise"] = time.perf_counter() - t0
+    if app is not None:
+        t0 = time.perf_counter()
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)  # compiled once, kept in jinja's cache
+        timings["templates"] = time.perf_counter() - t0
+    logger.info("warmup done", extra={"warmup_ms": {k: round(v * 1000, 1) for k, v in timings.items()}})
+    return timings